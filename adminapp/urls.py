@@ -3,7 +3,8 @@ from django.urls import path
 from adminapp.views import AdminIndexView, AdminShowUsersView, AdminCreateUserView, AdminUserDeleteView, AdminUserUpdateView, \
     AdminCategoryView, \
     AdminCategoryUpdateView, AdminCategoryDeleteView, AdminCategoryCreateView, AdminProductsShowView, \
-    AdminProductCreateView, AdminProductChangeView, AdminProductDeleteView
+    AdminProductCreateView, AdminProductChangeView, AdminProductDeleteView, AdminCatalogExportView, \
+    AdminSalesView
 
 app_name = 'adminapp'
 urlpatterns = [
@@ -20,4 +21,6 @@ urlpatterns = [
     path('admin_product_create/', AdminProductCreateView.as_view(), name='admin_product_create'),
     path('admin_product_update/<int:pk>/', AdminProductChangeView.as_view(), name='admin_product_update'),
     path('admin_product_delete/<int:pk>/', AdminProductDeleteView.as_view(), name='admin_product_delete'),
+    path('catalog_export/', AdminCatalogExportView.as_view(), name='catalog_export'),
+    path('sales/', AdminSalesView.as_view(), name='sales'),
 ]
\ No newline at end of file
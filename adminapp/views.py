@@ -1,15 +1,20 @@
+from datetime import date, timedelta
+
 from django.contrib import messages
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, StreamingHttpResponse, Http404
 from django.shortcuts import render
 
 from django.urls import reverse, reverse_lazy
-from django.views.generic import DetailView, ListView, DeleteView, UpdateView, CreateView, TemplateView
+from django.utils import timezone
+from django.views.generic import DetailView, ListView, DeleteView, UpdateView, CreateView, TemplateView, View
 
 from adminapp.forms import UserAdminRegisterForm, AdminUserChange, AdminCategoryChange, \
     AdminProductCreate
 from adminapp.mixin import AdminContextMixin, SuperuserDispatchMixin
 from authapp.models import User
+from mainapp.export import EXPORT_FORMATS, export_catalog, export_filename
 from mainapp.models import ProductCategory, Products
+from ordersapp.sales import sales_report
 
 
 class AdminIndexView(TemplateView, SuperuserDispatchMixin, AdminContextMixin):
@@ -334,7 +339,7 @@ class AdminProductDeleteView(DeleteView, SuperuserDispatchMixin, AdminContextMix
     def post(self, request, *args, **kwargs):
         self.object = self.get_object()
         self.object.is_active = False
-        self.object.save()
+        self.object.save(update_fields=['is_active'])
 
         return HttpResponseRedirect(self.success_url)
 
@@ -347,3 +352,52 @@ class AdminProductDeleteView(DeleteView, SuperuserDispatchMixin, AdminContextMix
 #     product_select.save()
 #
 #     return HttpResponseRedirect(reverse('adminapp:admin_products_show'))
+
+
+class AdminCatalogExportView(SuperuserDispatchMixin, View):
+    """
+    Потоковая выгрузка каталога: ?format=csv|jsonl, ?gzip=1 - сжатие на лету, ?active=1 - только активные.
+    Ответ отдается по мере чтения из БД, весь каталог в памяти не собирается
+    """
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            raise Http404(f'Неизвестный формат: {export_format}')
+        compress = request.GET.get('gzip') == '1'
+        response = StreamingHttpResponse(
+            export_catalog(export_format, compress, active_only=request.GET.get('active') == '1'),
+            content_type='application/gzip' if compress else f'{EXPORT_FORMATS[export_format]}; charset=utf-8',
+        )
+        filename = export_filename(export_format, compress, timezone.localdate())
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class AdminSalesView(TemplateView, SuperuserDispatchMixin, AdminContextMixin):
+    """
+    Продажи по категориям и лучшие товары за период ?from=ГГГГ-ММ-ДД&to=ГГГГ-ММ-ДД (по умолчанию - 30 дней).
+    Читает только дневные агрегаты (ordersapp.sales), позиции заказов не сканируются
+    """
+    template_name = 'adminapp/admin_sales.html'
+    title = 'Продажи'
+    top_products = 20
+
+    def get_period(self):
+        try:
+            date_to = date.fromisoformat(self.request.GET['to']) if self.request.GET.get('to') \
+                else timezone.localdate()
+            date_from = date.fromisoformat(self.request.GET['from']) if self.request.GET.get('from') \
+                else date_to - timedelta(days=29)
+        except ValueError:
+            raise Http404('Неверная дата')
+        return date_from, date_to
+
+    def get_context_data(self, **kwargs):
+        context = super(AdminSalesView, self).get_context_data(**kwargs)
+        date_from, date_to = self.get_period()
+        context['date_from'], context['date_to'] = date_from, date_to
+        context['categories'] = sales_report(date_from, date_to, 'category')
+        context['products'] = sales_report(date_from, date_to, 'product')[:self.top_products]
+        context['days'] = sales_report(date_from, date_to, 'category', daily=True)
+        return context
@@ -0,0 +1,320 @@
+"""
+Хранилища корзины. Все представления корзины работают через get_basket_backend(request):
+
+- DatabaseBasketBackend - строки Basket, товар резервируется на складе сразу при добавлении;
+- CacheBasketBackend - корзина пользователя в кеше как {id товара: количество}, без строк Basket
+  и без резерва. В строки Basket (с резервом) корзина переносится только при оформлении заказа - checkout();
+- SessionBasketBackend - то же в сессии, для анонимных посетителей. При входе переносится
+  в хранилище пользователя (сигнал user_logged_in).
+
+Для пользователей хранилище выбирается настройкой BASKET_BACKEND ('db' или 'cache').
+У хранилищ в кеше и сессии id строки корзины - это id товара.
+"""
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import cached_property
+
+from basketapp.models import Basket
+from basketapp.summary import BasketSummary
+from mainapp.models import Products
+from mainapp.stock import OutOfStock
+
+SESSION_BASKET_KEY = 'basket'
+BASKET_CACHE_TIMEOUT = 14 * 24 * 60 * 60
+
+
+class BasketBusy(Exception):
+    """Корзину сейчас изменяет другой запрос того же пользователя"""
+
+
+class BasketBackend:
+    """Интерфейс хранилища корзины"""
+
+    def add(self, product_id, quantity=1):
+        """Добавляет товар. DatabaseBasketBackend выбрасывает stock.OutOfStock, если товара не хватает"""
+        raise NotImplementedError
+
+    def set_quantities(self, quantities):
+        """
+        Устанавливает количества {id строки: количество} (0 - удалить строку).
+        Возвращает {id строки: количество} для найденных строк
+        """
+        raise NotImplementedError
+
+    def remove(self, line_id):
+        self.set_quantities({line_id: 0})
+
+    def get_quantities(self, line_ids):
+        """Текущие количества строк {id строки: количество}"""
+        raise NotImplementedError
+
+    def merge(self, lines):
+        """
+        Добавляет пары (id товара, количество) - корзину анонимного посетителя после входа.
+        Возвращает пары, которые не удалось добавить (DatabaseBasketBackend - товара не хватило на складе)
+        """
+        raise NotImplementedError
+
+    def checkout(self):
+        """
+        Переносит корзину в строки Basket перед оформлением заказа.
+        Возвращает пары (id товара, количество), которых не хватило на складе - они остаются в корзине
+        """
+        return []
+
+    def summary(self):
+        """Корзина для шаблонов: count, quantity, total_cost, перебор строк"""
+        raise NotImplementedError
+
+
+class DatabaseBasketBackend(BasketBackend):
+
+    def __init__(self, user):
+        self.user = user
+
+    def add(self, product_id, quantity=1):
+        Basket.objects.add(self.user.pk, product_id, quantity)
+
+    def set_quantities(self, quantities):
+        return Basket.objects.filter(user=self.user).set_quantities(quantities)
+
+    def get_quantities(self, line_ids):
+        return dict(Basket.objects.filter(user=self.user, pk__in=line_ids).values_list('id', 'quantity'))
+
+    def merge(self, lines):
+        reserved = {product_id for product_id, _ in Basket.objects.add_many(self.user.pk, lines)}
+        return [(product_id, quantity) for product_id, quantity in lines if product_id not in reserved]
+
+    def summary(self):
+        return BasketSummary(self.user)
+
+
+class StoredBasketLine:
+    """Строка корзины из кеша или сессии с тем же интерфейсом, что у Basket (id строки - id товара)"""
+
+    def __init__(self, product, quantity):
+        self.id = product.pk
+        self.product = product
+        self.quantity = quantity
+
+    def get_sum(self):
+        return self.quantity * self.product.price
+
+
+class StoredBasketBackend(BasketBackend):
+    """
+    Корзина вида {id товара (строкой): количество} во внешнем хранилище (load/save в наследниках).
+    Сама является сводкой для шаблонов: пока корзина пуста, не обращается к БД,
+    товары загружаются одним запросом при первом обращении к сумме или строкам
+    """
+
+    def load(self):
+        raise NotImplementedError
+
+    def save(self, lines):
+        raise NotImplementedError
+
+    @cached_property
+    def lines(self):
+        return self.load()
+
+    @contextmanager
+    def locked(self):
+        """Блокировка корзины на время чтения-изменения-записи (в наследниках)"""
+        yield
+
+    def _update(self, change):
+        """Применяет change(lines) к свежей копии корзины под блокировкой и сохраняет ее, возвращает результат change"""
+        with self.locked():
+            lines = dict(self.load())
+            result = change(lines)
+            self._save(lines)
+        return result
+
+    def _save(self, lines):
+        self.save(lines)
+        self.__dict__['lines'] = lines
+        self.__dict__.pop('items', None)
+
+    @staticmethod
+    def check_stock(quantities):
+        """
+        Проверяет, что товары {id товара: количество} есть в продаже в таком количестве, иначе выбрасывает
+        stock.OutOfStock. Товар не резервируется - остаток проверяется еще раз при оформлении заказа
+        """
+        if not quantities:
+            return
+        available = dict(Products.get_items().filter(pk__in=quantities).values_list('id', 'quantity'))
+        for product_id, quantity in quantities.items():
+            if available.get(product_id, 0) < quantity:
+                raise OutOfStock(product_id, quantity)
+
+    def add(self, product_id, quantity=1):
+        def change(lines):
+            lines[str(product_id)] = lines.get(str(product_id), 0) + quantity
+            self.check_stock({int(product_id): lines[str(product_id)]})
+
+        self._update(change)
+
+    def set_quantities(self, quantities):
+        def change(lines):
+            applied = {line: quantity for line, quantity in quantities.items() if str(line) in lines}
+            self.check_stock({int(line): quantity for line, quantity in applied.items()
+                              if quantity > lines[str(line)]})
+            for line, quantity in applied.items():
+                if quantity > 0:
+                    lines[str(line)] = quantity
+                else:
+                    lines.pop(str(line))
+            return applied
+
+        return self._update(change)
+
+    def get_quantities(self, line_ids):
+        return {line: self.lines[str(line)] for line in line_ids if str(line) in self.lines}
+
+    def merge(self, lines):
+        def change(merged):
+            for product_id, quantity in lines:
+                merged[str(product_id)] = merged.get(str(product_id), 0) + quantity
+            return []
+
+        return self._update(change)
+
+    def clear(self):
+        self._update(dict.clear)
+
+    def pairs(self, lines=None):
+        lines = self.lines if lines is None else lines
+        return [(int(product_id), quantity) for product_id, quantity in lines.items()]
+
+    def summary(self):
+        return self
+
+    @cached_property
+    def items(self):
+        if not self.lines:
+            return []
+        products = Products.get_items().in_bulk([product_id for product_id, _ in self.pairs()])
+        return [StoredBasketLine(products[product_id], quantity)
+                for product_id, quantity in self.pairs() if product_id in products]
+
+    @property
+    def count(self):
+        return len(self.lines)
+
+    @property
+    def quantity(self):
+        return sum(self.lines.values())
+
+    @property
+    def total_cost(self):
+        return sum(item.get_sum() for item in self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
+
+
+class SessionBasketBackend(StoredBasketBackend):
+
+    def __init__(self, session):
+        self.session = session
+
+    def load(self):
+        return self.session.get(SESSION_BASKET_KEY, {})
+
+    def save(self, lines):
+        if lines:
+            self.session[SESSION_BASKET_KEY] = lines
+        else:
+            self.session.pop(SESSION_BASKET_KEY, None)
+
+
+class CacheBasketBackend(StoredBasketBackend):
+    """
+    Корзина пользователя в кеше: правка корзины не пишет в основную БД.
+    Товар не резервируется до оформления заказа, позиции, которых к тому моменту не хватит, в заказ не попадут
+    и останутся в корзине. Правки из нескольких вкладок не теряются: чтение-изменение-запись корзины
+    идет под блокировкой cache.add
+    """
+    LOCK_TIMEOUT = 2
+    LOCK_WAIT = 0.01
+
+    def __init__(self, user):
+        self.user = user
+
+    @property
+    def key(self):
+        return f'basket:{self.user.pk}'
+
+    @contextmanager
+    def locked(self):
+        """
+        Блокировка с уникальным токеном: снимается, только если все еще принадлежит этому запросу.
+        Если за LOCK_TIMEOUT блокировку взять не удалось, выбрасывает BasketBusy
+        """
+        key, token = f'{self.key}:lock', uuid.uuid4().hex
+        deadline = time.monotonic() + self.LOCK_TIMEOUT
+        while not cache.add(key, token, self.LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                raise BasketBusy
+            time.sleep(self.LOCK_WAIT)
+        try:
+            yield
+        finally:
+            if cache.get(key) == token:
+                cache.delete(key)
+
+    def load(self):
+        return cache.get(self.key, {})
+
+    def save(self, lines):
+        if lines:
+            cache.set(self.key, lines, BASKET_CACHE_TIMEOUT)
+        else:
+            cache.delete(self.key)
+
+    def checkout(self):
+        def change(lines):
+            if not lines:
+                return []
+            reserved = {product_id for product_id, _ in Basket.objects.add_many(self.user.pk, self.pairs(lines))}
+            rejected = [(product_id, quantity) for product_id, quantity in self.pairs(lines)
+                        if product_id not in reserved]
+            lines.clear()
+            lines.update((str(product_id), quantity) for product_id, quantity in rejected)
+            return rejected
+
+        return self._update(change)
+
+
+BASKET_BACKENDS = {
+    'db': DatabaseBasketBackend,
+    'cache': CacheBasketBackend,
+}
+
+
+def get_user_backend(user):
+    return BASKET_BACKENDS[settings.BASKET_BACKEND](user)
+
+
+def get_basket_backend(request):
+    """Хранилище корзины текущего посетителя"""
+    if request.user.is_authenticated:
+        return get_user_backend(request.user)
+    return SessionBasketBackend(request.session)
+
+
+def get_basket(request):
+    """Корзина текущего посетителя для шаблонов"""
+    return get_basket_backend(request).summary()
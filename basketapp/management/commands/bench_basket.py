@@ -0,0 +1,60 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from authapp.models import User
+from basketapp.backends import BASKET_BACKENDS
+from basketapp.models import Basket
+from mainapp.models import Products
+from mainapp.stock import OutOfStock
+
+BENCH_USER = 'bench-basket'
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает пропускную способность хранилищ корзины (basketapp.backends) на типичной
+    нагрузке: добавление товаров, изменение количества, удаление строки и чтение итогов.
+    Пример: python manage.py bench_basket --operations 2000
+    """
+    help = 'Бенчмарк хранилищ корзины'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operations', type=int, default=1000, help='Операций на каждое хранилище')
+        parser.add_argument('--products', type=int, default=20, help='Разных товаров в корзине')
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username=BENCH_USER)
+        product_ids = list(Products.get_items().order_by('-quantity').values_list('id', flat=True)
+                           [:options['products']])
+
+        for name, backend_class in BASKET_BACKENDS.items():
+            self.clear(backend_class(user))
+            random.seed(0)
+            started = time.perf_counter()
+            for step in range(options['operations']):
+                backend = backend_class(user)
+                action = step % 4
+                try:
+                    if action in (0, 1):
+                        backend.add(random.choice(product_ids))
+                    elif action == 2:
+                        line = next(iter(backend.summary()), None)
+                        if line:
+                            backend.set_quantities({line.id: line.quantity + 1})
+                except OutOfStock:
+                    pass
+                if action == 3:
+                    summary = backend.summary()
+                    summary.quantity, summary.total_cost
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{name:6} {options["operations"] / elapsed:8.0f} операций/с '
+                              f'({elapsed * 1000 / options["operations"]:.2f} мс на операцию)')
+            self.clear(backend_class(user))
+
+    @staticmethod
+    def clear(backend):
+        Basket.objects.filter(user=backend.user).delete()
+        if hasattr(backend, 'clear'):
+            backend.clear()
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from basketapp.models import Basket
+
+
+class Command(BaseCommand):
+    """
+    Возвращает на склад товар из корзин, которые не менялись дольше BASKET_RESERVATION_TTL,
+    и удаляет эти строки. С --loop работает как воркер и повторяет проход каждые N секунд.
+    Пример: python manage.py expire_baskets --loop 60
+    """
+    help = 'Снятие просроченных резервов товара в корзинах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, help='Время жизни резерва в секундах (по умолчанию из настроек)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--loop', type=int, metavar='SECONDS', help='Повторять проход каждые SECONDS секунд')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            lines, units = Basket.objects.expire(options['ttl'], options['batch_size'])
+            self.stdout.write(f'Снято резервов: строк {lines}, единиц товара {units} '
+                              f'({time.perf_counter() - started:.2f} с)')
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.6 on 2026-10-18 13:43
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Сливает повторяющиеся строки корзины (user, product) в самую раннюю.
+    Товар под все строки уже зарезервирован на складе, поэтому остатки не меняются
+    """
+    Basket = apps.get_model('basketapp', 'Basket')
+    duplicates = (Basket.objects.order_by().values('user', 'product')
+                  .annotate(lines=Count('id'), first=Min('id'), total=Sum('quantity')).filter(lines__gt=1))
+    for line in list(duplicates):
+        Basket.objects.filter(pk=line['first']).update(quantity=line['total'])
+        Basket.objects.filter(user=line['user'], product=line['product']).exclude(pk=line['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0008_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('basketapp', '0002_auto_20220710_1320'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='basket',
+            unique_together={('user', 'product')},
+        ),
+    ]
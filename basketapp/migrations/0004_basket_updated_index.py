@@ -0,0 +1,17 @@
+# Generated by Django 3.2.6 on 2026-10-18 13:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basketapp', '0003_basket_unique_user_product'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='basket',
+            index=models.Index(fields=['updated'], name='basketapp_b_updated_8f1fc2_idx'),
+        ),
+    ]
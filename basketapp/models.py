@@ -1,25 +1,159 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction, connection, IntegrityError
+from django.db.models import F
+from django.utils import timezone
 
 # Create your models here.
-from django.utils.functional import cached_property
 
 from authapp.models import User
+from mainapp import stock
 from mainapp.models import Products
 
 
 class BasketQuerySet(models.QuerySet):
-    """Менеджер корзины. При удалении корзины возвращает количество товаров на склад"""
+    """
+    Менеджер корзины. При удалении корзины возвращает количество товаров на склад
+    одним UPDATE на все товары (stock.release_many). При оформлении заказа (key='make_order')
+    товары переходят в заказ и на склад не возвращаются
+    """
 
     def delete(self, *args, **kwargs):
-        if kwargs.get('key') != 'make_order':
-            for object in self:
-                object.product.quantity += object.quantity
-                object.product.save()
-        super(BasketQuerySet, self).delete()
+        with transaction.atomic():
+            if kwargs.get('key') != 'make_order':
+                stock.release_many(self.values_list('product_id', 'quantity'))
+            super(BasketQuerySet, self).delete()
+
+    def expired(self, ttl=None):
+        """Строки, резерв которых истек: не менялись дольше BASKET_RESERVATION_TTL секунд"""
+        ttl = settings.BASKET_RESERVATION_TTL if ttl is None else ttl
+        return self.filter(updated__lt=timezone.now() - timedelta(seconds=ttl))
+
+    def expire(self, ttl=None, batch_size=1000):
+        """
+        Удаляет просроченные строки пачками по batch_size, каждая пачка - в своей короткой транзакции:
+        строки выбираются по индексу на updated (в Postgres - с блокировкой, занятые строки пропускаются),
+        товар возвращается на склад одним UPDATE на пачку (stock.release_many), затем строки удаляются по id.
+        Возвращает (число строк, число единиц товара)
+        """
+        lines = units = 0
+        while True:
+            with transaction.atomic():
+                batch = list(self.expired(ttl).order_by('updated').select_for_update(skip_locked=True)
+                             .values_list('id', 'product_id', 'quantity')[:batch_size])
+                if not batch:
+                    break
+                stock.release_many((product_id, quantity) for _, product_id, quantity in batch)
+                # товар уже возвращен, поэтому удаление в обход BasketQuerySet.delete
+                models.QuerySet.delete(self.model.objects.filter(pk__in=[pk for pk, _, _ in batch]))
+            lines += len(batch)
+            units += sum(quantity for _, _, quantity in batch)
+            if len(batch) < batch_size:
+                break
+        return lines, units
+
+    def set_quantities(self, quantities):
+        """
+        Устанавливает количества строкам корзины из словаря {id строки: количество} в одной транзакции:
+        резерв на складе меняется разом для всех товаров (stock.adjust_many), строки обновляются одним
+        bulk_update, строки с нулевым количеством удаляются. Если товара не хватает - выбрасывает
+        stock.OutOfStock и не меняет ничего. Возвращает {id строки: новое количество} для найденных строк
+        """
+        with transaction.atomic():
+            lines = list(self.select_for_update().filter(pk__in=quantities).only('id', 'user_id', 'product_id',
+                                                                                 'quantity'))
+            changed = [line for line in lines if line.quantity != quantities[line.pk]]
+            stock.adjust_many((line.product_id, quantities[line.pk] - line.quantity) for line in changed)
+            now = timezone.now()
+            for line in changed:
+                line.quantity, line.updated = quantities[line.pk], now
+            self.model.objects.bulk_update([line for line in changed if line.quantity], ['quantity', 'updated'])
+            removed = [line.pk for line in changed if not line.quantity]
+            if removed:
+                # товар уже возвращен, поэтому удаление в обход BasketQuerySet.delete
+                models.QuerySet.delete(self.model.objects.filter(pk__in=removed))
+        for user_id in {line.user_id for line in changed}:
+            self._invalidate_summary(user_id)
+        return {line.pk: line.quantity for line in lines}
+
+    def add(self, user_id, product_id, quantity=1):
+        """
+        Добавляет товар в корзину: резервирует его на складе и увеличивает строку корзины
+        (или создает ее) одним INSERT ... ON CONFLICT DO UPDATE по уникальной паре (user, product).
+        Если товара не хватает, выбрасывает stock.OutOfStock
+        """
+        with transaction.atomic():
+            stock.adjust(product_id, quantity)
+            self._write_lines(user_id, [(product_id, quantity)])
+        self._invalidate_summary(user_id)
+
+    def add_many(self, user_id, lines):
+        """
+        Переносит в корзину пары (id товара, количество) - например, корзину из сессии при входе.
+        Каждая позиция резервируется на складе, позиции, которых не хватает, пропускаются;
+        все зарезервированные строки записываются одним INSERT ... ON CONFLICT. Возвращает записанные пары
+        """
+        totals = {}
+        for product_id, quantity in lines:
+            totals[product_id] = totals.get(product_id, 0) + quantity
+        with transaction.atomic():
+            reserved = [(product_id, quantity) for product_id, quantity in sorted(totals.items())
+                        if stock.reserve(product_id, quantity)]
+            if reserved:
+                self._write_lines(user_id, reserved)
+        self._invalidate_summary(user_id)
+        return reserved
+
+    @staticmethod
+    def _invalidate_summary(user_id):
+        # сигналы post_save не отправляются, сводку корзины сбрасываем сами
+        from basketapp.summary import invalidate_basket_summary
+        invalidate_basket_summary(user_id)
+
+    def _write_lines(self, user_id, lines):
+        if connection.vendor == 'postgresql' or (connection.vendor == 'sqlite' and
+                                                 connection.Database.sqlite_version_info >= (3, 24)):
+            self._upsert(user_id, lines)
+        else:
+            for product_id, quantity in lines:
+                self._update_or_create(user_id, product_id, quantity)
+
+    def _upsert(self, user_id, lines):
+        meta, quote = self.model._meta, connection.ops.quote_name
+        table = quote(meta.db_table)
+        now = timezone.now()
+        created, updated = (meta.get_field(name).get_db_prep_save(now, connection) for name in ('created', 'updated'))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, product_id, quantity, created, updated) '
+                f'VALUES {", ".join(["(%s, %s, %s, %s, %s)"] * len(lines))} '
+                f'ON CONFLICT (user_id, product_id) DO UPDATE SET '
+                f'quantity = {table}.quantity + EXCLUDED.quantity, updated = EXCLUDED.updated',
+                [param for product_id, quantity in lines
+                 for param in (user_id, product_id, quantity, created, updated)],
+            )
+
+    def _update_or_create(self, user_id, product_id, quantity):
+        """Для БД без ON CONFLICT: UPDATE, при отсутствии строки - INSERT, при гонке со вставкой - снова UPDATE"""
+        line = self.model.objects.filter(user_id=user_id, product_id=product_id)
+        if line.update(quantity=F('quantity') + quantity, updated=timezone.now()):
+            return
+        try:
+            with transaction.atomic():
+                # bulk_create не вызывает save(), товар уже зарезервирован
+                self.model.objects.bulk_create([self.model(user_id=user_id, product_id=product_id, quantity=quantity)])
+        except IntegrityError:
+            line.update(quantity=F('quantity') + quantity, updated=timezone.now())
 
 
 class Basket(models.Model):
     """Корзина"""
+    class Meta:
+        unique_together = ('user', 'product')
+        # поиск просроченных резервов командой expire_baskets
+        indexes = [models.Index(fields=['updated'])]
+
     objects = BasketQuerySet.as_manager()
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='basket', verbose_name='Пользователь')
@@ -34,31 +168,33 @@ class Basket(models.Model):
     def get_sum(self):
         return self.quantity * self.product.price
 
-    @cached_property
-    def get_basket(self):
-        return self.user.basket.select_related()
-
-    def get_result_sum(self):
-        basket = self.get_basket
-        return sum(good.get_sum() for good in basket)
-
-    def get_quantity(self):
-        basket = self.get_basket
-        return sum(good.quantity for good in basket)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Basket, cls).from_db(db, field_names, values)
+        if 'quantity' in field_names:
+            instance._reserved = instance.quantity
+        return instance
 
     def delete(self, **kwargs):
-        self.product.quantity += self.quantity
-        self.product.save()
-        super(Basket, self).delete(**kwargs)
+        with transaction.atomic():
+            stock.release(self.product_id, self.quantity)
+            super(Basket, self).delete(**kwargs)
 
     def save(self, *args, **kwargs):
-        if self.pk:
-            item = self._get_item_quantity(self.pk)
-            self.product.quantity -= self.quantity - item
+        """
+        Резервирует на складе разницу между новым количеством и уже зарезервированным.
+        Если товара не хватает, выбрасывает stock.OutOfStock и ничего не сохраняет
+        """
+        if self._state.adding:
+            reserved = 0
+        elif hasattr(self, '_reserved'):
+            reserved = self._reserved
         else:
-            self.product.quantity -= self.quantity
-        self.product.save()
-        super(Basket, self).save(*args, **kwargs)
+            reserved = self._get_item_quantity(self.pk)
+        with transaction.atomic():
+            stock.adjust(self.product_id, self.quantity - reserved)
+            super(Basket, self).save(*args, **kwargs)
+        self._reserved = self.quantity
 
     @staticmethod
     def _get_item_quantity(pk):
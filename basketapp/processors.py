@@ -1,9 +1,6 @@
-from basketapp.models import Basket
+from basketapp.backends import get_basket
 
 
 def basket(request):
-    """Корзина доступна во всех шаблонах проекта"""
-    basket_list = []
-    if request.user.is_authenticated:
-        basket_list = Basket.objects.filter(user=request.user.id).select_related()
-    return {'basket': basket_list}
\ No newline at end of file
+    """Корзина доступна во всех шаблонах проекта. Запросы к БД - только если шаблон к ней обратится"""
+    return {'basket': get_basket(request)}
@@ -0,0 +1,48 @@
+from functools import partial
+
+from django.contrib import messages
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from basketapp.models import Basket
+from basketapp.backends import BasketBusy, SessionBasketBackend, get_user_backend
+from basketapp.summary import invalidate_basket_summaries, invalidate_basket_summary
+from mainapp.models import Products
+
+
+@receiver(post_save, sender=Basket)
+@receiver(post_delete, sender=Basket)
+def invalidate_summary(sender, instance, **kwargs):
+    """Сбрасывает закешированные количество и сумму корзины пользователя"""
+    invalidate_basket_summary(instance.user_id)
+
+
+@receiver(post_save, sender=Products)
+def invalidate_product_summaries(sender, instance, created, **kwargs):
+    """Сбрасывает сводки корзин с измененным товаром (сумма зависит от цены) после фиксации транзакции"""
+    if not created:
+        transaction.on_commit(partial(invalidate_basket_summaries, [instance.pk]))
+
+
+@receiver(user_logged_in)
+def merge_session_basket(sender, request, user, **kwargs):
+    """
+    Переносит корзину анонимного посетителя из сессии в хранилище корзины пользователя при входе.
+    Позиции, которые перенести не удалось, остаются в корзине сессии
+    """
+    if request is None or not hasattr(request, 'session'):
+        return
+    basket = SessionBasketBackend(request.session)
+    if not basket:
+        return
+    pairs = basket.pairs()
+    try:
+        rejected = {product_id for product_id, _ in get_user_backend(user).merge(pairs)}
+    except BasketBusy:
+        rejected = {product_id for product_id, _ in pairs}
+    basket.set_quantities({product_id: 0 for product_id, _ in pairs if product_id not in rejected})
+    if rejected:
+        messages.warning(request, 'Части товаров из корзины нет в нужном количестве, они не перенесены',
+                         fail_silently=True)
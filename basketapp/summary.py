@@ -0,0 +1,101 @@
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, F, Sum
+from django.utils.functional import cached_property
+
+from basketapp.models import Basket
+
+BASKET_SUMMARY_TIMEOUT = 60 * 60
+INVALIDATE_BATCH_SIZE = 1000
+
+
+def get_basket_summary_key(user_id):
+    """
+    Ключ сводки корзины. Сводка сбрасывается правками корзины пользователя
+    и изменением цен товаров в ней (invalidate_basket_summaries), но не изменениями остатков
+    """
+    return f'basket_summary:{user_id}'
+
+
+def invalidate_basket_summary(user_id):
+    cache.delete(get_basket_summary_key(user_id))
+
+
+def invalidate_basket_summaries(product_ids=None):
+    """Сбрасывает сводки корзин, в которых есть товары product_ids (None - все корзины)"""
+    baskets = Basket.objects.all() if product_ids is None else Basket.objects.filter(product_id__in=product_ids)
+    user_ids = baskets.order_by().values_list('user_id', flat=True).distinct()
+    keys = []
+    for user_id in user_ids.iterator(chunk_size=INVALIDATE_BATCH_SIZE):
+        keys.append(get_basket_summary_key(user_id))
+        if len(keys) >= INVALIDATE_BATCH_SIZE:
+            cache.delete_many(keys)
+            keys = []
+    if keys:
+        cache.delete_many(keys)
+
+
+class BasketSummary:
+    """
+    Корзина пользователя для шаблонов. Ничего не читает из БД, пока шаблон к ней не обратится:
+    количество и сумма считаются одним агрегатом и кешируются по пользователю,
+    позиции корзины загружаются одним запросом только при переборе
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def user_id(self):
+        return self.user.pk if self.user.is_authenticated else None
+
+    @cached_property
+    def totals(self):
+        if self.user_id is None:
+            return {'count': 0, 'quantity': 0, 'total_cost': 0}
+        key = get_basket_summary_key(self.user_id)
+        totals = cache.get(key)
+        if totals is None:
+            if 'items' in self.__dict__:
+                totals = {
+                    'count': len(self.items),
+                    'quantity': sum(item.quantity for item in self.items),
+                    'total_cost': sum(item.get_sum() for item in self.items),
+                }
+            else:
+                totals = Basket.objects.filter(user_id=self.user_id).aggregate(
+                    count=Count('id'),
+                    total_quantity=Sum('quantity'),
+                    total_cost=Sum(F('quantity') * F('product__price'), output_field=DecimalField()),
+                )
+                totals = {'count': totals['count'], 'quantity': totals['total_quantity'] or 0,
+                          'total_cost': totals['total_cost'] or 0}
+            cache.set(key, totals, BASKET_SUMMARY_TIMEOUT)
+        return totals
+
+    @cached_property
+    def items(self):
+        if self.user_id is None:
+            return []
+        return list(Basket.objects.filter(user_id=self.user_id).select_related('product').order_by('id'))
+
+    @property
+    def count(self):
+        return self.totals['count']
+
+    @property
+    def quantity(self):
+        return self.totals['quantity']
+
+    @property
+    def total_cost(self):
+        return self.totals['total_cost']
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
+
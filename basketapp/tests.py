@@ -1,3 +1,429 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction, IntegrityError
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 # Create your tests here.
+from authapp.models import User
+from basketapp import processors
+from basketapp.models import Basket
+from basketapp.backends import (SESSION_BASKET_KEY, BasketBusy, CacheBasketBackend, DatabaseBasketBackend,
+                                SessionBasketBackend)
+from basketapp.summary import BasketSummary
+from mainapp.models import ProductCategory, Products
+from mainapp import stock
+from mainapp.stock import OutOfStock
+from ordersapp.models import OrderItem
+
+
+@override_settings(LOW_CACHE=True)
+class TestBasketSummary(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.boots = Products.objects.create(name='Ботинки', slug='boots', category=category, price=100, quantity=10)
+        self.shoes = Products.objects.create(name='Туфли', slug='shoes', category=category, price=250, quantity=10)
+        self.user = User.objects.create_user(username='user', password='123')
+        self.basket = Basket.objects.create(user=self.user, product=self.boots, quantity=2)
+        Basket.objects.create(user=self.user, product=self.shoes, quantity=1)
+        self.client.login(username='user', password='123')
+
+    def basket_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        return response, [query for query in context.captured_queries if 'basketapp_basket' in query['sql']]
+
+    def test_catalog_pages_do_not_touch_basket(self):
+        self.client.get('/products/')
+        for url in ('/products/', '/category_id/shoes/', '/detail/boots/'):
+            response, queries = self.basket_queries(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(queries, [])
+
+    def test_profile_page(self):
+        self.client.get('/profile/')
+        response, queries = self.basket_queries('/profile/')
+        self.assertContains(response, '450')
+        self.assertLessEqual(len(queries), 1)
+
+    def test_one_aggregate(self):
+        summary = BasketSummary(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual((summary.count, summary.quantity, summary.total_cost), (2, 3, 450))
+            self.assertTrue(summary)
+        with self.assertNumQueries(0):
+            self.assertEqual(BasketSummary(self.user).total_cost, 450)
+
+    def test_invalidated_on_save_and_delete(self):
+        self.assertEqual(BasketSummary(self.user).quantity, 3)
+        self.basket.quantity = 5
+        self.basket.save()
+        self.assertEqual(BasketSummary(self.user).quantity, 6)
+        self.basket.delete()
+        summary = BasketSummary(self.user)
+        self.assertEqual((summary.count, summary.total_cost), (1, 250))
+
+    def test_invalidated_on_price_change_only(self):
+        self.assertEqual(BasketSummary(self.user).total_cost, 450)
+        other = Products.objects.create(name='Сапоги', slug='other', category=self.boots.category, quantity=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.reserve(self.boots.pk, 1)
+            other.price = 1000
+            other.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(BasketSummary(self.user).total_cost, 450)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shoes.price = 300
+            self.shoes.save()
+        self.assertEqual(BasketSummary(self.user).total_cost, 500)
+
+    def test_ajax_update(self):
+        response = self.client.get(f'/basket/edit/{self.basket.pk}/4/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertIn('650', response.json()['result'])
+
+
+class TestBasketAdd(TestCase):
+
+    def setUp(self) -> None:
+        category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.boots = Products.objects.create(name='Ботинки', slug='boots', category=category, price=100, quantity=3)
+        self.user = User.objects.create_user(username='user', password='123')
+
+    def assertBasket(self, basket, left):
+        self.assertEqual(list(Basket.objects.filter(user=self.user).values_list('quantity', flat=True)), basket)
+        self.assertEqual(Products.objects.get(pk=self.boots.pk).quantity, left)
+
+    def test_one_line_per_product(self):
+        Basket.objects.add(self.user.pk, self.boots.pk)
+        with self.assertNumQueries(7):
+            Basket.objects.add(self.user.pk, self.boots.pk)
+        self.assertBasket([2], 1)
+        Basket.objects.add(self.user.pk, self.boots.pk)
+        with self.assertRaises(OutOfStock):
+            Basket.objects.add(self.user.pk, self.boots.pk)
+        self.assertBasket([3], 0)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Basket.objects.bulk_create([Basket(user=self.user, product=self.boots, quantity=1)])
+
+    def test_fallback_without_upsert(self):
+        Basket.objects.all()._update_or_create(self.user.pk, self.boots.pk, 1)
+        Basket.objects.all()._update_or_create(self.user.pk, self.boots.pk, 2)
+        self.assertBasket([3], 3)
+
+    def test_view_and_summary(self):
+        self.client.login(username='user', password='123')
+        self.assertEqual(BasketSummary(self.user).quantity, 0)
+        for _ in range(4):
+            response = self.client.get(f'/basket/basket_add/{self.boots.pk}', HTTP_REFERER='/products/')
+            self.assertRedirects(response, '/products/', fetch_redirect_response=False)
+        self.assertBasket([3], 0)
+        self.assertEqual(BasketSummary(self.user).quantity, 3)
+
+
+class TestSessionBasket(TestCase):
+
+    def setUp(self) -> None:
+        category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.boots = Products.objects.create(name='Ботинки', slug='boots', category=category, price=100, quantity=3)
+        self.shoes = Products.objects.create(name='Туфли', slug='shoes', category=category, price=250, quantity=1)
+        self.user = User.objects.create_user(username='user', password='123')
+
+    def add(self, product, times=1):
+        for _ in range(times):
+            self.client.get(f'/basket/basket_add/{product.pk}', HTTP_REFERER='/products/')
+
+    def test_anonymous_basket_in_session(self):
+        self.add(self.boots, 2)
+        self.add(self.shoes)
+        self.assertFalse(Basket.objects.exists())
+        self.assertEqual(Products.objects.get(pk=self.boots.pk).quantity, 3)
+        self.assertEqual(self.client.session[SESSION_BASKET_KEY], {str(self.boots.pk): 2, str(self.shoes.pk): 1})
+
+        response = self.client.get(f'/basket/edit/{self.boots.pk}/3/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertIn('550', response.json()['result'])
+        self.client.get(f'/basket/basket_remove/{self.shoes.pk}', HTTP_REFERER='/products/')
+        self.assertEqual(self.client.session[SESSION_BASKET_KEY], {str(self.boots.pk): 3})
+
+    def test_unknown_or_missing_product(self):
+        self.add(self.shoes, 2)
+        self.assertEqual(self.client.session[SESSION_BASKET_KEY], {str(self.shoes.pk): 1})
+        Products.objects.filter(pk=self.boots.pk).update(is_active=False)
+        for product_id in (self.boots.pk, self.shoes.pk + 100):
+            response = self.client.get(f'/basket/basket_add/{product_id}', HTTP_REFERER='/products/', follow=True)
+            self.assertContains(response, 'Товара нет в нужном количестве')
+        self.assertEqual(self.client.session[SESSION_BASKET_KEY], {str(self.shoes.pk): 1})
+        response = self.client.get(f'/basket/edit/{self.shoes.pk}/2/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json()['error'], 'Недостаточно товара на складе')
+        self.assertEqual(self.client.session[SESSION_BASKET_KEY], {str(self.shoes.pk): 1})
+
+    def test_merge_on_login(self):
+        Basket.objects.add(self.user.pk, self.boots.pk)
+        self.add(self.boots, 2)
+        self.add(self.shoes)
+        # последнюю пару туфель забрал другой покупатель
+        stock.reserve(self.shoes.pk, 1)
+        response = self.client.post('/login/', {'username': 'user', 'password': '123'})
+        self.assertEqual(response.status_code, 302)
+        # туфель на складе не осталось - позиция не переносится и остается в корзине сессии
+        self.assertEqual(self.client.session[SESSION_BASKET_KEY], {str(self.shoes.pk): 1})
+        self.assertEqual(list(Basket.objects.filter(user=self.user).values_list('product_id', 'quantity')),
+                         [(self.boots.pk, 3)])
+        self.assertEqual(Products.objects.get(pk=self.boots.pk).quantity, 0)
+        self.assertEqual(BasketSummary(self.user).total_cost, 300)
+        self.assertContains(self.client.get('/products/'), 'они не перенесены')
+
+    def test_merge_on_login_clears_merged_basket(self):
+        self.add(self.boots, 2)
+        self.client.post('/login/', {'username': 'user', 'password': '123'})
+        self.assertNotIn(str(self.boots.pk), self.client.session.get(SESSION_BASKET_KEY, {}))
+        self.assertEqual(list(Basket.objects.filter(user=self.user).values_list('product_id', 'quantity')),
+                         [(self.boots.pk, 2)])
+        self.assertNotContains(self.client.get('/products/'), 'не перенесены')
+
+    def test_empty_session_basket_does_not_query(self):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        request.session = SessionStore()
+        with self.assertNumQueries(0):
+            basket = processors.basket(request)['basket']
+            self.assertFalse(basket)
+            self.assertEqual(basket.total_cost, 0)
+
+
+class TestExpireBaskets(TestCase):
+
+    def setUp(self) -> None:
+        self.category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.boots = Products.objects.create(name='Ботинки', slug='boots', category=self.category, quantity=5)
+        self.shoes = Products.objects.create(name='Туфли', slug='shoes', category=self.category, quantity=2)
+        self.users = [User.objects.create_user(username=f'user{i}', password='123') for i in range(3)]
+        for user in self.users:
+            Basket.objects.add(user.pk, self.boots.pk)
+        Basket.objects.add(self.users[0].pk, self.shoes.pk, 2)
+        Basket.objects.filter(user__in=self.users[:2]).update(updated=timezone.now() - timedelta(hours=3))
+
+    def test_expire(self):
+        self.assertEqual(BasketSummary(self.users[0]).quantity, 3)
+        out = StringIO()
+        call_command('expire_baskets', batch_size=2, stdout=out)
+        self.assertIn('строк 3, единиц товара 4', out.getvalue())
+        self.assertEqual(list(Basket.objects.values_list('user', flat=True)), [self.users[2].pk])
+        self.assertEqual(Products.objects.get(pk=self.boots.pk).quantity, 4)
+        self.assertEqual(Products.objects.get(pk=self.shoes.pk).quantity, 2)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.in_stock_count, 2)
+        self.assertEqual(BasketSummary(self.users[0]).quantity, 0)
+
+        call_command('expire_baskets', stdout=out)
+        self.assertIn('строк 0, единиц товара 0', out.getvalue())
+
+    def test_ttl_from_settings(self):
+        with override_settings(BASKET_RESERVATION_TTL=4 * 60 * 60):
+            self.assertEqual(Basket.objects.expire(), (0, 0))
+        self.assertEqual(Basket.objects.expire(ttl=60), (3, 4))
+
+
+class TestBasketBatchUpdate(TestCase):
+
+    def setUp(self) -> None:
+        category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.boots = Products.objects.create(name='Ботинки', slug='boots', category=category, price=100, quantity=5)
+        self.shoes = Products.objects.create(name='Туфли', slug='shoes', category=category, price=250, quantity=1)
+        self.user = User.objects.create_user(username='user', password='123')
+        self.boots_line = Basket.objects.create(user=self.user, product=self.boots, quantity=1)
+        self.shoes_line = Basket.objects.create(user=self.user, product=self.shoes, quantity=1)
+        self.client.login(username='user', password='123')
+
+    def post(self, lines):
+        return self.client.post('/basket/batch/', json.dumps({'lines': lines}), content_type='application/json')
+
+    def quantities(self):
+        return dict(Products.objects.values_list('slug', 'quantity'))
+
+    def test_batch(self):
+        response = self.post({self.boots_line.pk: 4, self.shoes_line.pk: 0})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['lines'], {str(self.boots_line.pk): 4, str(self.shoes_line.pk): 0})
+        self.assertEqual((data['count'], data['quantity'], data['error']), (1, 4, None))
+        self.assertEqual(Decimal(data['total_cost'].replace(',', '.')), 400)
+        self.assertEqual(list(Basket.objects.values_list('product__slug', 'quantity')), [('boots', 4)])
+        self.assertEqual(self.quantities(), {'boots': 1, 'shoes': 1})
+
+    def test_out_of_stock_changes_nothing(self):
+        response = self.post({self.boots_line.pk: 2, self.shoes_line.pk: 3})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['lines'], {str(self.boots_line.pk): 1, str(self.shoes_line.pk): 1})
+        self.assertEqual(self.quantities(), {'boots': 4, 'shoes': 0})
+        self.assertEqual(sorted(Basket.objects.values_list('quantity', flat=True)), [1, 1])
+
+    def test_foreign_lines_and_bad_payload(self):
+        other = User.objects.create_user(username='other', password='123')
+        line = Basket.objects.create(user=other, product=self.boots, quantity=1)
+        self.assertEqual(self.post({line.pk: 3}).json()['lines'], {})
+        self.assertEqual(Basket.objects.get(pk=line.pk).quantity, 1)
+        self.assertEqual(self.post({line.pk: -1}).status_code, 400)
+        self.assertEqual(self.client.post('/basket/batch/', 'lines', content_type='application/json').status_code, 400)
+
+    def test_anonymous(self):
+        self.client.logout()
+        self.client.get(f'/basket/basket_add/{self.boots.pk}', HTTP_REFERER='/')
+        data = self.post({self.boots.pk: 3, self.shoes.pk: 1}).json()
+        self.assertEqual(data['lines'], {str(self.boots.pk): 3})
+        self.assertEqual(Decimal(data['total_cost'].replace(',', '.')), 300)
+
+
+class BasketBackendTests:
+    """Общие тесты хранилищ корзины, наследники задают make_backend()"""
+    reserves_on_add = False
+
+    def setUp(self) -> None:
+        cache.clear()
+        category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.boots = Products.objects.create(name='Ботинки', slug='boots', category=category, price=100, quantity=5)
+        self.shoes = Products.objects.create(name='Туфли', slug='shoes', category=category, price=250, quantity=1)
+        self.user = User.objects.create_user(username='user', password='123')
+
+    def make_backend(self):
+        raise NotImplementedError
+
+    def line_ids(self):
+        return {line.product.pk: line.id for line in self.make_backend().summary()}
+
+    def stock(self, product):
+        return Products.objects.get(pk=product.pk).quantity
+
+    def test_add_and_summary(self):
+        backend = self.make_backend()
+        backend.add(self.boots.pk)
+        backend.add(self.boots.pk, 2)
+        backend.add(self.shoes.pk)
+        summary = self.make_backend().summary()
+        self.assertEqual((summary.count, summary.quantity, summary.total_cost), (2, 4, 550))
+        self.assertEqual(sorted((line.product.slug, line.quantity) for line in summary),
+                         [('boots', 3), ('shoes', 1)])
+        self.assertEqual(self.stock(self.boots), 2 if self.reserves_on_add else 5)
+
+    def test_set_and_remove(self):
+        backend = self.make_backend()
+        backend.add(self.boots.pk)
+        backend.add(self.shoes.pk)
+        lines = self.line_ids()
+        backend = self.make_backend()
+        self.assertEqual(backend.set_quantities({lines[self.boots.pk]: 4, 10 ** 6: 1}), {lines[self.boots.pk]: 4})
+        backend.remove(lines[self.shoes.pk])
+        backend = self.make_backend()
+        self.assertEqual(backend.get_quantities(lines.values()), {lines[self.boots.pk]: 4})
+        self.assertEqual(backend.summary().total_cost, 400)
+        self.assertEqual(self.stock(self.shoes), 1)
+
+    def test_merge_and_checkout(self):
+        backend = self.make_backend()
+        backend.add(self.boots.pk)
+        backend.merge([(self.boots.pk, 2), (self.shoes.pk, 1)])
+        backend.checkout()
+        self.assertEqual(sorted(Basket.objects.filter(user=self.user).values_list('product__slug', 'quantity')),
+                         [('boots', 3), ('shoes', 1)])
+        self.assertEqual((self.stock(self.boots), self.stock(self.shoes)), (2, 0))
+        self.assertEqual(self.make_backend().summary().quantity, 4)
+
+
+class TestDatabaseBasketBackend(BasketBackendTests, TestCase):
+    reserves_on_add = True
+
+    def make_backend(self):
+        return DatabaseBasketBackend(self.user)
+
+
+class TestCacheBasketBackend(BasketBackendTests, TestCase):
+
+    def make_backend(self):
+        return CacheBasketBackend(self.user)
+
+    def test_merge_and_checkout(self):
+        backend = self.make_backend()
+        backend.add(self.boots.pk)
+        self.assertFalse(Basket.objects.exists())
+        backend.merge([(self.boots.pk, 2), (self.shoes.pk, 1)])
+        backend.checkout()
+        self.assertEqual(sorted(Basket.objects.filter(user=self.user).values_list('product__slug', 'quantity')),
+                         [('boots', 3), ('shoes', 1)])
+        self.assertEqual((self.stock(self.boots), self.stock(self.shoes)), (2, 0))
+        self.assertFalse(self.make_backend().lines)
+
+    @override_settings(BASKET_BACKEND='cache')
+    def test_make_order(self):
+        self.client.login(username='user', password='123')
+        self.client.get(f'/basket/basket_add/{self.boots.pk}', HTTP_REFERER='/')
+        self.assertFalse(Basket.objects.exists())
+        self.client.get('/make_order/')
+        self.assertEqual(list(OrderItem.objects.values_list('product__slug', 'quantity')), [('boots', 1)])
+        self.assertEqual(self.stock(self.boots), 4)
+        self.assertFalse(self.make_backend().lines)
+
+    @override_settings(BASKET_BACKEND='cache')
+    def test_checkout_keeps_rejected_lines(self):
+        self.client.login(username='user', password='123')
+        for product in (self.boots, self.shoes):
+            self.client.get(f'/basket/basket_add/{product.pk}', HTTP_REFERER='/')
+        # последнюю пару туфель забрали до оформления заказа
+        Products.objects.filter(pk=self.shoes.pk).update(quantity=0)
+        response = self.client.get('/make_order/', follow=True)
+        self.assertContains(response, 'они остались в корзине')
+        self.assertEqual(list(OrderItem.objects.values_list('product__slug', 'quantity')), [('boots', 1)])
+        self.assertEqual(self.make_backend().pairs(), [(self.shoes.pk, 1)])
+
+    def test_concurrent_updates_are_not_lost(self):
+        first, second = self.make_backend(), self.make_backend()
+        self.assertFalse(first.lines or second.lines)
+        first.add(self.boots.pk)
+        second.add(self.shoes.pk)
+        first.set_quantities({self.boots.pk: 2})
+        self.assertEqual(sorted(self.make_backend().pairs()), sorted([(self.boots.pk, 2), (self.shoes.pk, 1)]))
+
+    def test_busy_lock_is_not_bypassed(self):
+        backend = self.make_backend()
+        key = f'{backend.key}:lock'
+        # блокировку держит другой запрос: изменение не применяется, чужая блокировка остается
+        cache.add(key, 'other', 60)
+        with self.assertRaises(BasketBusy):
+            backend.LOCK_TIMEOUT = 0.05
+            backend.add(self.boots.pk)
+        self.assertEqual(cache.get(key), 'other')
+        self.assertFalse(self.make_backend().lines)
+
+    def test_expired_lock_is_not_released_by_previous_owner(self):
+        backend = self.make_backend()
+        key = f'{backend.key}:lock'
+        with backend.locked():
+            # своя блокировка истекла, ее взял другой запрос
+            cache.set(key, 'other', 60)
+        self.assertEqual(cache.get(key), 'other')
+
+
+class TestSessionBasketBackend(BasketBackendTests, TestCase):
+
+    def setUp(self) -> None:
+        super(TestSessionBasketBackend, self).setUp()
+        self.session = SessionStore()
+
+    def make_backend(self):
+        return SessionBasketBackend(self.session)
+
+    def test_merge_and_checkout(self):
+        backend = self.make_backend()
+        backend.add(self.boots.pk)
+        backend.merge([(self.boots.pk, 2), (self.shoes.pk, 1)])
+        self.assertEqual(backend.pairs(), [(self.boots.pk, 3), (self.shoes.pk, 1)])
+        DatabaseBasketBackend(self.user).merge(backend.pairs())
+        self.assertEqual((self.stock(self.boots), self.stock(self.shoes)), (2, 0))
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from basketapp.views import BasketAdd, BasketUpdate, BasketRemove
+from basketapp.views import BasketAdd, BasketUpdate, BasketRemove, BasketBatchUpdate
 
 
 app_name = 'basketapp'
@@ -8,5 +8,6 @@ urlpatterns = [
     path('basket_add/<int:product_id>', BasketAdd.as_view(), name='basket_add'),
     path('basket_remove/<int:basket_id>', BasketRemove.as_view(), name='basket_remove'),
     path('edit/<int:basket_id>/<int:quantity>/',
-         BasketUpdate.as_view(), name='basket_edit')
+         BasketUpdate.as_view(), name='basket_edit'),
+    path('batch/', BasketBatchUpdate.as_view(), name='basket_batch'),
 ]
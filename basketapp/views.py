@@ -1,35 +1,34 @@
+import json
+
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models import F
 from django.http import HttpResponseRedirect, JsonResponse
 from django.shortcuts import render
 
 # Create your views here.
 from django.template import RequestContext
 from django.urls import reverse_lazy
-from django.views.generic import UpdateView, CreateView, FormView, DeleteView
+from django.views.generic import UpdateView, CreateView, FormView, DeleteView, View
 
-from adminapp.mixin import AuthorisationDispatchMixin
 from authapp.models import User
-from basketapp.models import Basket
-from mainapp.models import Products
+from basketapp.backends import BasketBusy, get_basket_backend
+from mainapp.stock import OutOfStock
 from django.template.loader import render_to_string
+from django.utils.formats import localize
+
+BASKET_BUSY_MESSAGE = 'Корзина сейчас изменяется в другой вкладке, повторите действие'
 
 
-class BasketAdd(CreateView, AuthorisationDispatchMixin):
-    """Добавление товара в корзину"""
+class BasketAdd(CreateView):
+    """Добавление товара в корзину (хранилище корзины - basketapp.backends)"""
 
     def get(self, request, *args, **kwargs):
-        id_product = self.kwargs.get('product_id')
-        user = self.request.user
-        product = Products.objects.get(id=id_product)
-        baskets = Basket.objects.filter(user=user, product=product).select_related('user', 'product')
-        if baskets:
-            basket = baskets.first()
-            basket.quantity = F('quantity') + 1
-            # basket.quantity += 1
-            basket.save()
-        else:
-            Basket.objects.create(user=user, product=product, quantity=1)
+        try:
+            get_basket_backend(request).add(self.kwargs.get('product_id'))
+        except OutOfStock:
+            messages.error(request, 'Товара нет в нужном количестве')
+        except BasketBusy:
+            messages.error(request, BASKET_BUSY_MESSAGE)
         return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
 
 
@@ -48,11 +47,14 @@ class BasketAdd(CreateView, AuthorisationDispatchMixin):
 #         Basket.objects.create(user=user, product=product, quantity=1)
 #     return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
 
-class BasketRemove(DeleteView, AuthorisationDispatchMixin):
-    """Удаление корзины"""
+class BasketRemove(DeleteView):
+    """Удаление корзины. В корзинах из кеша и сессии basket_id - id товара"""
 
     def get(self, request, *args, **kwargs):
-        Basket.objects.get(id=self.kwargs.get('basket_id')).delete()
+        try:
+            get_basket_backend(request).remove(self.kwargs.get('basket_id'))
+        except BasketBusy:
+            messages.error(request, BASKET_BUSY_MESSAGE)
         return HttpResponseRedirect(self.request.META.get('HTTP_REFERER'))
 
 
@@ -62,25 +64,25 @@ class BasketRemove(DeleteView, AuthorisationDispatchMixin):
 #     Basket.objects.get(id=basket_id).delete()
 #     return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
 
-class BasketUpdate(UpdateView, AuthorisationDispatchMixin):
+class BasketUpdate(UpdateView):
     """Изменение корзины"""
 
     def get(self, request, *args, **kwargs):
         if request.is_ajax():
-            basket = Basket.objects.get(id=self.kwargs.get('basket_id'))
-            quantity = self.kwargs.get('quantity')
-            if quantity > 0:
-                basket.quantity = quantity
-                basket.save()
-            else:
-                basket.delete()
+            backend = get_basket_backend(request)
+            error = None
+            try:
+                backend.set_quantities({self.kwargs.get('basket_id'): self.kwargs.get('quantity')})
+            except OutOfStock:
+                error = 'Недостаточно товара на складе'
+            except BasketBusy:
+                error = BASKET_BUSY_MESSAGE
 
-            baskets = Basket.objects.filter(user=request.user).select_related('user')
-            context = {'basket': baskets}
+            context = {'basket': backend.summary()}
 
             result = render_to_string(
                 'basket_includes/basket_include_ajax.html', context=context)
-            return JsonResponse({'result': result})
+            return JsonResponse({'result': result, 'error': error})
 
 # FBV вариант BasketUpdate
 # def basket_edit(request, basket_id, quantity):
@@ -98,3 +100,41 @@ class BasketUpdate(UpdateView, AuthorisationDispatchMixin):
 #         result = render_to_string(
 #             'basket_includes/basket_include_ajax.html', context=context)
 #         return JsonResponse({'result': result})
+
+
+class BasketBatchUpdate(View):
+    """
+    Изменение нескольких строк корзины одним запросом (static/js/basket.js копит клики и отправляет их пачкой).
+    Тело запроса - JSON {"lines": {"id строки": количество, ...}}, в корзинах из кеша и сессии id строки - id товара.
+    Все изменения применяются в одной транзакции, в ответ - только новые количества строк и итоги корзины
+    """
+    MAX_LINES = 100
+
+    def post(self, request, *args, **kwargs):
+        try:
+            quantities = {int(line): int(quantity) for line, quantity in json.loads(request.body)['lines'].items()}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return JsonResponse({'error': 'Неверный формат запроса'}, status=400)
+        if len(quantities) > self.MAX_LINES or any(quantity < 0 for quantity in quantities.values()):
+            return JsonResponse({'error': 'Неверный формат запроса'}, status=400)
+
+        backend = get_basket_backend(request)
+        status, error = 200, None
+        try:
+            lines = backend.set_quantities(quantities)
+        except OutOfStock:
+            status, error = 409, 'Недостаточно товара на складе'
+            lines = backend.get_quantities(quantities)
+        except BasketBusy:
+            status, error = 409, BASKET_BUSY_MESSAGE
+            lines = backend.get_quantities(quantities)
+
+        basket = backend.summary()
+        return JsonResponse({
+            'lines': lines,
+            'count': basket.count,
+            'quantity': basket.quantity,
+            'total_cost': localize(basket.total_cost),
+            'error': error,
+        }, status=status)
+
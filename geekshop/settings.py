@@ -258,3 +258,18 @@ if os.name == 'posix':
 # При LOW_CACHE = True включает кеширование
 # При LOW_CACHE = False отключает кеширование
 LOW_CACHE = False
+
+# Время жизни страниц каталога в кеше. Устаревшие версии вытесняются по этому таймауту
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+# Бэкенд поиска товаров (mainapp.search): 'postgres' - tsvector + GIN индекс,
+# 'memory' - инвертированный индекс в памяти процесса для sqlite
+SEARCH_BACKEND = 'postgres' if DATABASES['default']['ENGINE'].endswith('postgresql') else 'memory'
+
+# Сколько секунд товар в корзине остается зарезервированным после последнего изменения строки.
+# Просроченные строки удаляет и возвращает товар на склад команда expire_baskets
+BASKET_RESERVATION_TTL = 2 * 60 * 60
+
+# Хранилище корзины пользователей (basketapp.backends): 'db' - строки Basket с резервом товара сразу,
+# 'cache' - корзина в кеше, в Basket переносится только при оформлении заказа
+BASKET_BACKEND = 'db'
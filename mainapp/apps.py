@@ -6,3 +6,6 @@ class MainappConfig(AppConfig):
     name = 'mainapp'
     verbose_name = 'Категории | Товары'
     verbose_name_plural = 'Категории | Товары'
+
+    def ready(self):
+        import mainapp.signals  # noqa: F401
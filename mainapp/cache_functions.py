@@ -1,40 +1,191 @@
+import hashlib
+import time
+
 from django.conf import settings
 from django.core.cache import cache
 
-from mainapp.models import Products, ProductCategory
+from mainapp.facets import count_facets, filter_products
+from mainapp.models import Products, ProductCategory, ProductFacet
+
+CATALOG_VERSION_KEY = 'catalog_version'
+CATALOG_PRODUCT_FIELDS = ('id', 'name', 'slug', 'image', 'description', 'price', 'quantity', 'category_id',
+                          'version')
+CATALOG_CATEGORY_FIELDS = ('id', 'name', 'slug', 'is_active', 'active_count', 'in_stock_count')
+FACET_CELL_FIELDS = ('category_id', 'price_bucket', 'in_stock', 'is_active', 'count')
+PRODUCT_PRICES_TIMEOUT = 60
+
+
+def get_catalog_version():
+    """
+    Возвращает текущую версию каталога. Версия входит во все ключи кеша каталога и в ETag страниц.
+    Начальное значение - текущее время, чтобы после вытеснения ключа из кеша версии не повторялись
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = int(time.time())
+        cache.add(CATALOG_VERSION_KEY, version, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY, version)
+    return version
+
+
+def bump_catalog_version():
+    """
+    Увеличивает версию каталога. Все ранее закешированные страницы и категории
+    становятся недоступны и вытесняются из кеша по таймауту
+    """
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, int(time.time()), timeout=None)
+        return cache.incr(CATALOG_VERSION_KEY)
+
+
+def _catalog_key(*parts):
+    return ':'.join(['catalog', str(get_catalog_version()), *map(str, parts)])
+
+
+def get_catalog_fragment_key(fragment_name, vary_on=()):
+    """Ключ фрагмента шаблона, действительный до следующего изменения каталога"""
+    vary = hashlib.md5(':'.join(map(str, vary_on)).encode()).hexdigest()
+    return _catalog_key('fragment', fragment_name, vary)
+
+
+def get_product_card_key(product):
+    """Ключ карточки товара. Не зависит от версии каталога - только от версии самого товара"""
+    return f'product_card:{product["id"]}:{product["version"]}'
 
 
 def get_links_menu_category(cat_slug):
-    """Возвращает ссылки на товары по слагу"""
-    if settings.LOW_CACHE:
-        key = 'category_products'
-        category_product = cache.get(key)
-        if category_product is None:
-            category_product = Products.objects.filter(category__slug=cat_slug).select_related('category')
-            cache.set(key, category_product)
-        return category_product
-    else:
-        return Products.objects.filter(category__slug=cat_slug).select_related('category')
+    """Возвращает активные товары категории по слагу"""
+    return Products.get_items().filter(category__slug=cat_slug).order_by('id')
+
 
 def get_links_menu():
-    """Возвращает все ссылки на товары"""
-    if settings.LOW_CACHE:
-        key = 'all_products'
-        all_products = cache.get(key)
-        if all_products is None:
-            all_products = Products.objects.all()
-            cache.set(key, all_products)
-        return all_products
-    return Products.objects.all()
+    """Возвращает все активные товары"""
+    return Products.get_items().order_by('id')
+
+
+def get_catalog_queryset(cat_slug=None, prices=(), in_stock=False, active=True):
+    """Товары каталога с фасетными фильтрами. active=None - активные и неактивные"""
+    if active:
+        queryset = get_links_menu_category(cat_slug) if cat_slug else get_links_menu()
+    else:
+        queryset = Products.objects.order_by('id')
+        if active is not None:
+            queryset = queryset.filter(is_active=False)
+        if cat_slug:
+            queryset = queryset.filter(category__slug=cat_slug)
+    return filter_products(queryset, prices, in_stock)
+
+
+def get_catalog_count(cat_slug=None, prices=(), in_stock=False, active=True):
+    """
+    Количество товаров в каталоге или категории.
+    Без фильтров читается из счетчиков ProductCategory.active_count, с фильтрами - из фасетов,
+    без COUNT(*) по товарам
+    """
+    categories = get_categories()
+    category_id = None
+    if cat_slug:
+        category_id = next((category['id'] for category in categories if category['slug'] == cat_slug), None)
+        if category_id is None:
+            return 0
+    if prices or in_stock or active is not True:
+        return get_facets(category_id, prices, in_stock, active)['total']
+    if category_id is not None:
+        return next(category['active_count'] for category in categories if category['id'] == category_id)
+    return sum(category['active_count'] for category in categories)
+
+
+def get_catalog_page(cat_slug, page, page_size, prices=(), in_stock=False, active=True):
+    """
+    Возвращает страницу каталога в виде {'count': всего товаров, 'items': [строки товаров]}.
+    Строки - словари с полями CATALOG_PRODUCT_FIELDS, поэтому попадание в кеш не делает запросов в БД
+    """
+    queryset = get_catalog_queryset(cat_slug, prices, in_stock, active)
+
+    def load():
+        offset = (page - 1) * page_size
+        return {
+            'count': get_catalog_count(cat_slug, prices, in_stock, active),
+            'items': list(queryset.values(*CATALOG_PRODUCT_FIELDS)[offset:offset + page_size]),
+        }
+
+    if not settings.LOW_CACHE:
+        return load()
+
+    filters = f'{",".join(map(str, prices))}:{int(in_stock)}:{active}'
+    key = _catalog_key('page', cat_slug or '__all__', filters, page, page_size)
+    catalog_page = cache.get(key)
+    if catalog_page is None:
+        catalog_page = load()
+        cache.set(key, catalog_page, settings.CATALOG_CACHE_TIMEOUT)
+    return catalog_page
+
+
+def get_product_prices(product_ids):
+    """
+    Цены и остатки товаров {id товара: {'price': цена, 'quantity': остаток}}.
+    Закешированные товары берутся одним get_many, остальные читаются одним запросом.
+    Ключи содержат версию каталога: сохранение товара (в том числе смена цены) их сбрасывает.
+    Резерв и возврат остатка в stock.py меняют версию, только когда товар появляется или заканчивается,
+    поэтому остаток может отставать от БД на PRODUCT_PRICES_TIMEOUT - он только справочный,
+    количество проверяется еще раз при резерве
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return {}
+
+    def load(ids):
+        return {product_id: {'price': price, 'quantity': quantity} for product_id, price, quantity in
+                Products.objects.filter(pk__in=ids).values_list('id', 'price', 'quantity')}
+
+    if not settings.LOW_CACHE:
+        return load(product_ids)
+
+    prefix = _catalog_key('price')
+    cached = cache.get_many([f'{prefix}:{product_id}' for product_id in product_ids])
+    prices = {product_id: cached[f'{prefix}:{product_id}'] for product_id in product_ids
+              if f'{prefix}:{product_id}' in cached}
+    missing = product_ids - prices.keys()
+    if missing:
+        loaded = load(missing)
+        cache.set_many({f'{prefix}:{product_id}': item for product_id, item in loaded.items()},
+                       PRODUCT_PRICES_TIMEOUT)
+        prices.update(loaded)
+    return prices
 
 
 def get_categories():
-    """Возвращает все категории"""
+    """Возвращает все категории вместе со счетчиками товаров"""
+    def load():
+        return list(ProductCategory.objects.order_by('id').values(*CATALOG_CATEGORY_FIELDS))
+
     if settings.LOW_CACHE:
-        key = 'all_cats'
+        key = _catalog_key('categories')
         all_cats = cache.get(key)
         if all_cats is None:
-            all_cats = ProductCategory.objects.all()
-            cache.set(key, all_cats)
+            all_cats = load()
+            cache.set(key, all_cats, settings.CATALOG_CACHE_TIMEOUT)
         return all_cats
-    return ProductCategory.objects.all()
+    return load()
+
+
+def get_facet_cells():
+    """Возвращает ненулевые ячейки фасетов каталога кортежами FACET_CELL_FIELDS"""
+    def load():
+        return list(ProductFacet.objects.filter(count__gt=0).values_list(*FACET_CELL_FIELDS))
+
+    if settings.LOW_CACHE:
+        key = _catalog_key('facets')
+        cells = cache.get(key)
+        if cells is None:
+            cells = load()
+            cache.set(key, cells, settings.CATALOG_CACHE_TIMEOUT)
+        return cells
+    return load()
+
+
+def get_facets(category_id=None, prices=(), in_stock=False, active=True):
+    """Количество товаров для каждого значения фасетных фильтров (см. mainapp.facets.count_facets)"""
+    return count_facets(get_facet_cells(), category_id, prices, in_stock, active)
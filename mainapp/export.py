@@ -0,0 +1,74 @@
+"""
+Потоковая выгрузка каталога (товары вместе с категорией) в CSV или JSONL.
+
+Строки читаются из БД через iterator(chunk_size) - в Postgres это серверный курсор,
+в sqlite - fetchmany, поэтому в памяти одновременно держится не больше одной пачки
+строк независимо от размера каталога. Результат - генератор байтовых кусков, который
+пишется в файл (команда export_catalog) или отдается через StreamingHttpResponse.
+"""
+import csv
+import json
+import zlib
+
+from mainapp.models import Products
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+EXPORT_FIELDS = ('id', 'slug', 'name', 'description', 'price', 'quantity', 'is_active', 'image',
+                 'category_id', 'category__slug', 'category__name', 'updated_at')
+EXPORT_COLUMNS = tuple(field.replace('__', '_') for field in EXPORT_FIELDS)
+
+
+class Echo:
+    """Псевдо-файл для csv.writer: возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _jsonl_lines(rows):
+    for row in rows:
+        item = dict(zip(EXPORT_COLUMNS, row))
+        item['price'] = str(item['price'])
+        item['updated_at'] = item['updated_at'].isoformat()
+        yield json.dumps(item, ensure_ascii=False) + '\n'
+
+
+def export_catalog(export_format='csv', compress=False, chunk_size=2000, active_only=False):
+    """
+    Генератор байтовых кусков выгрузки. Строки склеиваются по chunk_size штук,
+    чтобы не отдавать клиенту по одной короткой строке; при compress=True куски сжимаются gzip на лету
+    """
+    queryset = Products.get_items() if active_only else Products.objects.all()
+    rows = queryset.order_by('id').values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+    lines = _csv_lines(rows) if export_format == 'csv' else _jsonl_lines(rows)
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= chunk_size:
+            data = ''.join(buffer).encode('utf-8')
+            buffer = []
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = ''.join(buffer).encode('utf-8')
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def export_filename(export_format, compress=False, date=None):
+    name = f'catalog-{date:%Y%m%d}.{export_format}' if date else f'catalog.{export_format}'
+    return f'{name}.gz' if compress else name
@@ -0,0 +1,92 @@
+"""
+Фасетные фильтры каталога: категория, ценовой диапазон, наличие, активность.
+
+Количество товаров для каждого значения фильтра считается по ячейкам ProductFacet
+(категория, ценовой диапазон, наличие, активность) -> количество, которые обновляются
+при сохранении товара. Ячеек порядка (категорий x 24), поэтому подсчет всех фасетов
+не зависит от числа товаров и не делает запросов кроме загрузки ячеек (они кешируются).
+"""
+from django.db.models import Q
+
+from mainapp.models import Products
+
+PRICE_BUCKETS = Products.PRICE_BUCKETS
+ACTIVE_VALUES = {'1': True, '0': False, 'all': None}
+
+
+def price_label(bucket):
+    """Подпись ценового диапазона"""
+    low = PRICE_BUCKETS[bucket]
+    if bucket + 1 == len(PRICE_BUCKETS):
+        return f'от {low} руб.'
+    if not low:
+        return f'до {PRICE_BUCKETS[bucket + 1]} руб.'
+    return f'{low} - {PRICE_BUCKETS[bucket + 1]} руб.'
+
+
+def parse_prices(values):
+    """Номера ценовых диапазонов из GET параметров, неизвестные значения отбрасываются"""
+    return tuple(sorted({int(value) for value in values
+                         if value.isdigit() and int(value) < len(PRICE_BUCKETS)}))
+
+
+def price_q(prices):
+    """
+    Условие на цену для выбранных диапазонов. Соседние диапазоны склеиваются
+    в один, чтобы условие оставалось диапазоном по индексу (price, id)
+    """
+    ranges = []
+    for bucket in prices:
+        if ranges and ranges[-1][1] == bucket:
+            ranges[-1][1] = bucket + 1
+        else:
+            ranges.append([bucket, bucket + 1])
+    condition = Q()
+    for start, end in ranges:
+        bounds = Q(price__gte=PRICE_BUCKETS[start]) if start else Q()
+        if end < len(PRICE_BUCKETS):
+            bounds &= Q(price__lt=PRICE_BUCKETS[end])
+        condition |= bounds
+    return condition
+
+
+def filter_products(queryset, prices=(), in_stock=False):
+    """Накладывает фильтры по цене и наличию на queryset товаров"""
+    if prices:
+        queryset = queryset.filter(price_q(prices))
+    if in_stock:
+        queryset = queryset.filter(quantity__gt=0)
+    return queryset
+
+
+def count_facets(cells, category_id=None, prices=(), in_stock=False, active=True):
+    """
+    Считает фасеты по ячейкам (category_id, price_bucket, in_stock, is_active, count).
+    Для каждого фильтра количество считается с учетом всех остальных фильтров, кроме него самого,
+    чтобы было видно сколько товаров останется при выборе другого значения.
+    Возвращает {'total', 'categories': {id: n}, 'prices': {bucket: n}, 'in_stock': n, 'active': {bool: n}}
+    """
+    facets = {'total': 0, 'categories': {}, 'prices': dict.fromkeys(range(len(PRICE_BUCKETS)), 0),
+              'in_stock': 0, 'active': {True: 0, False: 0}}
+    prices = set(prices)
+    for cell_category, bucket, cell_in_stock, cell_active, count in cells:
+        matches = {
+            'category': category_id is None or cell_category == category_id,
+            'price': not prices or bucket in prices,
+            'in_stock': not in_stock or cell_in_stock,
+            'active': active is None or cell_active == active,
+        }
+        failed = [name for name, ok in matches.items() if not ok]
+        if len(failed) > 1:
+            continue
+        if not failed:
+            facets['total'] += count
+        if not failed or failed == ['category']:
+            facets['categories'][cell_category] = facets['categories'].get(cell_category, 0) + count
+        if not failed or failed == ['price']:
+            facets['prices'][bucket] += count
+        if (not failed or failed == ['in_stock']) and cell_in_stock:
+            facets['in_stock'] += count
+        if not failed or failed == ['active']:
+            facets['active'][cell_active] += count
+    return facets
@@ -0,0 +1,102 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+
+from mainapp.cache_functions import bump_catalog_version
+from mainapp.models import ProductCategory, ProductFacet, Products
+from mainapp.pagination import KeysetPaginator, encode_cursor, NEXT, KEYSET_ORDERINGS
+from mainapp.search import invalidate_search_index
+
+BENCH_SLUG = 'bench-pagination'
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает OFFSET-пагинацию (Paginator) и keyset-пагинацию на сгенерированном каталоге.
+    Товары создаются в отдельной категории bench-pagination и переиспользуются между запусками.
+    Пример: python manage.py bench_pagination --rows 1000000 --pages 1 10000
+    """
+    help = 'Бенчмарк OFFSET и keyset пагинации каталога'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Размер каталога')
+        parser.add_argument('--page-size', type=int, default=5)
+        parser.add_argument('--pages', type=int, nargs='+', default=[1, 10_000], help='Номера страниц')
+        parser.add_argument('--order', choices=list(KEYSET_ORDERINGS), default='id')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--batch', type=int, default=10_000, help='Размер пачки при генерации')
+        parser.add_argument('--clear', action='store_true', help='Удалить сгенерированный каталог после замера')
+
+    def handle(self, *args, **options):
+        category = self.generate(options['rows'], options['batch'])
+        queryset = Products.objects.filter(category=category)
+        fields = KEYSET_ORDERINGS[options['order']]
+        page_size = options['page_size']
+
+        for number in options['pages']:
+            offset_time = self.measure(options['repeat'], lambda: list(
+                Paginator(queryset.order_by(*fields), page_size).page(number).object_list))
+
+            # курсор на начало страницы находим один раз, в замер он не входит
+            cursor = None
+            if number > 1:
+                boundary = queryset.order_by(*fields).values(*fields)[(number - 1) * page_size - 1]
+                cursor = encode_cursor(NEXT, options['order'], [boundary[field] for field in fields])
+            paginator = KeysetPaginator(queryset, page_size, options['order'])
+            keyset_time = self.measure(options['repeat'], lambda: paginator.page(cursor).object_list)
+
+            self.stdout.write(
+                f'страница {number:>8}: offset {offset_time * 1000:8.2f} мс, keyset {keyset_time * 1000:8.2f} мс')
+
+        if options['clear']:
+            self.clear(category)
+
+    def generate(self, rows, batch):
+        """Дозаполняет тестовую категорию до rows товаров через bulk_create"""
+        category, _ = ProductCategory.objects.get_or_create(slug=BENCH_SLUG, defaults={'name': 'Бенчмарк'})
+        exists = Products.objects.filter(category=category).count()
+        started = time.perf_counter()
+        for start in range(exists, rows, batch):
+            with transaction.atomic():
+                Products.objects.bulk_create([
+                    Products(name=f'Товар {i}', slug=f'{BENCH_SLUG}-{i}', category=category,
+                             price=i % 100_000, quantity=i % 7)
+                    for i in range(start, min(start + batch, rows))
+                ])
+            self.stdout.write(f'\rсоздано {min(start + batch, rows)} из {rows}', ending='')
+        if exists < rows:
+            # bulk_create обходит save(), поэтому счетчики и фасеты пересчитываются целиком
+            ProductCategory.recount_counters()
+            ProductFacet.rebuild()
+            self.stdout.write(f'\nкаталог сгенерирован за {time.perf_counter() - started:.1f} с')
+        return category
+
+    def clear(self, category):
+        """
+        Удаляет тестовую категорию с товарами. Товары удаляются одним SQL DELETE в обход сигналов
+        (пересчет счетчиков, индекс поиска, версия каталога на каждую строку), агрегаты пересчитываются один раз.
+        На сгенерированные товары не ссылаются корзины и заказы, поэтому каскад Django не нужен
+        """
+        table = connection.ops.quote_name(Products._meta.db_table)
+        column = connection.ops.quote_name(Products._meta.get_field('category').column)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {table} WHERE {column} = %s', [category.pk])
+            category.delete()
+            ProductCategory.recount_counters()
+            ProductFacet.rebuild()
+        bump_catalog_version()
+        invalidate_search_index()
+        self.stdout.write('тестовый каталог удален')
+
+    @staticmethod
+    def measure(repeat, func):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
@@ -0,0 +1,102 @@
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template import Context, Template
+from django.test import RequestFactory, override_settings
+
+from mainapp.cache_functions import get_catalog_page
+from mainapp.models import ProductCategory, Products, ProductFacet
+from mainapp.views import ProductsView
+
+BENCH_SLUG = 'bench-render'
+
+# цикл карточек в том виде, в каком он был в products.html до кеширования фрагментов
+INLINE_CARDS = Template('''{% for good in products %}{% include 'mainapp_includes/product_card.html' %}{% endfor %}''')
+CACHED_CARDS = Template('''{% load my_tags %}{% product_cards products %}''')
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает рендер страницы каталога без кеша фрагментов (как раньше: каждая карточка и
+    боковая панель рендерятся заново) и с кешем карточек и боковой панели.
+    Товары создаются в отдельной категории bench-render и переиспользуются между запусками.
+    Пример: python manage.py bench_render --products 10000 --per-page 30
+    """
+    help = 'Бенчмарк рендера страницы каталога с кешем фрагментов и без'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000, help='Размер тестовой категории')
+        parser.add_argument('--per-page', type=int, default=30)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--clear', action='store_true', help='Удалить сгенерированные товары после замера')
+
+    def handle(self, *args, **options):
+        category = self.generate(options['products'])
+        per_page = options['per_page']
+        view = ProductsView.as_view(paginate_by=per_page)
+        url = f'/category_id/{category.slug}/'
+
+        def render_page():
+            request = RequestFactory().get(url)
+            request.user = AnonymousUser()
+            request.session = SessionStore()
+            return view(request, cat_slug=category.slug).render()
+
+        def cold_page():
+            cache.clear()
+            render_page()
+
+        products = get_catalog_page(category.slug, 1, per_page)['items']
+        context = Context({'products': products})
+
+        with override_settings(LOW_CACHE=False):
+            plain = self.measure(options['repeat'], render_page)
+            inline = self.measure(options['repeat'], lambda: INLINE_CARDS.render(context))
+        with override_settings(LOW_CACHE=True):
+            cold = self.measure(options['repeat'], cold_page)
+            render_page()
+            warm = self.measure(options['repeat'], render_page)
+            CACHED_CARDS.render(context)
+            cards = self.measure(options['repeat'], lambda: CACHED_CARDS.render(context))
+
+        self.stdout.write(f'страница каталога ({per_page} товаров):')
+        self.stdout.write(f'  без кеша        {plain * 1000:8.2f} мс')
+        self.stdout.write(f'  холодный кеш    {cold * 1000:8.2f} мс')
+        self.stdout.write(f'  теплый кеш      {warm * 1000:8.2f} мс  (x{plain / warm:.1f})')
+        self.stdout.write('только карточки:')
+        self.stdout.write(f'  цикл в шаблоне  {inline * 1000:8.2f} мс')
+        self.stdout.write(f'  product_cards   {cards * 1000:8.2f} мс  (x{inline / cards:.1f})')
+
+        if options['clear']:
+            Products.objects.filter(category=category).delete()
+            category.delete()
+
+    def generate(self, total):
+        """Дозаполняет тестовую категорию до total товаров"""
+        category, _ = ProductCategory.objects.get_or_create(slug=BENCH_SLUG, defaults={'name': 'Бенчмарк рендера'})
+        exists = Products.objects.filter(category=category).count()
+        with transaction.atomic():
+            Products.objects.bulk_create([
+                Products(name=f'Товар {i}', slug=f'{BENCH_SLUG}-{i}', category=category, price=i % 10_000,
+                         quantity=i % 7, image=f'products_images/{BENCH_SLUG}-{i}.jpg')
+                for i in range(exists, total)
+            ])
+        if exists < total:
+            # bulk_create обходит save(), поэтому счетчики и фасеты пересчитываются целиком
+            ProductCategory.recount_counters()
+            ProductFacet.rebuild()
+        return category
+
+    @staticmethod
+    def measure(repeat, func):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings)
@@ -0,0 +1,90 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from mainapp.models import ProductCategory, Products
+from mainapp.search import BACKENDS, tokenize
+
+BENCH_SLUG = 'bench-search'
+ADJECTIVES = ('синяя', 'красная', 'черные', 'белый', 'зимняя', 'летние', 'кожаные', 'спортивный', 'теплая',
+              'легкие', 'водонепроницаемая', 'стильные', 'классический', 'детские', 'мужская', 'женские')
+NOUNS = ('куртка', 'ботинки', 'кроссовки', 'рубашка', 'футболка', 'джинсы', 'пальто', 'шапка', 'перчатки',
+         'рюкзак', 'сумка', 'платье', 'юбка', 'свитер', 'толстовка', 'кеды', 'сапоги', 'шорты')
+BRANDS = ('The North Face', 'Adidas', 'Nike', 'Puma', 'Reebok', 'Columbia', 'Levis', 'Zara', 'Mango', 'Gap')
+DESCRIPTION = ('удобная', 'прочный', 'материал', 'хлопок', 'полиэстер', 'подкладка', 'капюшон', 'застежка',
+               'молния', 'карманы', 'размер', 'сезон', 'уход', 'стирка', 'коллекция', 'новинка', 'скидка')
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает бэкенды поиска на сгенерированном каталоге: время построения индекса
+    и задержки (p50/p95/p99) для точных слов, префиксов и запросов с опечатками.
+    Пример: python manage.py bench_search --products 500000
+    """
+    help = 'Бенчмарк бэкендов поиска товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=500_000, help='Размер каталога')
+        parser.add_argument('--queries', type=int, default=1000, help='Запросов каждого вида')
+        parser.add_argument('--backends', nargs='+', choices=list(BACKENDS), help='По умолчанию - доступные для БД')
+        parser.add_argument('--batch', type=int, default=10_000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self.generate(options['products'], options['batch'])
+
+        backends = options['backends'] or ['memory'] + (['postgres'] if connection.vendor == 'postgresql' else [])
+        queries = self.queries(options['queries'])
+        for name in backends:
+            backend = BACKENDS[name]()
+            started = time.perf_counter()
+            backend.rebuild()
+            self.stdout.write(f'{name}: индекс построен за {time.perf_counter() - started:.1f} с')
+            for kind, batch in queries.items():
+                backend.search(batch[0])  # прогрев
+                timings, found = [], 0
+                for query in batch:
+                    started = time.perf_counter()
+                    found += bool(backend.search(query))
+                    timings.append((time.perf_counter() - started) * 1000)
+                quantiles = statistics.quantiles(timings, n=100)
+                self.stdout.write(
+                    f'  {kind:<10} p50 {quantiles[49]:6.2f} мс  p95 {quantiles[94]:6.2f} мс  '
+                    f'p99 {quantiles[98]:6.2f} мс  найдено {found}/{len(batch)}')
+
+    def generate(self, count, batch):
+        """Дозаполняет тестовую категорию до count товаров"""
+        category, _ = ProductCategory.objects.get_or_create(slug=BENCH_SLUG, defaults={'name': 'Бенчмарк поиска'})
+        exists = Products.objects.filter(category=category).count()
+        for start in range(exists, count, batch):
+            with transaction.atomic():
+                Products.objects.bulk_create([
+                    Products(name=self.name(i), description=' '.join(random.choices(DESCRIPTION, k=12)),
+                             slug=f'{BENCH_SLUG}-{i}', category=category, price=i % 10_000)
+                    for i in range(start, min(start + batch, count))
+                ])
+            self.stdout.write(f'\rсоздано {min(start + batch, count)} из {count}', ending='')
+        if exists < count:
+            self.stdout.write('')
+
+    @staticmethod
+    def name(i):
+        return f'{random.choice(ADJECTIVES)} {random.choice(NOUNS)} {random.choice(BRANDS)} {i % 50_000}'
+
+    def queries(self, count):
+        words = [self.name(random.randrange(1_000_000)).split() for _ in range(count)]
+
+        def typo(word):
+            i = random.randrange(1, len(word) - 1)
+            return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+        return {
+            'слова': [f'{adjective} {noun}' for adjective, noun, *_ in words],
+            'модель': [f'{noun} {number}' for _, noun, *_, number in words],
+            'префикс': [f'{adjective} {noun[:4]}' for adjective, noun, *_ in words],
+            'опечатка': [typo(noun) for _, noun, *_ in words if len(tokenize(noun)[0]) > 4],
+        }
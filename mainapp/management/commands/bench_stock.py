@@ -0,0 +1,72 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from mainapp import stock
+from mainapp.models import ProductCategory, Products
+
+BENCH_SLUG = 'bench-stock'
+
+
+def stress(product_id, threads, attempts, quantity=1):
+    """
+    Запускает threads потоков, каждый из которых attempts раз резервирует quantity единиц товара.
+    Возвращает (число успешных резервов, время в секундах)
+    """
+    reserved = []
+    errors = []
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        done = 0
+        try:
+            barrier.wait()
+            for _ in range(attempts):
+                if stock.reserve(product_id, quantity):
+                    done += 1
+        except Exception as error:
+            errors.append(error)
+        finally:
+            reserved.append(done)
+            connection.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return sum(reserved), time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочная проверка резервирования остатков: несколько потоков одновременно разбирают
+    один товар. Проверяет, что продано не больше, чем было на складе, и печатает число резервов в секунду.
+    Пример: python manage.py bench_stock --stock 1000 --threads 16 --attempts 100
+    """
+    help = 'Нагрузочный тест резервирования остатков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stock', type=int, default=1000, help='Начальный остаток товара')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--attempts', type=int, default=200, help='Попыток резерва на поток')
+
+    def handle(self, *args, **options):
+        category, _ = ProductCategory.objects.get_or_create(slug=BENCH_SLUG, defaults={'name': 'Бенчмарк склада'})
+        product, _ = Products.objects.get_or_create(slug=BENCH_SLUG, defaults={'name': 'Товар', 'category': category})
+        product.quantity = options['stock']
+        product.save()
+
+        threads, attempts = options['threads'], options['attempts']
+        reserved, elapsed = stress(product.pk, threads, attempts)
+        left = Products.objects.values_list('quantity', flat=True).get(pk=product.pk)
+
+        self.stdout.write(f'попыток: {threads * attempts}, зарезервировано: {reserved}, остаток: {left}')
+        self.stdout.write(f'{threads * attempts / elapsed:.0f} попыток/с, {reserved / elapsed:.0f} резервов/с')
+        if reserved + left != options['stock'] or reserved > options['stock']:
+            raise CommandError('Остаток не сошелся: продано больше, чем было на складе')
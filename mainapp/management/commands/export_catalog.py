@@ -0,0 +1,38 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from mainapp.export import EXPORT_FORMATS, export_catalog
+
+
+class Command(BaseCommand):
+    """
+    Потоковая выгрузка каталога в CSV или JSONL (см. mainapp.export).
+    Память не растет с размером каталога: строки читаются и пишутся пачками.
+    Пример: python manage.py export_catalog --format jsonl --gzip -o catalog.jsonl.gz
+    """
+    help = 'Выгрузка товаров с категориями в CSV / JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-o', '--output', help='Файл выгрузки (по умолчанию stdout)')
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Сжимать gzip на лету')
+        parser.add_argument('--active', action='store_true', help='Только активные товары')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Строк в одной выборке из БД')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        chunks = export_catalog(options['format'], options['gzip'], options['chunk_size'], options['active'])
+        written = 0
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
+        self.stderr.write(f'Выгружено {written / 2 ** 20:.1f} МБ за {time.perf_counter() - started:.1f} с')
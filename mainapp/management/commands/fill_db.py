@@ -1,39 +1,22 @@
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
-import json
 
 from authapp.models import User
 from mainapp.models import ProductCategory, Products
 
-
-def read_json(file_path):
-    with open(f'mainapp/fixtures/{file_path}', 'r', encoding='utf-8') as f:
-        return json.load(f)
+FIXTURES = ('mainapp/fixtures/productcategory.json', 'mainapp/fixtures/products.json')
 
 
 class Command(BaseCommand):
     """
-    Заполняет БД данными из ../fixtures/productcategory.json и ../fixtures/products.json,
-    Создает суперпользователя name=root password=123
+    Заполняет БД данными из ../fixtures/productcategory.json и ../fixtures/products.json
+    (через import_catalog), создает суперпользователя name=root password=123
     """
 
     def handle(self, *args, **options):
-        ProductCategory.objects.all().delete()
-        categories = read_json('productcategory.json')
-
-        for category in categories:
-            cat = category.get('fields')
-            cat['id'] = category.get('pk')
-            ProductCategory(**cat).save()
-
         Products.objects.all().delete()
-        products = read_json('products.json')
-
-        for product in products:
-            prod = product.get('fields')
-            cat = prod.get('category')
-            _cat_id = ProductCategory.objects.get(id=cat)
-            prod['category'] = _cat_id
-            Products(**prod).save()
+        ProductCategory.objects.all().delete()
+        call_command('import_catalog', *FIXTURES, restart=True, stdout=self.stdout, stderr=self.stderr)
 
         try:
             User.objects.get(username='root').delete()
@@ -0,0 +1,316 @@
+import codecs
+import json
+import os
+import re
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from basketapp.summary import invalidate_basket_summaries
+from mainapp.cache_functions import bump_catalog_version
+from mainapp.models import ProductCategory, Products, ProductFacet
+from mainapp.search import invalidate_search_index
+
+SEPARATORS = re.compile(r'[ \t\r\n,\[\]]*')
+MAX_RECORD_SIZE = 1 << 20
+CATEGORY_MODEL = 'mainapp.productcategory'
+PRODUCT_MODEL = 'mainapp.products'
+CATEGORY_FIELDS = ('name', 'description', 'is_active')
+PRODUCT_FIELDS = ('name', 'image', 'description', 'price', 'quantity', 'category', 'is_active')
+
+
+def read_records(path, offset=0, chunk_size=1 << 16):
+    """
+    Потоково читает записи из JSON-массива или JSONL, не загружая файл целиком.
+    Возвращает пары (запись, байтовая позиция сразу после записи) - с этой позиции
+    чтение можно продолжить после сбоя
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        buffer, index, position, eof = '', 0, offset, False
+        while True:
+            # между записями допускаются пробелы, переводы строк, запятые и скобки массива
+            separators = SEPARATORS.match(buffer, index).end()
+            position += separators - index
+            index = separators
+            try:
+                if index == len(buffer):
+                    raise ValueError
+                record, end = decoder.raw_decode(buffer, index)
+            except ValueError:
+                if eof or len(buffer) - index > MAX_RECORD_SIZE:
+                    if index < len(buffer):
+                        raise CommandError(f'{path}: неверный JSON на позиции {position}')
+                    return
+                chunk = file.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[index:] + utf8.decode(chunk, final=eof)
+                index = 0
+                continue
+            position += len(buffer[index:end].encode('utf-8'))
+            index = end
+            yield record, position
+
+
+def upsert(model, objs, update_fields, batch_size, increment=()):
+    """
+    INSERT ... ON CONFLICT (slug) DO UPDATE пачками (Postgres и sqlite 3.24+).
+    Существующие строки обновляются только если изменилось одно из update_fields, тогда же
+    обновляется updated_at и увеличиваются поля increment. Возвращает число записанных строк
+    """
+    meta, quote = model._meta, connection.ops.quote_name
+    table = quote(meta.db_table)
+    fields = [field for field in meta.concrete_fields if not field.primary_key]
+    columns = [quote(meta.get_field(name).column) for name in update_fields]
+    distinct = 'IS DISTINCT FROM' if connection.vendor == 'postgresql' else 'IS NOT'
+    assignments = [f'{column} = EXCLUDED.{column}' for column in [*columns, quote('updated_at')]]
+    assignments += [f'{quote(name)} = {table}.{quote(name)} + 1' for name in increment]
+    sql = (f'INSERT INTO {table} ({", ".join(quote(field.column) for field in fields)}) VALUES {{}} '
+           f'ON CONFLICT ({quote("slug")}) DO UPDATE SET {", ".join(assignments)} '
+           f'WHERE ({", ".join(f"{table}.{column}" for column in columns)}) {distinct} '
+           f'({", ".join(f"EXCLUDED.{column}" for column in columns)})')
+    placeholders = f'({", ".join(["%s"] * len(fields))})'
+
+    batch_size = min(batch_size, connection.ops.bulk_batch_size(fields, objs) or batch_size)
+    written = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            params = [field.get_db_prep_save(field.pre_save(obj, True), connection)
+                      for obj in batch for field in fields]
+            cursor.execute(sql.format(', '.join([placeholders] * len(batch))), params)
+            written += cursor.rowcount
+    return written
+
+
+class Checkpoint:
+    """
+    Позиция импорта: номер файла, байтовая позиция в нем и соответствие id категорий
+    из файла id в БД. Записывается после каждой зафиксированной транзакции
+    """
+
+    def __init__(self, path, files):
+        self.path = path
+        self.files = [(os.path.abspath(file), os.path.getsize(file)) for file in files]
+        self.file_index = self.offset = self.records = 0
+        self.categories = {}
+
+    def load(self):
+        """Загружает сохраненную позицию, если она относится к тем же файлам"""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding='utf-8') as file:
+            state = json.load(file)
+        if [tuple(item) for item in state['files']] != self.files:
+            raise CommandError(f'Контрольная точка {self.path} относится к другим файлам, используйте --restart')
+        self.file_index, self.offset, self.records = state['file_index'], state['offset'], state['records']
+        self.categories = state['categories']
+        return True
+
+    def save(self):
+        state = {'files': self.files, 'file_index': self.file_index, 'offset': self.offset,
+                 'records': self.records, 'categories': self.categories}
+        with open(f'{self.path}.tmp', 'w', encoding='utf-8') as file:
+            json.dump(state, file)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def delete(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Command(BaseCommand):
+    """
+    Импорт каталога из JSON (формат фикстур Django или массив товаров) и JSONL.
+    Файлы читаются потоково, категории и товары записываются пачками INSERT ... ON CONFLICT
+    (товары и категории сопоставляются по slug), каждые --chunk-size записей - отдельная транзакция.
+    После каждой транзакции позиция сохраняется в контрольную точку, и повторный запуск после
+    сбоя продолжает импорт с нее. В конце пересчитываются счетчики категорий, фасеты и поиск.
+    Пример: python manage.py import_catalog categories.json products.jsonl --batch-size 2000
+    """
+    help = 'Потоковый импорт категорий и товаров из JSON / JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='Файлы JSON или JSONL, обрабатываются по порядку')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Записей в одном bulk-запросе')
+        parser.add_argument('--chunk-size', type=int, default=10_000, help='Записей в одной транзакции')
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить данные, ничего не записывать')
+        parser.add_argument('--checkpoint', help='Файл контрольной точки (по умолчанию <первый файл>.checkpoint)')
+        parser.add_argument('--restart', action='store_true', help='Начать заново, игнорируя контрольную точку')
+        parser.add_argument('--max-errors', type=int, default=100, help='Прервать импорт после стольких ошибок')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.max_errors = options['max_errors']
+        self.errors = 0
+        self.written = 0
+
+        checkpoint = Checkpoint(options['checkpoint'] or f'{options["files"][0]}.checkpoint', options['files'])
+        if options['restart']:
+            checkpoint.delete()
+        elif not self.dry_run and checkpoint.load():
+            self.stdout.write(f'Продолжение с записи {checkpoint.records}: '
+                              f'{options["files"][checkpoint.file_index]}, позиция {checkpoint.offset}')
+        self.category_ids = {**self.load_categories(), **checkpoint.categories}
+
+        started = time.perf_counter()
+        total_size = sum(size for _, size in checkpoint.files)
+        done_size = sum(size for _, size in checkpoint.files[:checkpoint.file_index])
+        for file_index in range(checkpoint.file_index, len(options['files'])):
+            path, size = options['files'][file_index], checkpoint.files[file_index][1]
+            offset = checkpoint.offset if file_index == checkpoint.file_index else 0
+            chunk = []
+            for record, position in read_records(path, offset):
+                chunk.append(record)
+                if len(chunk) >= options['chunk_size']:
+                    self.write_chunk(chunk)
+                    self.commit(checkpoint, file_index, position, len(chunk))
+                    self.progress(checkpoint.records, done_size + position, total_size, started)
+                    chunk = []
+            self.write_chunk(chunk)
+            self.commit(checkpoint, file_index + 1, 0, len(chunk))
+            done_size += size
+            self.progress(checkpoint.records, done_size, total_size, started)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write('')
+        if self.dry_run:
+            self.stdout.write(f'Проверено записей: {checkpoint.records}, ошибок: {self.errors}')
+            return
+
+        checkpoint.delete()
+        ProductCategory.recount_counters()
+        ProductFacet.rebuild()
+        bump_catalog_version()
+        invalidate_search_index()
+        # цены менялись в обход сигналов
+        invalidate_basket_summaries()
+        self.stdout.write(f'Импортировано за {elapsed:.1f} с: записано (создано или изменено) {self.written}, '
+                          f'ошибок {self.errors}')
+
+    def commit(self, checkpoint, file_index, offset, records):
+        checkpoint.file_index, checkpoint.offset = file_index, offset
+        checkpoint.records += records
+        checkpoint.categories = {key: value for key, value in self.category_ids.items() if key.startswith('pk:')}
+        if not self.dry_run:
+            checkpoint.save()
+
+    def progress(self, records, position, total_size, started):
+        elapsed = time.perf_counter() - started or 1e-9
+        percent = position * 100 / total_size if total_size else 100
+        self.stdout.write(f'\r{records} записей, {percent:5.1f}%, {records / elapsed:,.0f} записей/с', ending='')
+        self.stdout.flush()
+
+    @staticmethod
+    def load_categories():
+        """Все категории БД: ключи 'pk:<id>' и 'slug:<slug>' -> id"""
+        category_ids = {}
+        for category_id, slug in ProductCategory.objects.values_list('id', 'slug'):
+            category_ids[f'pk:{category_id}'] = category_ids[f'slug:{slug}'] = category_id
+        return category_ids
+
+    def error(self, record, message):
+        self.errors += 1
+        self.stderr.write(f'\n{message}: {json.dumps(record, ensure_ascii=False)[:200]}')
+        if self.errors >= self.max_errors:
+            raise CommandError(f'Слишком много ошибок ({self.errors}), импорт прерван')
+
+    def write_chunk(self, records):
+        """Проверяет и записывает пачку записей одной транзакцией. Категории пишутся раньше товаров"""
+        categories, products = [], []
+        for record in records:
+            if not isinstance(record, dict):
+                self.error(record, 'Запись должна быть объектом')
+                continue
+            model, fields = str(record.get('model', PRODUCT_MODEL)).lower(), record.get('fields', record)
+            if model == CATEGORY_MODEL:
+                categories.append((record, fields))
+            elif model == PRODUCT_MODEL:
+                products.append((record, fields))
+            else:
+                self.error(record, f'Неизвестная модель {model}')
+
+        with transaction.atomic():
+            self.write_categories(categories)
+            self.write_products(products)
+            if self.dry_run:
+                transaction.set_rollback(True)
+
+    def write_categories(self, records):
+        valid = {}
+        for record, fields in records:
+            category = ProductCategory(name=fields.get('name'), slug=fields.get('slug'),
+                                       description=fields.get('description') or '',
+                                       is_active=fields.get('is_active', True))
+            try:
+                category.clean_fields(exclude=['updated_at'])
+            except ValidationError as e:
+                self.error(record, e.messages[0])
+                continue
+            valid[category.slug] = (record, record.get('pk', fields.get('id')), category)
+        valid = self.check_category_names(valid)
+        if not valid:
+            return
+
+        if self.dry_run:
+            ids = dict.fromkeys(valid, -1)
+        else:
+            self.written += upsert(ProductCategory, [category for _, _, category in valid.values()],
+                                   CATEGORY_FIELDS, self.batch_size)
+            # upsert не возвращает id в sqlite - дочитываем их по slug
+            ids = dict(ProductCategory.objects.filter(slug__in=list(valid)).values_list('slug', 'id'))
+        for slug, (_, feed_pk, _) in valid.items():
+            self.category_ids[f'slug:{slug}'] = ids[slug]
+            if feed_pk is not None:
+                self.category_ids[f'pk:{feed_pk}'] = ids[slug]
+
+    def check_category_names(self, valid):
+        """
+        Название категории тоже уникально, а upsert сопоставляет категории только по slug:
+        категории, чье название занято другим slug в файле или в БД, отбрасываются с ошибкой
+        """
+        taken = dict(ProductCategory.objects.filter(name__in=[category.name for _, _, category in valid.values()])
+                     .values_list('name', 'slug'))
+        checked = {}
+        for slug, (record, feed_pk, category) in valid.items():
+            if taken.setdefault(category.name, slug) != slug:
+                self.error(record, f'Категория с названием {category.name} уже есть (slug {taken[category.name]})')
+                continue
+            checked[slug] = (record, feed_pk, category)
+        return checked
+
+    def resolve_category(self, value):
+        """Категория товара задается id из файла (или БД) либо slug"""
+        if isinstance(value, int) or str(value).isdigit():
+            return self.category_ids.get(f'pk:{value}')
+        return self.category_ids.get(f'slug:{value}')
+
+    def write_products(self, records):
+        valid = {}
+        for record, fields in records:
+            category_id = self.resolve_category(fields.get('category'))
+            if category_id is None:
+                self.error(record, f'Неизвестная категория {fields.get("category")}')
+                continue
+            try:
+                product = Products(name=fields.get('name'), slug=fields.get('slug'), category_id=category_id,
+                                   image=fields.get('image') or '', description=fields.get('description') or '',
+                                   price=Decimal(str(fields.get('price', 0))), quantity=int(fields.get('quantity', 0)),
+                                   is_active=fields.get('is_active', True))
+                product.clean_fields(exclude=['category', 'updated_at'])
+            except (InvalidOperation, TypeError, ValueError):
+                self.error(record, 'Неверная цена или количество')
+                continue
+            except ValidationError as e:
+                self.error(record, e.messages[0])
+                continue
+            valid[product.slug] = product
+        if valid and not self.dry_run:
+            self.written += upsert(Products, list(valid.values()), PRODUCT_FIELDS, self.batch_size,
+                                   increment=('version',))
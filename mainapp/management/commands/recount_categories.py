@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from mainapp.cache_functions import bump_catalog_version
+from mainapp.models import ProductCategory, ProductFacet
+
+FACET_FIELDS = ('category_id', 'price_bucket', 'in_stock', 'is_active', 'count')
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает счетчики товаров всех категорий и фасеты каталога,
+    выводит категории, где счетчики разошлись
+    """
+    help = 'Пересчет счетчиков active_count / in_stock_count у категорий и фасетов каталога'
+
+    def handle(self, *args, **options):
+        fields = ('id', 'name', *ProductCategory.COUNTER_FIELDS)
+        with transaction.atomic():
+            before = {row['id']: row for row in ProductCategory.objects.select_for_update().values(*fields)}
+            ProductCategory.recount_counters()
+            after = ProductCategory.objects.values(*fields)
+            cells = set(ProductFacet.objects.filter(count__gt=0).values_list(*FACET_FIELDS))
+            ProductFacet.rebuild()
+            facets_changed = cells != set(ProductFacet.objects.values_list(*FACET_FIELDS))
+
+        repaired = 0
+        for row in after:
+            old = before[row['id']]
+            if any(old[field] != row[field] for field in ProductCategory.COUNTER_FIELDS):
+                repaired += 1
+                self.stdout.write(
+                    f'{row["name"]}: активных {old["active_count"]} -> {row["active_count"]}, '
+                    f'в наличии {old["in_stock_count"]} -> {row["in_stock_count"]}')
+        if facets_changed:
+            self.stdout.write('Фасеты каталога пересчитаны')
+        if repaired or facets_changed:
+            bump_catalog_version()
+        self.stdout.write(f'Категорий: {len(before)}, исправлено: {repaired}')
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.6 on 2026-10-18 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0002_auto_20220710_1320'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='products',
+            index=models.Index(fields=['price', 'id'], name='mainapp_pro_price_b3ac80_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='products',
+            index=models.Index(fields=['category', 'id'], name='mainapp_pro_categor_47f3b1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='products',
+            index=models.Index(fields=['category', 'price', 'id'], name='mainapp_pro_categor_761c63_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.6 on 2026-10-18 13:15
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    ProductCategory = apps.get_model('mainapp', 'ProductCategory')
+    Products = apps.get_model('mainapp', 'Products')
+
+    def count(**filters):
+        products = Products.objects.filter(category=OuterRef('pk'), is_active=True, **filters)
+        return Coalesce(Subquery(products.order_by().values('category')
+                                 .annotate(total=Count('pk')).values('total')), Value(0))
+
+    ProductCategory.objects.update(active_count=count(), in_stock_count=count(quantity__gt=0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0003_auto_20261018_1313'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productcategory',
+            name='active_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Активных товаров'),
+        ),
+        migrations.AddField(
+            model_name='productcategory',
+            name='in_stock_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Товаров в наличии'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+# Выражение должно совпадать с mainapp.search.PG_DOCUMENT
+DOCUMENT = ("setweight(to_tsvector('russian'::regconfig, coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('russian'::regconfig, coalesce(description, '')), 'B')")
+
+
+def create_search_indexes(apps, schema_editor):
+    """GIN индексы полнотекстового и триграммного поиска. Только для Postgres"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(f'CREATE INDEX IF NOT EXISTS mainapp_products_search_idx '
+                          f'ON mainapp_products USING gin (({DOCUMENT}))')
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS mainapp_products_name_trgm_idx '
+                          'ON mainapp_products USING gin (name gin_trgm_ops)')
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS mainapp_products_search_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS mainapp_products_name_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0004_productcategory_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.6 on 2026-10-18 13:25
+
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, Value, When
+import django.db.models.deletion
+
+PRICE_BUCKETS = (0, 1000, 3000, 5000, 10000, 20000)
+
+
+def fill_facets(apps, schema_editor):
+    Products = apps.get_model('mainapp', 'Products')
+    ProductFacet = apps.get_model('mainapp', 'ProductFacet')
+
+    bucket = Case(*(When(price__gte=bound, then=Value(i)) for i, bound in reversed(list(enumerate(PRICE_BUCKETS)))),
+                  default=Value(0), output_field=IntegerField())
+    stock = Case(When(quantity__gt=0, then=Value(True)), default=Value(False), output_field=models.BooleanField())
+    cells = (Products.objects.order_by().annotate(bucket=bucket, stock=stock)
+             .values('category', 'bucket', 'stock', 'is_active').annotate(total=Count('pk')))
+    ProductFacet.objects.bulk_create([
+        ProductFacet(category_id=cell['category'], price_bucket=cell['bucket'], in_stock=cell['stock'],
+                     is_active=cell['is_active'], count=cell['total'])
+        for cell in cells
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0005_products_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_bucket', models.PositiveSmallIntegerField(verbose_name='Ценовой диапазон')),
+                ('in_stock', models.BooleanField(verbose_name='В наличии')),
+                ('is_active', models.BooleanField(verbose_name='Активность')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Товаров')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mainapp.productcategory', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'фасет',
+                'verbose_name_plural': 'Фасеты',
+                'unique_together': {('category', 'price_bucket', 'in_stock', 'is_active')},
+            },
+        ),
+        migrations.RunPython(fill_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.6 on 2026-10-18 13:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0006_productfacet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='products',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False, verbose_name='Версия'),
+        ),
+    ]
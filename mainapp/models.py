@@ -1,4 +1,9 @@
-from django.db import models
+from bisect import bisect_right
+from collections import defaultdict
+
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, F, OuterRef, Subquery, Value, Case, When, IntegerField
+from django.db.models.functions import Coalesce
 
 
 # Create your models here.
@@ -9,20 +14,77 @@ class ProductCategory(models.Model):
         verbose_name = 'категория'
         verbose_name_plural = 'Категории'
 
+    COUNTER_FIELDS = ('active_count', 'in_stock_count')
+
     name = models.CharField(max_length=64, unique=True, verbose_name='Название')
     description = models.TextField(blank=True, null=True, verbose_name='Описание')
     is_active = models.BooleanField(default=True, verbose_name='Активность')
     slug = models.SlugField(max_length=256, unique=True, db_index=True, verbose_name='URL')
+    active_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Активных товаров')
+    in_stock_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Товаров в наличии')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Изменена')
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Счетчики меняются только через update_counters, иначе сохранение формы
+        # из админки затрет их значениями на момент загрузки объекта
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.COUNTER_FIELDS]
+        super(ProductCategory, self).save(*args, **kwargs)
+
+    @staticmethod
+    def update_counters(changes):
+        """
+        Применяет к счетчикам категорий изменения товаров.
+        changes - пары (старое состояние, новое состояние) из Products.counted_state(),
+        None означает что товара до/после изменения нет
+        """
+        deltas = defaultdict(lambda: [0, 0])
+        for old, new in changes:
+            for state, sign in ((old, -1), (new, 1)):
+                if state is None:
+                    continue
+                category_id, is_active, in_stock, _ = state
+                if is_active:
+                    deltas[category_id][0] += sign
+                    deltas[category_id][1] += sign if in_stock else 0
+
+        for category_id, (active, in_stock) in deltas.items():
+            if active or in_stock:
+                ProductCategory.objects.filter(pk=category_id).update(
+                    active_count=F('active_count') + active,
+                    in_stock_count=F('in_stock_count') + in_stock,
+                )
+
+    @staticmethod
+    def recount_counters():
+        """Пересчитывает счетчики всех категорий одним UPDATE с подзапросами"""
+        def count(**filters):
+            products = Products.objects.filter(category=OuterRef('pk'), is_active=True, **filters)
+            return Coalesce(Subquery(products.order_by().values('category')
+                                     .annotate(total=Count('pk')).values('total')), Value(0))
+
+        return ProductCategory.objects.update(active_count=count(), in_stock_count=count(quantity__gt=0))
+
 
 class Products(models.Model):
     """Товар"""
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
+        # индексы под keyset-пагинацию каталога (см. mainapp.pagination)
+        indexes = [
+            models.Index(fields=['price', 'id']),
+            models.Index(fields=['category', 'id']),
+            models.Index(fields=['category', 'price', 'id']),
+        ]
+
+    COUNTED_FIELDS = ('category_id', 'is_active', 'quantity', 'price')
+    # нижние границы ценовых диапазонов фильтра каталога
+    PRICE_BUCKETS = (0, 1000, 3000, 5000, 10000, 20000)
 
     name = models.CharField(max_length=128, verbose_name='Название')
     image = models.ImageField(upload_to='products_images', blank=True, verbose_name='Изображение')
@@ -32,10 +94,141 @@ class Products(models.Model):
     category = models.ForeignKey(ProductCategory, on_delete=models.CASCADE, verbose_name='Категория')
     is_active = models.BooleanField(default=True, verbose_name='Активность')
     slug = models.SlugField(max_length=256, unique=True, db_index=True, verbose_name='URL')
+    # увеличивается при каждом сохранении, входит в ключ кеша карточки товара
+    version = models.PositiveIntegerField(default=1, editable=False, verbose_name='Версия')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Изменен')
 
     def __str__(self):
         return f'{self.name} | {self.category}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Products, cls).from_db(db, field_names, values)
+        instance._loaded_quantity = instance.__dict__.get('quantity')
+        return instance
+
+    def counted_state(self):
+        """Состояние товара, от которого зависят счетчики категории и фасеты каталога"""
+        return self.make_state(self.category_id, self.is_active, self.quantity, self.price)
+
+    @classmethod
+    def make_state(cls, category_id, is_active, quantity, price):
+        return category_id, is_active, quantity > 0, cls.price_bucket(price)
+
+    @classmethod
+    def stored_values(cls, product_id):
+        """Поля COUNTED_FIELDS товара в БД (строка блокируется до конца транзакции), None - товара нет"""
+        return cls.objects.select_for_update().filter(pk=product_id).values(*cls.COUNTED_FIELDS).first()
+
+    @classmethod
+    def stored_state(cls, product_id):
+        """Состояние товара в БД (строка блокируется до конца транзакции), None - товара нет"""
+        values = cls.stored_values(product_id)
+        return None if values is None else cls.make_state(**values)
+
+    @classmethod
+    def price_bucket(cls, price):
+        """Номер ценового диапазона из PRICE_BUCKETS"""
+        return max(bisect_right(cls.PRICE_BUCKETS, price) - 1, 0)
+
+    @staticmethod
+    def update_aggregates(changes):
+        """Обновляет все агрегаты по товарам: счетчики категорий и фасеты"""
+        changes = [(old, new) for old, new in changes if old != new]
+        if changes:
+            ProductCategory.update_counters(changes)
+            ProductFacet.update_cells(changes)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version = F('version') + 1
+            if kwargs.get('update_fields') is None and \
+                    self.__dict__.get('quantity') == getattr(self, '_loaded_quantity', None):
+                # остаток не менялся вызывающим - не пишем его: иначе значение на момент загрузки
+                # откатит резерв, сделанный stock.py после загрузки объекта. Остаток меняется через stock.py
+                deferred = self.get_deferred_fields()
+                kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                           if not field.primary_key and field.name != 'quantity'
+                                           and field.attname not in deferred]
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        with transaction.atomic():
+            # учтенное состояние всегда читается из заблокированной строки: остаток мог измениться
+            # в stock.py после загрузки объекта, и счетчики разошлись бы с БД
+            stored = None if self._state.adding else self.stored_values(self.pk)
+            super(Products, self).save(*args, **kwargs)
+            expressions = [field for field in ('quantity', 'price', 'version')
+                           if hasattr(getattr(self, field), 'resolve_expression')]
+            if expressions:
+                self.refresh_from_db(fields=expressions)
+            values = {field: getattr(self, field) for field in self.COUNTED_FIELDS}
+            if stored is not None and kwargs.get('update_fields') is not None:
+                # несохраненные поля остались в БД такими, как в заблокированной строке
+                written = {self._meta.get_field(name).attname for name in kwargs['update_fields']}
+                values = {field: values[field] if field in written else stored[field] for field in values}
+                if 'quantity' not in written:
+                    self.quantity = values['quantity']
+            self._loaded_quantity = self.quantity
+            Products.update_aggregates([(stored and self.make_state(**stored), self.make_state(**values))])
+
     @staticmethod
     def get_items():
         return Products.objects.filter(is_active=True)
+
+
+class ProductFacet(models.Model):
+    """
+    Предрасчитанные фасеты каталога: количество товаров для каждого сочетания
+    (категория, ценовой диапазон, наличие, активность). Ячеек немного (категории x диапазоны x 4),
+    поэтому счетчики для любой комбинации фильтров считаются суммированием ячеек без запросов к товарам
+    """
+    class Meta:
+        verbose_name = 'фасет'
+        verbose_name_plural = 'Фасеты'
+        unique_together = ('category', 'price_bucket', 'in_stock', 'is_active')
+
+    category = models.ForeignKey(ProductCategory, on_delete=models.CASCADE, verbose_name='Категория')
+    price_bucket = models.PositiveSmallIntegerField(verbose_name='Ценовой диапазон')
+    in_stock = models.BooleanField(verbose_name='В наличии')
+    is_active = models.BooleanField(verbose_name='Активность')
+    count = models.PositiveIntegerField(default=0, verbose_name='Товаров')
+
+    @staticmethod
+    def update_cells(changes):
+        """Переносит товары между ячейками. changes - как в ProductCategory.update_counters"""
+        deltas = defaultdict(int)
+        for old, new in changes:
+            for state, sign in ((old, -1), (new, 1)):
+                if state is not None:
+                    deltas[state] += sign
+
+        for (category_id, is_active, in_stock, bucket), delta in deltas.items():
+            if not delta:
+                continue
+            cell = ProductFacet.objects.filter(category_id=category_id, price_bucket=bucket,
+                                               in_stock=in_stock, is_active=is_active)
+            if cell.update(count=F('count') + delta) or delta < 0:
+                continue
+            try:
+                with transaction.atomic():
+                    ProductFacet.objects.create(category_id=category_id, price_bucket=bucket,
+                                                in_stock=in_stock, is_active=is_active, count=delta)
+            except IntegrityError:
+                cell.update(count=F('count') + delta)
+
+    @staticmethod
+    def rebuild():
+        """Пересчитывает все ячейки одним GROUP BY по товарам"""
+        bucket = Case(*(When(price__gte=bound, then=Value(i)) for i, bound in
+                        reversed(list(enumerate(Products.PRICE_BUCKETS)))),
+                      default=Value(0), output_field=IntegerField())
+        stock = Case(When(quantity__gt=0, then=Value(True)), default=Value(False), output_field=models.BooleanField())
+        cells = (Products.objects.order_by().annotate(bucket=bucket, stock=stock)
+                 .values('category', 'bucket', 'stock', 'is_active').annotate(total=Count('pk')))
+        with transaction.atomic():
+            ProductFacet.objects.all().delete()
+            ProductFacet.objects.bulk_create([
+                ProductFacet(category_id=cell['category'], price_bucket=cell['bucket'], in_stock=cell['stock'],
+                             is_active=cell['is_active'], count=cell['total'])
+                for cell in cells
+            ])
@@ -0,0 +1,149 @@
+import base64
+import binascii
+import json
+from decimal import Decimal
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+# сортировки каталога: имя из GET параметра -> поля ключа ('-' - по убыванию)
+KEYSET_ORDERINGS = {
+    'id': ('id',),
+    'price': ('price', 'id'),
+}
+# разбор значений ключа из курсора, остальные поля - целые числа
+KEYSET_TYPES = {
+    'price': Decimal,
+    'created_at': parse_datetime,
+}
+NEXT = 'n'
+PREV = 'p'
+
+
+class InvalidCursor(ValueError):
+    """Курсор поврежден или не подходит к выбранной сортировке"""
+
+
+def encode_cursor(direction, ordering, values):
+    """Упаковывает позицию в непрозрачную для клиента строку"""
+    raw = json.dumps([direction, ordering, [str(value) for value in values]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _parse(field, value):
+    parsed = KEYSET_TYPES.get(field.lstrip('-'), int)(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+def decode_cursor(cursor, orderings=KEYSET_ORDERINGS):
+    """Распаковывает курсор в (направление, сортировка, значения ключа)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, ordering, values = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    fields = orderings.get(ordering) if isinstance(ordering, str) else None
+    if direction not in (NEXT, PREV) or fields is None or len(values) != len(fields):
+        raise InvalidCursor(cursor)
+    try:
+        return direction, ordering, [_parse(field, value) for field, value in zip(fields, values)]
+    except (ArithmeticError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+class KeysetPage:
+    """Страница keyset-пагинации. Вместо номеров страниц - курсоры на соседние страницы"""
+
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Пагинация по ключу сортировки, по умолчанию (id) или (price, id) каталога.
+    Страница выбирается условием WHERE по ключу и LIMIT, без OFFSET и COUNT(*),
+    поэтому время выборки не зависит от номера страницы
+    """
+
+    def __init__(self, queryset, per_page, ordering='id', orderings=KEYSET_ORDERINGS):
+        if ordering not in orderings:
+            raise InvalidCursor(ordering)
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = ordering
+        self.orderings = orderings
+        self.fields = orderings[ordering]
+        self.names = [field.lstrip('-') for field in self.fields]
+
+    def _after(self, values, reverse=False, fields=None):
+        """
+        Условие 'строго после values' (или 'строго до' при reverse) для составного ключа.
+        Ведущее поле ограничено диапазоном (price >= p AND (price > p OR id > i)),
+        чтобы БД могла начать чтение индекса сразу с нужной позиции
+        """
+        fields = fields or self.fields
+        name = fields[0].lstrip('-')
+        lookup = 'lt' if reverse != fields[0].startswith('-') else 'gt'
+        condition = Q(**{f'{name}__{lookup}': values[0]})
+        if len(fields) == 1:
+            return condition
+        return Q(**{f'{name}__{lookup}e': values[0]}) & (
+                condition | self._after(values[1:], reverse, fields[1:]))
+
+    def _key(self, item):
+        if isinstance(item, dict):
+            return [item[name] for name in self.names]
+        return [getattr(item, name) for name in self.names]
+
+    def page(self, cursor=None, values=()):
+        """
+        Возвращает страницу после/до позиции из курсора, без курсора - первую страницу.
+        Строки - словари с полями values и ключа, при values=None - объекты модели
+        """
+        direction, positions = NEXT, None
+        if cursor:
+            direction, ordering, positions = decode_cursor(cursor, self.orderings)
+            if ordering != self.ordering:
+                raise InvalidCursor(cursor)
+
+        reverse = direction == PREV
+        queryset = self.queryset
+        if positions is not None:
+            queryset = queryset.filter(self._after(positions, reverse=reverse))
+        order_by = [(field[1:] if field.startswith('-') else f'-{field}') if reverse else field
+                    for field in self.fields]
+        queryset = queryset.order_by(*order_by)
+        if values is not None:
+            queryset = queryset.values(*values, *(name for name in self.names if name not in values))
+        rows = list(queryset[:self.per_page + 1])
+
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+        if not rows:
+            return KeysetPage(rows)
+
+        has_next = has_more if not reverse else True
+        has_prev = has_more if reverse else positions is not None
+        return KeysetPage(
+            rows,
+            next_cursor=encode_cursor(NEXT, self.ordering, self._key(rows[-1])) if has_next else None,
+            prev_cursor=encode_cursor(PREV, self.ordering, self._key(rows[0])) if has_prev else None,
+        )
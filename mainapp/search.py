@@ -0,0 +1,420 @@
+"""
+Полнотекстовый поиск по товарам (Products.name и Products.description).
+
+Два бэкенда с общим интерфейсом search(query, limit) -> [(id товара, релевантность)]:
+- PostgresSearchBackend - tsvector со словарем russian и GIN индексом (docker-развертывание);
+- MemorySearchBackend - инвертированный индекс в памяти процесса (sqlite-развертывание),
+  поддерживается сигналами Products (см. mainapp.signals).
+Бэкенд выбирается настройкой SEARCH_BACKEND.
+"""
+import heapq
+import math
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from mainapp.cache_functions import CATALOG_PRODUCT_FIELDS
+from mainapp.models import Products
+from mainapp.stemmer import stem
+
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile(r'[а-я]')
+CYRILLIC = 'абвгдежзийклмнопрстуфхцчшщъыьэюя'
+SEARCH_INDEX_VERSION_KEY = 'search_index_version'
+SEARCH_CHANGES_KEY = 'search_index_changes'
+SEARCH_CHANGE_KEY = 'search_index_change:{}'
+LATIN = 'abcdefghijklmnopqrstuvwxyz0123456789'
+
+# Выражение документа для Postgres. Должно совпадать с выражением GIN индекса
+# из миграции mainapp 0005, иначе индекс не будет использоваться
+PG_DOCUMENT = ("setweight(to_tsvector('russian'::regconfig, coalesce(name, '')), 'A') || "
+               "setweight(to_tsvector('russian'::regconfig, coalesce(description, '')), 'B')")
+
+
+@lru_cache(maxsize=100_000)
+def normalize(word):
+    """Приводит слово к термину индекса: русские слова - к основе, остальные - к нижнему регистру"""
+    word = word.lower().replace('ё', 'е')
+    return stem(word) if CYRILLIC_RE.search(word) else word
+
+
+def tokenize(text):
+    """Разбивает текст на термины"""
+    return [normalize(word) for word in WORD_RE.findall(text or '') if len(word) > 1 or word.isdigit()]
+
+
+def edits1(term):
+    """Все строки на расстоянии Дамерау-Левенштейна 1 от term (перестановка, удаление, замена, вставка)"""
+    letters = CYRILLIC if CYRILLIC_RE.search(term) else LATIN
+    splits = [(term[:i], term[i:]) for i in range(len(term) + 1)]
+    deletes = [left + right[1:] for left, right in splits if right]
+    transposes = [left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1]
+    replaces = [left + char + right[1:] for left, right in splits if right for char in letters]
+    inserts = [left + char + right for left, right in splits for char in letters]
+    return set(deletes + transposes + replaces + inserts)
+
+
+class InvertedIndex:
+    """
+    Инвертированный индекс с ранжированием BM25.
+
+    Список вхождений термина хранится в array('q') отсортированным по id товара,
+    каждый элемент - (id << 8) | вес, где вес - BM25-вклад термина, квантованный в 1..255.
+    Для каждого товара хранится его набор (термин << 8) | вес - по нему товар удаляется из индекса.
+    Это ~8 байт на вхождение, поиск товара в списке - бинарный.
+    Для частых терминов лениво строится список, отсортированный по весу: из него берутся
+    MAX_CANDIDATES лучших товаров, поэтому время запроса не растет с размером каталога.
+    """
+    NAME_WEIGHT = 3
+    DESCRIPTION_WEIGHT = 1
+    K1 = 1.2
+    B = 0.75
+    AVG_LENGTH = 30
+    MAX_CANDIDATES = 2000
+    MAX_EXPANSIONS = 30
+    MIN_PREFIX = 3
+    PREFIX_PENALTY = 0.7
+    TYPO_PENALTY = 0.5
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.term_ids = {}
+        self.vocabulary = []
+        self.postings = []
+        self.top = {}
+        self.documents = {}
+
+    def __len__(self):
+        return len(self.documents)
+
+    def _term_id(self, term):
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = self.term_ids[term] = len(self.postings)
+            self.postings.append(array('q'))
+            insort(self.vocabulary, term)
+        return term_id
+
+    def _weights(self, name, description):
+        """Квантованные BM25-веса терминов товара"""
+        frequencies = Counter()
+        for term in tokenize(name):
+            frequencies[term] += self.NAME_WEIGHT
+        for term in tokenize(description):
+            frequencies[term] += self.DESCRIPTION_WEIGHT
+        length = sum(frequencies.values())
+        norm = self.K1 * (1 - self.B + self.B * length / self.AVG_LENGTH)
+        top = self.K1 + 1
+        return {term: max(1, min(255, round(tf * top / (tf + norm) / top * 255)))
+                for term, tf in frequencies.items()}
+
+    def add(self, product_id, name, description):
+        """Добавляет или переиндексирует товар"""
+        weights = self._weights(name, description)
+        with self.lock:
+            document = array('q', sorted(self._term_id(term) << 8 | weight for term, weight in weights.items()))
+            old = self.documents.get(product_id)
+            if old == document.tobytes():
+                return
+            if old is not None:
+                self.remove(product_id)
+            for item in document:
+                term_id, entry = item >> 8, product_id << 8 | item & 255
+                postings = self.postings[term_id]
+                if not postings or postings[-1] < entry:
+                    postings.append(entry)
+                else:
+                    postings.insert(bisect_left(postings, entry), entry)
+                best = self.top.get(term_id)
+                if best is not None and entry & 255 >= best[-1] & 255:
+                    del self.top[term_id]
+            self.documents[product_id] = document.tobytes()
+
+    def remove(self, product_id):
+        """Удаляет товар из индекса"""
+        with self.lock:
+            old = self.documents.pop(product_id, None)
+            if old is None:
+                return
+            for item in array('q', old):
+                term_id = item >> 8
+                postings = self.postings[term_id]
+                i = bisect_left(postings, product_id << 8)
+                if i < len(postings) and postings[i] >> 8 == product_id:
+                    del postings[i]
+                self.top.pop(term_id, None)
+
+    def _best(self, term_id):
+        """Вхождения термина, лучшие по весу (не более MAX_CANDIDATES)"""
+        postings = self.postings[term_id]
+        if len(postings) <= self.MAX_CANDIDATES:
+            return postings
+        best = self.top.get(term_id)
+        if best is None:
+            best = self.top[term_id] = array('q', heapq.nlargest(
+                self.MAX_CANDIDATES, postings, key=lambda entry: entry & 255))
+        return best
+
+    def _idf(self, term_id):
+        frequency = len(self.postings[term_id])
+        return math.log(1 + (len(self.documents) - frequency + 0.5) / (frequency + 0.5))
+
+    def expand(self, term):
+        """
+        Термины индекса, подходящие под термин запроса, с множителем релевантности:
+        точное совпадение, продолжения префикса, а если их нет - опечатки на расстоянии 1
+        """
+        matches = {}
+        term_id = self.term_ids.get(term)
+        if term_id is not None and self.postings[term_id]:
+            matches[term_id] = 1.0
+        if len(term) >= self.MIN_PREFIX:
+            i = bisect_left(self.vocabulary, term)
+            while i < len(self.vocabulary) and len(matches) < self.MAX_EXPANSIONS:
+                candidate = self.vocabulary[i]
+                if not candidate.startswith(term):
+                    break
+                candidate_id = self.term_ids[candidate]
+                if self.postings[candidate_id]:
+                    matches.setdefault(candidate_id, self.PREFIX_PENALTY)
+                i += 1
+        if not matches and len(term) > self.MIN_PREFIX:
+            for candidate in edits1(term):
+                candidate_id = self.term_ids.get(candidate)
+                if candidate_id is not None and self.postings[candidate_id]:
+                    matches[candidate_id] = self.TYPO_PENALTY
+        return matches
+
+    def search(self, query, limit=20):
+        """Товары, содержащие все слова запроса, по убыванию релевантности"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self.lock:
+            groups = []
+            for term in terms:
+                matches = self.expand(term)
+                if not matches:
+                    return []
+                groups.append({term_id: penalty * self._idf(term_id) for term_id, penalty in matches.items()})
+
+            # перебираем товары самого редкого слова, остальные слова проверяем бинарным поиском
+            groups.sort(key=lambda group: sum(len(self.postings[term_id]) for term_id in group))
+            driver, others = groups[0], groups[1:]
+            scores = {}
+            for term_id, factor in driver.items():
+                for entry in self._best(term_id):
+                    product_id, score = entry >> 8, (entry & 255) * factor
+                    if score > scores.get(product_id, 0):
+                        scores[product_id] = score
+
+            others = [[(self.postings[term_id], factor) for term_id, factor in group.items()] for group in others]
+            results = []
+            for product_id, score in scores.items():
+                key = product_id << 8
+                for group in others:
+                    best = 0
+                    for postings, factor in group:
+                        i = bisect_left(postings, key)
+                        if i < len(postings) and postings[i] >> 8 == product_id:
+                            best = max(best, (postings[i] & 255) * factor)
+                    if not best:
+                        break
+                    score += best
+                else:
+                    results.append((score / 255, product_id))
+        return [(product_id, score) for score, product_id in heapq.nlargest(limit, results)]
+
+
+def invalidate_search_index():
+    """
+    Сбрасывает индексы поиска в памяти во всех процессах - после массовых изменений
+    товаров в обход сигналов (bulk_create, update). Индекс перестроится при следующем запросе
+    """
+    cache.set(SEARCH_INDEX_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+class MemorySearchBackend:
+    """
+    Поиск по индексу в памяти процесса. Индекс строится из БД при первом запросе
+    и целиком перестраивается только после invalidate_search_index().
+
+    Изменения отдельных товаров публикуются в журнал в кеше: номер записи выдает cache.incr,
+    запись хранит id товара. Перед поиском процесс переиндексирует товары из пропущенных записей
+    """
+    chunk_size = 2000
+    change_timeout = 24 * 60 * 60
+    # отставание, после которого дешевле перестроить индекс, чем читать журнал
+    max_lag = 10_000
+    # сколько ждать запись, номер которой уже выдан: дольше - запись потеряна (вытеснена из кеша)
+    gap_timeout = 5
+
+    def __init__(self):
+        self.index = None
+        self.index_version = None
+        self.applied = 0
+        self.gap = None
+        self.lock = threading.Lock()
+
+    def _state(self):
+        state = cache.get_many([SEARCH_INDEX_VERSION_KEY, SEARCH_CHANGES_KEY])
+        return state.get(SEARCH_INDEX_VERSION_KEY), state.get(SEARCH_CHANGES_KEY, 0)
+
+    def get_index(self):
+        version, last = self._state()
+        if self.index is not None and version == self.index_version and last == self.applied:
+            return self.index
+        with self.lock:
+            version, last = self._state()
+            if self.index is None or version != self.index_version or not self.catch_up(last):
+                # номер последней записи читается до построения: записи после него применятся повторно
+                self.index = self.build()
+                self.index_version, self.applied, self.gap = version, last, None
+        return self.index
+
+    def catch_up(self, last):
+        """Применяет пропущенные записи журнала. False - журнал не восстановить, индекс нужно перестроить"""
+        if last == self.applied:
+            return True
+        if last < self.applied or last - self.applied > self.max_lag:
+            return False
+        numbers = range(self.applied + 1, last + 1)
+        changes = cache.get_many([SEARCH_CHANGE_KEY.format(number) for number in numbers])
+        product_ids, applied = set(), self.applied
+        for number in numbers:
+            product_id = changes.get(SEARCH_CHANGE_KEY.format(number))
+            if product_id is None:
+                # запись еще не сделана (между incr и set) или вытеснена из кеша
+                now = time.monotonic()
+                if self.gap is None or self.gap[0] != number:
+                    self.gap = (number, now)
+                elif now - self.gap[1] > self.gap_timeout:
+                    return False
+                break
+            product_ids.add(product_id)
+            applied = number
+        self.reindex(product_ids)
+        self.applied = applied
+        return True
+
+    def reindex(self, product_ids):
+        """Переиндексирует товары по данным из БД: удаленные и неактивные убираются из индекса"""
+        product_ids = list(product_ids)
+        for i in range(0, len(product_ids), self.chunk_size):
+            chunk = product_ids[i:i + self.chunk_size]
+            found = set()
+            for product_id, name, description in (Products.get_items().filter(pk__in=chunk)
+                                                  .values_list('id', 'name', 'description')):
+                self.index.add(product_id, name, description)
+                found.add(product_id)
+            for product_id in set(chunk) - found:
+                self.index.remove(product_id)
+
+    def build(self):
+        index = InvertedIndex()
+        products = Products.get_items().values_list('id', 'name', 'description')
+        for product_id, name, description in products.iterator(chunk_size=self.chunk_size):
+            index.add(product_id, name, description)
+        return index
+
+    def rebuild(self):
+        self.index = self.build()
+
+    def publish(self, product_id):
+        """Записывает изменение товара в журнал для остальных процессов"""
+        cache.add(SEARCH_CHANGES_KEY, 0, timeout=None)
+        try:
+            number = cache.incr(SEARCH_CHANGES_KEY)
+        except ValueError:
+            # счетчик вытеснен из кеша между add и incr - журнал потерян
+            invalidate_search_index()
+            return
+        cache.set(SEARCH_CHANGE_KEY.format(number), product_id, timeout=self.change_timeout)
+
+    def update(self, product):
+        """Переиндексирует товар, если индекс уже построен"""
+        if self.index is not None:
+            if product.is_active:
+                self.index.add(product.pk, product.name, product.description)
+            else:
+                self.index.remove(product.pk)
+        self.publish(product.pk)
+
+    def remove(self, product_id):
+        if self.index is not None:
+            self.index.remove(product_id)
+        self.publish(product_id)
+
+    def search(self, query, limit=20):
+        return self.get_index().search(query, limit)
+
+
+class PostgresSearchBackend:
+    """
+    Поиск средствами Postgres: tsvector со словарем russian (стемминг), to_tsquery с
+    префиксами слов, ранжирование ts_rank_cd. Если слова не нашлись (опечатка) -
+    поиск по триграммам названия (pg_trgm)
+    """
+
+    def update(self, product):
+        """Индекс строится по выражению и обновляется самой БД"""
+
+    def remove(self, product_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def search(self, query, limit=20):
+        words = [word.lower() for word in WORD_RE.findall(query) if len(word) > 1 or word.isdigit()]
+        if not words:
+            return []
+        ts_query = ' & '.join(f'{word}:*' for word in words)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT id, ts_rank_cd({PG_DOCUMENT}, query) AS rank '
+                f'FROM mainapp_products, to_tsquery(\'russian\', %s) query '
+                f'WHERE is_active AND ({PG_DOCUMENT}) @@ query '
+                f'ORDER BY rank DESC, id LIMIT %s', [ts_query, limit])
+            rows = cursor.fetchall()
+            if not rows:
+                cursor.execute(
+                    'SELECT id, word_similarity(%s, name) AS rank FROM mainapp_products '
+                    'WHERE is_active AND %s <%% name ORDER BY rank DESC, id LIMIT %s',
+                    [' '.join(words), ' '.join(words), limit])
+                rows = cursor.fetchall()
+        return [(product_id, float(rank)) for product_id, rank in rows]
+
+
+BACKENDS = {
+    'memory': MemorySearchBackend,
+    'postgres': PostgresSearchBackend,
+}
+_backends = {}
+
+
+def get_search_backend(name=None):
+    """Возвращает бэкенд поиска (один экземпляр на процесс)"""
+    name = name or settings.SEARCH_BACKEND
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
+
+
+def search_products(query, limit=20):
+    """
+    Ищет товары и возвращает строки каталога (как в mainapp.cache_functions)
+    с полем rank, в порядке релевантности
+    """
+    found = get_search_backend().search(query, limit)
+    rows = {row['id']: row for row in Products.objects.filter(pk__in=[product_id for product_id, _ in found])
+            .values(*CATALOG_PRODUCT_FIELDS)}
+    return [dict(rows[product_id], rank=rank) for product_id, rank in found if product_id in rows]
@@ -0,0 +1,44 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from mainapp.cache_functions import bump_catalog_version
+from mainapp.models import Products, ProductCategory
+from mainapp.search import get_search_backend
+
+
+@receiver(post_save, sender=Products)
+@receiver(post_delete, sender=Products)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+def invalidate_catalog(sender, **kwargs):
+    """
+    Сбрасывает кеш каталога при любом изменении товара или категории - после фиксации транзакции,
+    иначе запрос между сменой версии и фиксацией закеширует старые данные под новой версией
+    """
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(pre_delete, sender=Products)
+def remember_counted_state(sender, instance, **kwargs):
+    """Запоминает учтенное состояние удаляемого товара - из заблокированной строки, а не из загруженного объекта"""
+    instance._counted_state = Products.stored_state(instance.pk)
+
+
+@receiver(post_delete, sender=Products)
+def update_product_aggregates(sender, instance, **kwargs):
+    """Вычитает удаленный товар из счетчиков категории и фасетов (в той же транзакции, что и удаление)"""
+    Products.update_aggregates([(instance._counted_state, None)])
+
+
+@receiver(post_save, sender=Products)
+def update_search_index(sender, instance, **kwargs):
+    """Переиндексирует товар в поиске после фиксации транзакции"""
+    transaction.on_commit(partial(get_search_backend().update, instance))
+
+
+@receiver(post_delete, sender=Products)
+def remove_from_search_index(sender, instance, **kwargs):
+    transaction.on_commit(partial(get_search_backend().remove, instance.pk))
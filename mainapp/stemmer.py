@@ -0,0 +1,82 @@
+"""
+Стеммер русского языка по алгоритму Snowball (Портер).
+https://snowballstem.org/algorithms/russian/stemmer.html
+"""
+import re
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = re.compile(r'(ив|ивши|ившись|ыв|ывши|ывшись|(?<=[ая])(в|вши|вшись))$')
+REFLEXIVE = re.compile(r'(ся|сь)$')
+ADJECTIVE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+PARTICIPLE = re.compile(r'(ивш|ывш|ующ|(?<=[ая])(ем|нн|вш|ющ|щ))$')
+VERB = re.compile(r'(ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить'
+                  r'|ыть|ишь|ую|ю|(?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно))$')
+NOUN = re.compile(r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь'
+                  r'|ию|ью|ю|ия|ья|я)$')
+DERIVATIONAL = re.compile(r'(ост|ость)$')
+SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+
+
+def _regions(word):
+    """Возвращает начало областей RV и R2 в слове"""
+    rv = r1 = r2 = len(word)
+    for i, char in enumerate(word):
+        if char in VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i - 1] in VOWELS and word[i] not in VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i - 1] in VOWELS and word[i] not in VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+
+def _cut(pattern, word, start):
+    """Отрезает окончание pattern, если оно целиком лежит в области word[start:]"""
+    match = pattern.search(word[start:])
+    if match:
+        return word[:start + match.start()], True
+    return word, False
+
+
+def stem(word):
+    """Возвращает основу русского слова"""
+    word = word.lower().replace('ё', 'е')
+    rv, r2 = _regions(word)
+    if rv >= len(word):
+        return word
+
+    # Шаг 1
+    word, found = _cut(PERFECTIVE_GERUND, word, rv)
+    if not found:
+        word, _ = _cut(REFLEXIVE, word, rv)
+        word, found = _cut(ADJECTIVE, word, rv)
+        if found:
+            word, _ = _cut(PARTICIPLE, word, rv)
+        else:
+            word, found = _cut(VERB, word, rv)
+            if not found:
+                word, _ = _cut(NOUN, word, rv)
+
+    # Шаг 2
+    if word.endswith('и') and len(word) > rv:
+        word = word[:-1]
+
+    # Шаг 3
+    word, _ = _cut(DERIVATIONAL, word, r2)
+
+    # Шаг 4
+    if word.endswith('нн') and len(word) - 1 > rv:
+        word = word[:-1]
+    else:
+        word, found = _cut(SUPERLATIVE, word, rv)
+        if found and word.endswith('нн') and len(word) - 1 > rv:
+            word = word[:-1]
+        elif word.endswith('ь') and len(word) > rv:
+            word = word[:-1]
+    return word
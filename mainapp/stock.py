@@ -0,0 +1,166 @@
+"""
+Резервирование остатков товаров.
+
+Остаток меняется одним условным UPDATE: quantity = quantity - n WHERE quantity >= n.
+Проверка и списание выполняются в одном операторе под блокировкой строки, поэтому
+два одновременных запроса на последнюю единицу не могут оба пройти, а остаток не уходит в минус.
+Вместе с остатком увеличивается версия товара (ключ кеша карточки); счетчики категорий
+и фасеты пересчитываются только если товар перешел из "в наличии" в "нет в наличии" или обратно.
+Только в этом случае увеличивается и версия каталога - после фиксации транзакции, чтобы другие
+процессы не закешировали страницы со старым наличием, пока изменение еще не видно.
+Обычное добавление в корзину кеш каталога не сбрасывает.
+Возврат многих товаров сразу (очистка корзины, отмена заказа) - один UPDATE с CASE по id.
+Products.save() не пишет quantity, если вызывающий его не менял, поэтому сохранение формы товара
+не откатывает резерв, сделанный после загрузки объекта.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from mainapp.cache_functions import bump_catalog_version
+from mainapp.models import Products
+
+RELEASE_BATCH_SIZE = 500
+
+
+class OutOfStock(Exception):
+    """На складе нет нужного количества товара"""
+
+    def __init__(self, product_id, quantity):
+        self.product_id = product_id
+        self.quantity = quantity
+        super(OutOfStock, self).__init__(f'Товара {product_id} нет в количестве {quantity}')
+
+
+def _update_aggregates(deltas):
+    """
+    Переносит измененные товары между ячейками счетчиков и фасетов.
+    Строки уже заблокированы UPDATE, поэтому прочитанные остатки актуальны.
+    Возвращает True, если наличие хоть одного товара изменилось
+    """
+    rows = Products.objects.filter(pk__in=deltas).values_list('id', 'category_id', 'is_active', 'quantity', 'price')
+    changes = []
+    for product_id, category_id, is_active, quantity, price in rows:
+        bucket = Products.price_bucket(price)
+        changes.append(((category_id, is_active, quantity - deltas[product_id] > 0, bucket),
+                        (category_id, is_active, quantity > 0, bucket)))
+    Products.update_aggregates(changes)
+    return any(old != new for old, new in changes)
+
+
+def _bump_catalog_on_commit(changed):
+    """Сбрасывает кеш каталога после фиксации транзакции, если наличие товаров изменилось"""
+    if changed:
+        transaction.on_commit(bump_catalog_version)
+
+
+def _update_stock(product_id, delta, condition=None):
+    """Меняет остаток на delta одним UPDATE. Возвращает False, если строка не подошла под условие"""
+    with transaction.atomic():
+        updated = Products.objects.filter(pk=product_id, **(condition or {})).update(
+            quantity=F('quantity') + delta,
+            version=F('version') + 1,
+            updated_at=timezone.now(),
+        )
+        if not updated:
+            return False
+        changed = _update_aggregates({product_id: delta})
+    _bump_catalog_on_commit(changed)
+    return True
+
+
+def reserve(product_id, quantity):
+    """Списывает quantity единиц товара, если они есть на складе. Возвращает True при успехе"""
+    if quantity <= 0:
+        return True
+    return _update_stock(product_id, -quantity, {'quantity__gte': quantity})
+
+
+def release(product_id, quantity):
+    """Возвращает quantity единиц товара на склад"""
+    if quantity > 0:
+        _update_stock(product_id, quantity)
+
+
+def adjust(product_id, delta):
+    """
+    Изменяет резерв на delta: положительное значение списывает товар со склада, отрицательное - возвращает.
+    Если товара не хватает, выбрасывает OutOfStock
+    """
+    if delta > 0 and not reserve(product_id, delta):
+        raise OutOfStock(product_id, delta)
+    if delta < 0:
+        release(product_id, -delta)
+
+
+def _group(quantities):
+    totals = defaultdict(int)
+    for product_id, quantity in quantities:
+        totals[product_id] += quantity
+    return totals
+
+
+def reserve_many(quantities):
+    """
+    Списывает товары из пар (id товара, количество) одним UPDATE с CASE: все или ничего.
+    Если хоть одного товара не хватает, изменения откатываются и выбрасывается OutOfStock
+    """
+    totals = {product_id: quantity for product_id, quantity in _group(quantities).items() if quantity > 0}
+    if not totals:
+        return
+    taken = Case(*(When(pk=product_id, then=Value(quantity)) for product_id, quantity in totals.items()),
+                 default=Value(0), output_field=IntegerField())
+    with transaction.atomic():
+        updated = Products.objects.filter(pk__in=totals, quantity__gte=taken).update(
+            quantity=F('quantity') - taken,
+            version=F('version') + 1,
+            updated_at=timezone.now(),
+        )
+        if updated == len(totals):
+            changed = _update_aggregates({product_id: -quantity for product_id, quantity in totals.items()})
+        else:
+            transaction.set_rollback(True)
+    if updated != len(totals):
+        available = dict(Products.objects.filter(pk__in=totals).values_list('id', 'quantity'))
+        product_id = next((product_id for product_id, quantity in totals.items()
+                           if available.get(product_id, 0) < quantity), None)
+        raise OutOfStock(product_id, totals.get(product_id))
+    _bump_catalog_on_commit(changed)
+
+
+def adjust_many(deltas):
+    """
+    Применяет изменения резерва из пар (id товара, delta) в одной транзакции: списания - одним UPDATE
+    (все или ничего, иначе OutOfStock), возвраты - одним UPDATE
+    """
+    totals = _group(deltas)
+    with transaction.atomic():
+        reserve_many((product_id, delta) for product_id, delta in totals.items() if delta > 0)
+        release_many((product_id, -delta) for product_id, delta in totals.items() if delta < 0)
+
+
+def release_many(quantities):
+    """
+    Возвращает на склад товары из пар (id товара, количество) одним UPDATE с CASE
+    на каждые RELEASE_BATCH_SIZE товаров, все пачки - в одной транзакции
+    """
+    totals = _group(quantities)
+    product_ids = sorted(product_id for product_id, quantity in totals.items() if quantity > 0)
+    if not product_ids:
+        return
+
+    changed = False
+    with transaction.atomic():
+        for start in range(0, len(product_ids), RELEASE_BATCH_SIZE):
+            batch = {product_id: totals[product_id] for product_id in product_ids[start:start + RELEASE_BATCH_SIZE]}
+            returned = Case(*(When(pk=product_id, then=Value(quantity)) for product_id, quantity in batch.items()),
+                            default=Value(0), output_field=IntegerField())
+            Products.objects.filter(pk__in=batch).update(
+                quantity=F('quantity') + returned,
+                version=F('version') + 1,
+                updated_at=timezone.now(),
+            )
+            changed = _update_aggregates(batch) or changed
+    _bump_catalog_on_commit(changed)
@@ -1,10 +1,16 @@
 from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
 
-from mainapp.cache_functions import get_categories
+from mainapp.cache_functions import get_categories, get_catalog_fragment_key, get_product_card_key
 from mainapp.models import ProductCategory, Products
 
 register = template.Library()
 
+PRODUCT_CARD_TEMPLATE = 'mainapp_includes/product_card.html'
+
 
 @register.simple_tag()
 def get_all_categories():
@@ -15,4 +21,59 @@ def get_all_categories():
 @register.simple_tag()
 def get_all_products():
     """Возвращает все товары"""
-    return Products.objects.all()
\ No newline at end of file
+    return Products.objects.all()
+
+
+@register.simple_tag()
+def product_cards(products):
+    """
+    HTML карточек товаров (строки каталога со словарями CATALOG_PRODUCT_FIELDS).
+    Карточки кешируются по id и версии товара: кеш всей страницы читается одним get_many,
+    рендерятся и записываются одним set_many только отсутствующие карточки
+    """
+    products = list(products)
+    card_template = get_template(PRODUCT_CARD_TEMPLATE)
+    if not settings.LOW_CACHE:
+        return mark_safe(''.join(card_template.render({'good': good}) for good in products))
+
+    keys = [get_product_card_key(good) for good in products]
+    cards = cache.get_many(keys)
+    missing = {key: card_template.render({'good': good}) for key, good in zip(keys, products) if key not in cards}
+    if missing:
+        cache.set_many(missing, settings.CATALOG_CACHE_TIMEOUT)
+        cards.update(missing)
+    return mark_safe(''.join(cards[key] for key in keys))
+
+
+class CatalogCacheNode(template.Node):
+
+    def __init__(self, nodelist, fragment_name, vary_on):
+        self.nodelist = nodelist
+        self.fragment_name = fragment_name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        if not settings.LOW_CACHE:
+            return self.nodelist.render(context)
+        key = get_catalog_fragment_key(self.fragment_name.resolve(context),
+                                       [var.resolve(context) for var in self.vary_on])
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = self.nodelist.render(context)
+            cache.set(key, fragment, settings.CATALOG_CACHE_TIMEOUT)
+        return fragment
+
+
+@register.tag('catalog_cache')
+def do_catalog_cache(parser, token):
+    """
+    Кеширует фрагмент шаблона до следующего изменения каталога (версия каталога входит в ключ):
+    {% catalog_cache 'имя' [переменные...] %} ... {% endcatalog_cache %}
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' требует имя фрагмента")
+    nodelist = parser.parse(('endcatalog_cache',))
+    parser.delete_first_token()
+    return CatalogCacheNode(nodelist, parser.compile_filter(bits[1]),
+                            [parser.compile_filter(bit) for bit in bits[2:]])
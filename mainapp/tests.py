@@ -1,8 +1,29 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
 
 # Create your tests here.
 from authapp.models import User
-from mainapp.models import ProductCategory, Products
+from basketapp.models import Basket
+from mainapp import stock
+from mainapp.cache_functions import get_catalog_page, get_catalog_version, get_product_card_key
+from mainapp.management.commands.bench_stock import stress
+from mainapp.management.commands.import_catalog import Command as ImportCatalog, read_records
+from mainapp.models import ProductCategory, Products, ProductFacet
+from mainapp.search import MemorySearchBackend, PostgresSearchBackend, get_search_backend, invalidate_search_index, \
+    search_products
+from ordersapp.models import Order, OrderItem
 from django.test.client import Client
 
 
@@ -39,3 +60,657 @@ class TestProductsSmoke(TestCase):
         self.client.login(username='root', password='123')
         response = self.client.get('/')
         self.assertFalse(response.context['user'].is_anonymous)
+
+
+@override_settings(LOW_CACHE=True)
+class TestCatalogCache(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.shoes = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.coats = ProductCategory.objects.create(name='Куртки', slug='coats')
+        for i in range(7):
+            Products.objects.create(name=f'Ботинки {i}', slug=f'boots-{i}', category=self.shoes, price=100 + i)
+        Products.objects.create(name='Пуховик', slug='down-coat', category=self.coats, price=500)
+
+    def test_warm_page_without_queries(self):
+        self.client.get('/category_id/shoes/?page=2')
+        with self.assertNumQueries(0):
+            response = self.client.get('/category_id/shoes/?page=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([good['slug'] for good in response.context['products']], ['boots-5', 'boots-6'])
+
+    def test_pages_are_cached_per_slug(self):
+        shoes = get_catalog_page('shoes', 1, 5)
+        coats = get_catalog_page('coats', 1, 5)
+        self.assertEqual(shoes['count'], 7)
+        self.assertEqual([good['slug'] for good in coats['items']], ['down-coat'])
+
+    def test_product_change_invalidates_page(self):
+        get_catalog_page('coats', 1, 5)
+        product = Products.objects.get(slug='down-coat')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.price = 999
+            product.quantity = 3
+            product.save()
+        good = get_catalog_page('coats', 1, 5)['items'][0]
+        self.assertEqual((good['price'], good['quantity']), (999, 3))
+
+    def test_missing_page(self):
+        response = self.client.get('/category_id/coats/?page=3')
+        self.assertEqual(response.status_code, 404)
+
+
+class TestKeysetPagination(TestCase):
+
+    def setUp(self) -> None:
+        self.category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        prices = [300, 100, 200, 100, 500, 400, 100]
+        for i, price in enumerate(prices):
+            Products.objects.create(name=f'Ботинки {i}', slug=f'boots-{i}', category=self.category, price=price)
+
+    def walk(self, url):
+        slugs, urls = [], []
+        while url:
+            data = self.client.get(url).json()
+            urls.append(url)
+            slugs.extend(item['slug'] for item in data['items'])
+            url = data['next']
+        return slugs, urls, data
+
+    def test_json_walk_by_price(self):
+        slugs, urls, last = self.walk('/category_id/shoes/json/?order=price')
+        expected = list(Products.objects.order_by('price', 'id').values_list('slug', flat=True))
+        self.assertEqual(slugs, expected)
+        self.assertEqual(len(urls), 2)
+
+        data = self.client.get(last['prev']).json()
+        self.assertEqual([item['slug'] for item in data['items']], expected[:5])
+        self.assertIsNone(data['prev'])
+
+    def test_keyset_page(self):
+        response = self.client.get('/products/keyset/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['products']), 5)
+        self.assertIsNone(response.context['prev_url'])
+        response = self.client.get(response.context['next_url'])
+        self.assertEqual([good['slug'] for good in response.context['products']], ['boots-5', 'boots-6'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/products/keyset/garbage/').status_code, 404)
+
+
+class TestCategoryCounters(TestCase):
+
+    def setUp(self) -> None:
+        self.category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.boots = Products.objects.create(name='Ботинки', slug='boots', category=self.category, quantity=2)
+        self.shoes = Products.objects.create(name='Туфли', slug='shoes', category=self.category)
+        self.user = User.objects.create_superuser(username='root', password='123')
+
+    def assertCounters(self, active, in_stock):
+        self.category.refresh_from_db()
+        self.assertEqual((self.category.active_count, self.category.in_stock_count), (active, in_stock))
+
+    def test_save_and_delete(self):
+        self.assertCounters(2, 1)
+        self.shoes.quantity = 5
+        self.shoes.save()
+        self.assertCounters(2, 2)
+        self.boots.delete()
+        self.assertCounters(1, 1)
+
+    def test_admin_soft_delete(self):
+        self.client.login(username='root', password='123')
+        self.client.post(f'/adminapp/admin_product_delete/{self.boots.pk}/')
+        self.assertCounters(1, 0)
+
+    def test_stale_instance_keeps_counters(self):
+        stale = Products.objects.get(pk=self.boots.pk)
+        stock.reserve(self.boots.pk, 2)
+        self.assertCounters(2, 0)
+        # товар загружен до резерва: счетчики считаются по строке в БД, а не по объекту
+        stale.is_active = False
+        stale.save(update_fields=['is_active'])
+        self.assertCounters(1, 0)
+        self.assertEqual(Products.objects.get(pk=self.boots.pk).quantity, 0)
+        stale.delete()
+        self.assertCounters(1, 0)
+        self.assertEqual(set(ProductFacet.objects.values_list('count', flat=True)) - {0}, {1})
+
+    def test_basket_and_order(self):
+        basket = Basket.objects.create(user=self.user, product=self.boots, quantity=2)
+        self.assertCounters(2, 0)
+        basket.delete()
+        self.assertCounters(2, 1)
+
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=order, product=Products.objects.get(pk=self.boots.pk), quantity=3)
+        order.delete()
+        self.assertCounters(2, 1)
+
+    def test_category_form_keeps_counters(self):
+        category = ProductCategory.objects.get(pk=self.category.pk)
+        Products.objects.create(name='Кеды', slug='sneakers', category=self.category, quantity=1)
+        category.name = 'Обувь и кеды'
+        category.save()
+        self.assertCounters(3, 2)
+
+    def test_recount_command(self):
+        ProductCategory.objects.update(active_count=100, in_stock_count=100)
+        call_command('recount_categories', stdout=StringIO())
+        self.assertCounters(2, 1)
+
+
+@override_settings(LOW_CACHE=True)
+class TestFacets(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.shoes = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.coats = ProductCategory.objects.create(name='Куртки', slug='coats')
+        for i, (price, quantity) in enumerate([(500, 0), (1500, 2), (1500, 0), (25000, 1)]):
+            Products.objects.create(name=f'Ботинки {i}', slug=f'boots-{i}', category=self.shoes,
+                                    price=price, quantity=quantity)
+        self.coat = Products.objects.create(name='Пуховик', slug='coat', category=self.coats, price=4000, quantity=1)
+        Products.objects.create(name='Плащ', slug='cloak', category=self.coats, price=4000, is_active=False)
+
+    def facets(self, url):
+        response = self.client.get(url)
+        facets = response.context['facets']
+        return response, {
+            'categories': [category['count'] for category in facets['categories']],
+            'prices': [price['count'] for price in facets['prices']],
+            'in_stock': facets['in_stock']['count'],
+        }
+
+    def test_counts(self):
+        response, facets = self.facets('/products/')
+        self.assertEqual(facets, {'categories': [4, 1], 'prices': [1, 2, 1, 0, 0, 1], 'in_stock': 3})
+        self.assertContains(response, 'Обувь (4)')
+
+        response, facets = self.facets('/category_id/shoes/?price=1&price=5&in_stock=1')
+        self.assertEqual(facets, {'categories': [2, 0], 'prices': [0, 1, 0, 0, 0, 1], 'in_stock': 2})
+        self.assertEqual([good['slug'] for good in response.context['products']], ['boots-1', 'boots-3'])
+        self.assertEqual(response.context['paginator'].count, 2)
+
+        response, facets = self.facets('/category_id/coats/?active=all')
+        self.assertEqual(facets['prices'], [0, 0, 1, 0, 0, 0])
+        self.assertEqual([good['slug'] for good in response.context['products']], ['coat'])
+
+        User.objects.create_user(username='staff', password='123', is_staff=True)
+        self.client.login(username='staff', password='123')
+        response, facets = self.facets('/category_id/coats/?active=all')
+        self.assertEqual(facets['prices'], [0, 0, 2, 0, 0, 0])
+        response, facets = self.facets('/category_id/coats/?active=0')
+        self.assertEqual([good['slug'] for good in response.context['products']], ['cloak'])
+
+    def test_incremental_update(self):
+        self.client.get('/products/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coat.price = 500
+            self.coat.quantity = 0
+            self.coat.save()
+            Products.objects.get(slug='boots-0').delete()
+        _, facets = self.facets('/products/')
+        self.assertEqual(facets, {'categories': [3, 1], 'prices': [1, 2, 0, 0, 0, 1], 'in_stock': 2})
+
+        cells = set(ProductFacet.objects.filter(count__gt=0).values_list('category', 'price_bucket', 'in_stock',
+                                                                         'is_active', 'count'))
+        ProductFacet.rebuild()
+        self.assertEqual(cells, set(ProductFacet.objects.values_list('category', 'price_bucket', 'in_stock',
+                                                                      'is_active', 'count')))
+
+    def test_warm_filtered_page_without_queries(self):
+        self.client.get('/products/?price=1&in_stock=1')
+        with self.assertNumQueries(0):
+            response = self.client.get('/products/?price=1&in_stock=1')
+        self.assertEqual([good['slug'] for good in response.context['products']], ['boots-1'])
+
+
+@override_settings(LOW_CACHE=True)
+class TestFragmentCache(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.boots = Products.objects.create(name='Ботинки', slug='boots', category=category, price=100)
+        Products.objects.create(name='Туфли', slug='shoes', category=category, price=200)
+
+    def test_version(self):
+        self.assertEqual(self.boots.version, 1)
+        self.boots.save()
+        self.boots.save(update_fields=['price'])
+        self.assertEqual(self.boots.version, 3)
+        self.assertEqual(Products.objects.get(pk=self.boots.pk).version, 3)
+
+    def test_cards_are_cached_per_version(self):
+        response = self.client.get('/products/')
+        self.assertContains(response, 'Ботинки')
+        key = get_product_card_key({'id': self.boots.pk, 'version': 1})
+        self.assertIn('Ботинки', cache.get(key))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boots.name = 'Сапоги'
+            self.boots.save()
+        response = self.client.get('/products/')
+        self.assertContains(response, 'Сапоги')
+        self.assertNotContains(response, 'Ботинки')
+        self.assertIn('Сапоги', cache.get(get_product_card_key({'id': self.boots.pk, 'version': 2})))
+
+    def test_sidebar_follows_catalog_version(self):
+        self.assertContains(self.client.get('/products/'), 'Обувь (2)')
+        with self.captureOnCommitCallbacks(execute=True):
+            Products.objects.create(name='Кеды', slug='sneakers', category=self.boots.category)
+        self.assertContains(self.client.get('/products/'), 'Обувь (3)')
+
+
+class TestConditionalGet(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.boots = Products.objects.create(name='Ботинки', slug='boots', category=category, quantity=1)
+        User.objects.create_user(username='user', password='123')
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_product_detail(self):
+        response = self.client.get('/detail/boots/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        self.assertIn('must-revalidate', response['Cache-Control'])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.revalidate('/detail/boots/', response).status_code, 304)
+
+        self.boots.quantity = 0
+        self.boots.save()
+        self.assertEqual(self.revalidate('/detail/boots/', response).status_code, 200)
+        self.assertEqual(self.client.get('/detail/missing/').status_code, 404)
+
+    def test_catalog_pages(self):
+        response = self.client.get('/products/')
+        self.assertEqual(self.revalidate('/products/', response).status_code, 304)
+        self.assertEqual(self.revalidate('/products/?page=2', response).status_code, 404)
+        self.assertEqual(self.revalidate('/category_id/shoes/', response).status_code, 200)
+
+        self.client.login(username='user', password='123')
+        response_user = self.revalidate('/products/', response)
+        self.assertEqual(response_user.status_code, 200)
+        self.assertIn('private', response_user['Cache-Control'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Products.objects.create(name='Туфли', slug='shoes', category=self.boots.category)
+        self.assertEqual(self.revalidate('/products/', response_user).status_code, 200)
+
+
+class TestImportCatalog(TestCase):
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.categories = [{'model': 'mainapp.productcategory', 'pk': 7, 'fields': {'name': 'Обувь', 'slug': 'shoes'}}]
+        self.products = [{'name': f'Ботинки {i}', 'slug': f'boots-{i}', 'price': '100.50', 'quantity': i,
+                          'category': 7 if i % 2 else 'shoes'} for i in range(5)]
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def write(self, name, records, jsonl=False):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            if jsonl:
+                file.write('\n'.join(json.dumps(record, ensure_ascii=False) for record in records))
+            else:
+                json.dump(records, file, ensure_ascii=False, indent=2)
+        return path
+
+    def test_read_records(self):
+        array = self.write('products.json', self.products)
+        lines = self.write('products.jsonl', self.products, jsonl=True)
+        records = list(read_records(array, chunk_size=7))
+        self.assertEqual([record for record, _ in records], self.products)
+        self.assertEqual([record for record, _ in read_records(lines, chunk_size=7)], self.products)
+        resumed = read_records(array, offset=records[1][1])
+        self.assertEqual([record for record, _ in resumed], self.products[2:])
+
+    def test_import_and_update(self):
+        files = [self.write('categories.json', self.categories), self.write('products.jsonl', self.products, True)]
+        call_command('import_catalog', *files, stdout=StringIO())
+        category = ProductCategory.objects.get(slug='shoes')
+        self.assertEqual(Products.objects.filter(category=category).count(), 5)
+        self.assertEqual((category.active_count, category.in_stock_count), (5, 4))
+        self.assertEqual(ProductFacet.objects.get(category=category, in_stock=False).count, 1)
+
+        self.products[0]['price'] = 200
+        self.write('products.jsonl', self.products, True)
+        call_command('import_catalog', *files, stdout=StringIO())
+        self.assertEqual(list(Products.objects.order_by('id').values_list('price', 'version'))[:2],
+                         [(200, 2), (Decimal('100.50'), 1)])
+
+    def test_dry_run(self):
+        self.products[3]['price'] = 'дорого'
+        self.products[4]['category'] = 'missing'
+        files = [self.write('categories.json', self.categories), self.write('products.json', self.products)]
+        stderr = StringIO()
+        call_command('import_catalog', *files, dry_run=True, stdout=StringIO(), stderr=stderr)
+        self.assertFalse(Products.objects.exists())
+        self.assertFalse(ProductCategory.objects.exists())
+        self.assertIn('Неизвестная категория missing', stderr.getvalue())
+
+    def test_duplicate_category_name(self):
+        ProductCategory.objects.create(name='Сапоги', slug='boots')
+        self.categories += [{'model': 'mainapp.productcategory', 'fields': {'name': 'Сапоги', 'slug': 'high-boots'}},
+                            {'model': 'mainapp.productcategory', 'fields': {'name': 'Обувь', 'slug': 'footwear'}}]
+        stderr = StringIO()
+        call_command('import_catalog', self.write('categories.json', self.categories), stdout=StringIO(),
+                     stderr=stderr)
+        self.assertEqual(sorted(ProductCategory.objects.values_list('slug', flat=True)), ['boots', 'shoes'])
+        self.assertIn('Категория с названием Сапоги уже есть (slug boots)', stderr.getvalue())
+        self.assertIn('Категория с названием Обувь уже есть (slug shoes)', stderr.getvalue())
+
+    def test_resume_after_crash(self):
+        files = [self.write('categories.json', self.categories), self.write('products.json', self.products)]
+        write_chunk = ImportCatalog.write_chunk
+        calls = []
+
+        def crash(command, records):
+            calls.append(records)
+            if len(calls) == 3:
+                raise RuntimeError('сбой')
+            write_chunk(command, records)
+
+        with mock.patch.object(ImportCatalog, 'write_chunk', crash), self.assertRaises(RuntimeError):
+            call_command('import_catalog', *files, chunk_size=2, stdout=StringIO())
+        self.assertEqual(Products.objects.count(), 2)
+
+        call_command('import_catalog', *files, chunk_size=2, stdout=StringIO())
+        self.assertEqual(Products.objects.count(), 5)
+        self.assertFalse(os.path.exists(f'{files[0]}.checkpoint'))
+
+
+class TestExportCatalog(TestCase):
+
+    def setUp(self) -> None:
+        category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        for i in range(5):
+            Products.objects.create(name=f'Ботинки, "модель" {i}', slug=f'boots-{i}', category=category,
+                                    price=100 + i, is_active=i != 4)
+        User.objects.create_superuser(username='root', password='123')
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.csv.gz')
+            call_command('export_catalog', output=path, gzip=True, chunk_size=2, stderr=StringIO())
+            with gzip.open(path, 'rt', encoding='utf-8') as file:
+                rows = list(csv.DictReader(file))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual((rows[0]['name'], rows[0]['category_slug'], rows[0]['price']),
+                         ('Ботинки, "модель" 0', 'shoes', '100.00'))
+
+    def test_admin_endpoint(self):
+        self.assertEqual(self.client.get('/adminapp/catalog_export/').status_code, 302)
+        self.client.login(username='root', password='123')
+        response = self.client.get('/adminapp/catalog_export/', {'format': 'jsonl', 'gzip': '1', 'active': '1'})
+        self.assertTrue(response.streaming)
+        self.assertIn('.jsonl.gz', response['Content-Disposition'])
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual([json.loads(line)['slug'] for line in lines], [f'boots-{i}' for i in range(4)])
+        self.assertEqual(self.client.get('/adminapp/catalog_export/', {'format': 'xml'}).status_code, 404)
+
+
+@override_settings(SEARCH_BACKEND='memory')
+class TestSearch(TestCase):
+
+    def setUp(self) -> None:
+        get_search_backend().index = None
+        category = ProductCategory.objects.create(name='Одежда', slug='clothes')
+        self.coat = Products.objects.create(name='Синяя куртка The North Face', slug='coat', category=category,
+                                            description='Теплая зимняя куртка с капюшоном')
+        Products.objects.create(name='Кроссовки беговые', slug='sneakers', category=category,
+                                description='Легкие кроссовки для бега')
+        Products.objects.create(name='Красные кроссовки', slug='red-sneakers', category=category, is_active=False)
+
+    def search(self, query):
+        return [good['slug'] for good in search_products(query)]
+
+    def test_stemming_and_ranking(self):
+        self.assertEqual(self.search('куртки'), ['coat'])
+        self.assertEqual(self.search('кроссовок'), ['sneakers'])
+        self.assertEqual(self.search('north face'), ['coat'])
+        self.assertEqual(self.search('зимние куртки'), ['coat'])
+
+    def test_prefix_and_typo(self):
+        self.assertEqual(self.search('крос'), ['sneakers'])
+        self.assertEqual(self.search('кутрка'), ['coat'])
+        self.assertEqual(self.search('кроссовки пальто'), [])
+
+    def test_incremental_update(self):
+        self.search('куртка')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coat.name = 'Синее пальто'
+            self.coat.description = ''
+            self.coat.save()
+        self.assertEqual(self.search('куртка'), [])
+        self.assertEqual(self.search('пальто'), ['coat'])
+
+    def test_other_process_index_refreshed(self):
+        other = MemorySearchBackend()
+        self.assertEqual([product_id for product_id, _ in other.search('куртка')], [self.coat.pk])
+        self.search('куртка')
+        index = get_search_backend().get_index()
+        other_index = other.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.coat.name = 'Синее пальто'
+            self.coat.description = ''
+            self.coat.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(other.search('куртка'), [])
+        self.assertEqual([product_id for product_id, _ in other.search('пальто')], [self.coat.pk])
+        # индексы не перестраиваются: другой процесс применил изменение из журнала
+        self.assertIs(other.get_index(), other_index)
+        self.assertEqual(self.search('пальто'), ['coat'])
+        self.assertIs(get_search_backend().get_index(), index)
+
+    def test_invalidate_rebuilds_index(self):
+        other = MemorySearchBackend()
+        index = other.get_index()
+        invalidate_search_index()
+        self.assertIsNot(other.get_index(), index)
+
+    def test_views(self):
+        response = self.client.get('/search/', {'q': 'куртка'})
+        self.assertEqual([good['slug'] for good in response.context['products']], ['coat'])
+        data = self.client.get('/search/json/', {'q': 'бег'}).json()
+        self.assertEqual([item['slug'] for item in data['items']], ['sneakers'])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Поиск средствами Postgres')
+class TestPostgresSearch(TestCase):
+
+    def setUp(self) -> None:
+        category = ProductCategory.objects.create(name='Одежда', slug='clothes')
+        self.coat = Products.objects.create(name='Синяя куртка', slug='coat', category=category,
+                                            description='Теплая зимняя куртка')
+        self.backend = PostgresSearchBackend()
+
+    def test_full_text_and_typo(self):
+        self.assertEqual([product_id for product_id, _ in self.backend.search('куртки')], [self.coat.pk])
+        # слов нет в полнотекстовом индексе - поиск по триграммам
+        self.assertEqual([product_id for product_id, _ in self.backend.search('кутрка')], [self.coat.pk])
+
+
+class TestStock(TestCase):
+
+    def setUp(self) -> None:
+        self.category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.boots = Products.objects.create(name='Ботинки', slug='boots', category=self.category, quantity=2)
+        self.user = User.objects.create_user(username='user', password='123')
+
+    def assertStock(self, quantity, in_stock):
+        product = Products.objects.get(pk=self.boots.pk)
+        self.category.refresh_from_db()
+        self.assertEqual((product.quantity, self.category.in_stock_count), (quantity, in_stock))
+        return product
+
+    def test_reserve_and_release(self):
+        self.assertFalse(stock.reserve(self.boots.pk, 3))
+        self.assertStock(2, 1)
+        self.assertTrue(stock.reserve(self.boots.pk, 2))
+        product = self.assertStock(0, 0)
+        self.assertEqual(product.version, self.boots.version + 1)
+        stock.release(self.boots.pk, 1)
+        self.assertStock(1, 1)
+
+    def test_save_between_load_and_reserve(self):
+        product = Products.objects.get(pk=self.boots.pk)
+        self.assertTrue(stock.reserve(self.boots.pk, 2))
+        # обычное сохранение не возвращает остаток на момент загрузки объекта
+        product.name = 'Зимние ботинки'
+        product.save()
+        self.assertEqual(product.quantity, 0)
+        self.assertStock(0, 0)
+        self.assertFalse(stock.reserve(self.boots.pk, 1))
+        # остаток, явно измененный в форме товара, записывается
+        product.quantity = 5
+        product.save()
+        self.assertStock(5, 1)
+
+    def test_catalog_version_bumped_on_commit(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            stock.reserve(self.boots.pk, 1)
+            stock.release(self.boots.pk, 1)
+            stock.release_many([(self.boots.pk, 1)])
+        # товар остался в наличии - кеш каталога не сбрасывается
+        self.assertEqual((len(callbacks), get_catalog_version()), (0, version))
+        with self.captureOnCommitCallbacks() as callbacks:
+            stock.reserve_many([(self.boots.pk, 3)])
+            stock.release_many([(self.boots.pk, 3)])
+        self.assertEqual(get_catalog_version(), version)
+        self.assertEqual(len(callbacks), 2)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_basket_does_not_oversell(self):
+        basket = Basket.objects.create(user=self.user, product=self.boots, quantity=1)
+        basket = Basket.objects.get(pk=basket.pk)
+        basket.quantity = 2
+        with CaptureQueriesContext(connection) as context:
+            basket.save()
+        products = [query['sql'] for query in context.captured_queries if 'mainapp_products' in query['sql']]
+        self.assertEqual(len(products), 2)
+        self.assertIn('"quantity" >= 1', products[0])
+        self.assertNotIn('"name"', products[0])
+        self.assertFalse([query for query in context.captured_queries
+                          if query['sql'].startswith('SELECT') and 'basketapp_basket' in query['sql']])
+        self.assertStock(0, 0)
+        basket.quantity = 3
+        with self.assertRaises(stock.OutOfStock):
+            basket.save()
+        self.assertEqual(Basket.objects.get(pk=basket.pk).quantity, 2)
+        basket.quantity = 1
+        basket.save()
+        self.assertStock(1, 1)
+        Basket.objects.filter(pk=basket.pk).delete()
+        self.assertStock(2, 1)
+
+    def test_basket_add_view(self):
+        self.client.login(username='user', password='123')
+        for _ in range(2):
+            self.client.get(f'/basket/basket_add/{self.boots.pk}', HTTP_REFERER='/')
+        etag = self.client.get('/products/')['ETag']
+        response = self.client.get(f'/basket/basket_add/{self.boots.pk}', HTTP_REFERER='/products/', follow=True,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Товара нет в нужном количестве')
+        self.assertEqual(Basket.objects.get(user=self.user).quantity, 2)
+        self.assertStock(0, 0)
+        self.assertNotContains(self.client.get('/products/'), 'Товара нет в нужном количестве')
+
+    def fill_basket(self, size):
+        products = [Products.objects.create(name=f'Товар {i}', slug=f'bulk-{size}-{i}', category=self.category,
+                                            quantity=1) for i in range(size)]
+        for product in products:
+            Basket.objects.create(user=self.user, product=product, quantity=1)
+        return products
+
+    def clear_basket_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            Basket.objects.filter(user=self.user).delete()
+        return len(context.captured_queries)
+
+    def test_bulk_release_query_count(self):
+        self.fill_basket(5)
+        small = self.clear_basket_queries()
+        products = self.fill_basket(50)
+        self.assertEqual(self.clear_basket_queries(), small)
+        self.assertEqual(set(Products.objects.filter(pk__in=[p.pk for p in products])
+                             .values_list('quantity', flat=True)), {1})
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.in_stock_count, 56)
+
+    def test_order_stock_returned_once(self):
+        Products.objects.filter(pk=self.boots.pk).update(quantity=3)
+        orders = []
+        for steps in ((), (Order.SENT_TO_PROCEED, Order.PROCEEDED, Order.PAID),
+                      (Order.SENT_TO_PROCEED, Order.PROCEEDED, Order.PAID, Order.READY)):
+            Basket.objects.add(self.user.pk, self.boots.pk)
+            order = Order.from_basket(self.user)
+            for status in steps:
+                order.change_status(status)
+            orders.append(order)
+        forming, paid, ready = orders
+        self.assertStock(0, 0)
+        # повторное удаление не возвращает товар еще раз
+        forming.delete()
+        Order.objects.get(pk=forming.pk).delete()
+        self.assertStock(1, 1)
+        # отмена возвращает товар, удаление отмененного заказа - нет
+        paid.change_status(Order.CANCEL)
+        paid.delete()
+        self.assertStock(2, 1)
+        # выданный заказ отменить нельзя - товар не возвращается
+        ready.delete()
+        self.assertStock(2, 1)
+        self.assertEqual(list(Order.objects.order_by('id').values_list('status', 'is_active')),
+                         [(Order.CANCEL, False), (Order.CANCEL, False), (Order.READY, False)])
+
+    def test_order_delete_query_count(self):
+        order = Order.objects.create(user=self.user)
+        products = self.fill_basket(30)
+        Basket.objects.filter(user=self.user).delete(key='make_order')
+        self.assertEqual(Products.objects.filter(pk__in=[p.pk for p in products], quantity=0).count(), 30)
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=1) for product in products])
+        # + блокировка заказа и событие отмены в outbox
+        with self.assertNumQueries(13):
+            order.delete()
+        self.assertEqual(Products.objects.filter(pk__in=[p.pk for p in products], quantity=1).count(), 30)
+
+
+class TestStockConcurrency(TransactionTestCase):
+
+    def test_stale_reader_cannot_oversell(self):
+        # последовательная проверка условного UPDATE: остаток прочитан до того, как его забрал другой запрос
+        category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        product = Products.objects.create(name='Ботинки', slug='boots', category=category, quantity=2)
+        stale = Products.objects.get(pk=product.pk)
+        self.assertTrue(stock.reserve(product.pk, 2))
+        with self.assertRaises(stock.OutOfStock):
+            stock.adjust(stale.pk, stale.quantity)
+        with self.assertRaises(stock.OutOfStock):
+            stock.reserve_many([(stale.pk, 1)])
+        self.assertEqual(Products.objects.get(pk=product.pk).quantity, 0)
+        category.refresh_from_db()
+        self.assertEqual(category.in_stock_count, 0)
+
+    # параллельные потоки требуют отдельных соединений с тестовой БД - тест выполняется на Postgres
+    @skipUnlessDBFeature('test_db_allows_multiple_connections')
+    def test_no_oversell(self):
+        category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        product = Products.objects.create(name='Ботинки', slug='boots', category=category, quantity=30)
+        reserved, _ = stress(product.pk, threads=4, attempts=20)
+        self.assertEqual(reserved, 30)
+        self.assertEqual(Products.objects.get(pk=product.pk).quantity, 0)
+        category.refresh_from_db()
+        self.assertEqual(category.in_stock_count, 0)
@@ -1,5 +1,5 @@
 from django.urls import path
-from mainapp.views import IndexView, ProductDetail, ProductsView
+from mainapp.views import IndexView, ProductDetail, ProductsView, CatalogJsonView, SearchView, SearchJsonView
 
 app_name = 'mainapp'
 urlpatterns = [
@@ -7,4 +7,17 @@ urlpatterns = [
     path('products/', ProductsView.as_view(), name='products'),
     path('category_id/<slug:cat_slug>/', ProductsView.as_view(), name='category_id'),
     path('detail/<slug:slug>/', ProductDetail.as_view(), name='product_detail'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('search/json/', SearchJsonView.as_view(), name='search_json'),
+
+    # keyset-пагинация: курсор непрозрачен для клиента и берется из ссылок next/prev
+    path('products/keyset/', ProductsView.as_view(keyset=True), name='products_keyset'),
+    path('products/keyset/<str:cursor>/', ProductsView.as_view(keyset=True), name='products_keyset'),
+    path('category_id/<slug:cat_slug>/keyset/', ProductsView.as_view(keyset=True), name='category_keyset'),
+    path('category_id/<slug:cat_slug>/keyset/<str:cursor>/', ProductsView.as_view(keyset=True),
+         name='category_keyset'),
+    path('catalog/json/', CatalogJsonView.as_view(), name='products_json'),
+    path('catalog/json/<str:cursor>/', CatalogJsonView.as_view(), name='products_json'),
+    path('category_id/<slug:cat_slug>/json/', CatalogJsonView.as_view(), name='category_json'),
+    path('category_id/<slug:cat_slug>/json/<str:cursor>/', CatalogJsonView.as_view(), name='category_json'),
 ]
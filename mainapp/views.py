@@ -1,14 +1,25 @@
+import hashlib
 import json
 import os
 
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.contrib.messages import get_messages
+from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage, InvalidPage, Page
+from django.http import Http404, JsonResponse, QueryDict
 from django.shortcuts import render
 from datetime import datetime
 
 from adminapp.mixin import AdminContextMixin
-from mainapp.cache_functions import get_links_menu, get_links_menu_category
+from mainapp.cache_functions import get_catalog_version, get_catalog_page, get_catalog_queryset, get_categories, \
+    get_facets, CATALOG_PRODUCT_FIELDS
+from mainapp.facets import ACTIVE_VALUES, PRICE_BUCKETS, parse_prices, price_label
 from mainapp.models import Products, ProductCategory
-from django.views.generic import DetailView, ListView, TemplateView
+from mainapp.pagination import KeysetPaginator, InvalidCursor, KEYSET_ORDERINGS
+from mainapp.search import search_products
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import condition
+from django.views.generic import DetailView, ListView, TemplateView, View
 
 now = datetime.today().strftime('%H:%M')
 MODULE_DIR = os.path.dirname(__file__)
@@ -33,9 +44,131 @@ class IndexView(TemplateView, AdminContextMixin):
 #
 #     return render(request, 'mainapp/index.html', content)
 
-class ProductsView(ListView):
-    """Список товаров"""
+def _etag(request, *parts):
+    """
+    ETag страницы. В шапке сайта выводятся имя пользователя и ссылка на админку,
+    поэтому пользователь тоже входит в ETag. Страница с непоказанными сообщениями
+    (например, об ошибке добавления в корзину) не должна совпасть с закешированной
+    """
+    user = request.user
+    user_tag = (user.pk, user.first_name, user.is_superuser) if user.is_authenticated else None
+    return hashlib.md5(repr((user_tag, len(get_messages(request)), *parts)).encode()).hexdigest()
+
+
+def catalog_etag(request, *args, **kwargs):
+    """ETag страницы каталога: версия каталога и адрес страницы (категория, номер/курсор, фильтры)"""
+    return _etag(request, get_catalog_version(), request.get_full_path())
+
+
+def product_state(request, slug):
+    if not hasattr(request, '_product_state'):
+        request._product_state = Products.objects.filter(slug=slug).values(
+            'updated_at', 'quantity', 'is_active').first()
+    return request._product_state
+
+
+def product_etag(request, slug):
+    """ETag карточки товара: слаг, время изменения и наличие на складе"""
+    state = product_state(request, slug)
+    if state is None:
+        return None
+    return _etag(request, slug, state['updated_at'].isoformat(), state['quantity'] > 0, state['is_active'])
+
+
+def product_last_modified(request, slug):
+    state = product_state(request, slug)
+    return state and state['updated_at']
+
+
+class ConditionalMixin:
+    """
+    Условный GET: при совпадении ETag/Last-Modified возвращается 304 без рендера страницы.
+    max-age=0 заставляет браузер и обратный прокси перед сервисом web каждый раз перепроверять страницу
+    """
+    etag_func = None
+    last_modified_func = None
+
+    def dispatch(self, request, *args, **kwargs):
+        dispatch = condition(etag_func=self.etag_func, last_modified_func=self.last_modified_func)(
+            super(ConditionalMixin, self).dispatch)
+        response = dispatch(request, *args, **kwargs)
+        patch_cache_control(response, max_age=0, must_revalidate=True, private=request.user.is_authenticated)
+        return response
+
+
+class KeysetMixin:
+    """
+    Keyset-пагинация каталога: страница задается курсором из URL,
+    сортировка - GET параметром order (id или price)
+    """
     paginate_by = 5
+    keyset_url_name = 'mainapp:products_keyset'
+    keyset_category_url_name = 'mainapp:category_keyset'
+
+    def get_keyset_ordering(self):
+        ordering = self.request.GET.get('order', 'id')
+        if ordering not in KEYSET_ORDERINGS:
+            raise Http404(f'Неизвестная сортировка: {ordering}')
+        return ordering
+
+    def get_keyset_page(self, queryset):
+        paginator = KeysetPaginator(queryset, self.paginate_by, self.get_keyset_ordering())
+        try:
+            return paginator.page(self.kwargs.get('cursor'), values=CATALOG_PRODUCT_FIELDS)
+        except InvalidCursor:
+            raise Http404('Неверный курсор')
+
+    def get_cursor_url(self, cursor):
+        if cursor is None:
+            return None
+        kwargs = {'cursor': cursor}
+        url_name = self.keyset_url_name
+        if self.kwargs.get('cat_slug'):
+            kwargs['cat_slug'] = self.kwargs['cat_slug']
+            url_name = self.keyset_category_url_name
+        url = reverse(url_name, kwargs=kwargs)
+        # сортировка и фильтры передаются GET параметрами и сохраняются при переходе по курсору
+        query = self.request.GET.urlencode()
+        return f'{url}?{query}' if query else url
+
+
+class CatalogFilterMixin:
+    """
+    Фасетные фильтры каталога из GET параметров:
+    price - номер ценового диапазона (можно несколько), in_stock=1 - только в наличии,
+    active=1|0|all - активность товаров (только для персонала, остальным всегда active=1).
+    Категория задается слагом в URL
+    """
+
+    def get_catalog_filters(self):
+        active = True
+        if self.request.user.is_staff:
+            active = ACTIVE_VALUES.get(self.request.GET.get('active', '1'), True)
+        return {
+            'prices': parse_prices(self.request.GET.getlist('price')),
+            'in_stock': self.request.GET.get('in_stock') == '1',
+            'active': active,
+        }
+
+    def get_filtered_queryset(self):
+        return get_catalog_queryset(self.kwargs.get('cat_slug'), **self.get_catalog_filters())
+
+
+def filter_query(prices=(), in_stock=False, active=True):
+    """GET параметры фильтров каталога (без ?)"""
+    query = QueryDict(mutable=True)
+    query.setlist('price', [str(bucket) for bucket in prices])
+    if in_stock:
+        query['in_stock'] = '1'
+    if active is not True:
+        query['active'] = next(key for key, value in ACTIVE_VALUES.items() if value is active)
+    return query.urlencode()
+
+
+class ProductsView(ConditionalMixin, CatalogFilterMixin, KeysetMixin, ListView):
+    """Список товаров. При keyset=True страницы переключаются курсорами вместо номеров"""
+    etag_func = staticmethod(catalog_etag)
+    keyset = False
     model = Products
     template_name = 'mainapp/products.html'
     context_object_name = 'products'
@@ -43,10 +176,127 @@ class ProductsView(ListView):
     time = now
 
     def get_queryset(self):
-        if self.kwargs.get('cat_slug'):
-            return get_links_menu_category(self.kwargs.get('cat_slug'))
-            # return qs.filter(category=self.kwargs.get('category')).select_related('category')
-        return get_links_menu()
+        return self.get_filtered_queryset()
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Страница берется из кеша каталога целиком (товары и их количество),
+        queryset из get_queryset при этом не выполняется.
+        В режиме keyset страница выбирается по курсору без OFFSET и COUNT(*)
+        """
+        if self.keyset:
+            page = self.get_keyset_page(queryset)
+            return None, page, page.object_list, page.has_next() or page.has_previous()
+
+        page_number = self.request.GET.get(self.page_kwarg) or self.kwargs.get(self.page_kwarg) or 1
+        try:
+            page_number = int(page_number)
+        except ValueError:
+            raise Http404('Номер страницы должен быть числом')
+
+        catalog_page = get_catalog_page(self.kwargs.get('cat_slug'), max(page_number, 1), page_size,
+                                        **self.get_catalog_filters())
+        paginator = Paginator(range(catalog_page['count']), page_size)
+        try:
+            paginator.validate_number(page_number)
+        except InvalidPage as e:
+            raise Http404(f'Неверная страница ({page_number}): {e}')
+        page = Page(catalog_page['items'], page_number, paginator)
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super(ProductsView, self).get_context_data(**kwargs)
+        if self.keyset:
+            page = context['page_obj']
+            context['keyset_page'] = page
+            context['next_url'] = self.get_cursor_url(page.next_cursor)
+            context['prev_url'] = self.get_cursor_url(page.prev_cursor)
+        # фасеты считаются лениво - только если боковой панели нет в кеше
+        filters = self.get_catalog_filters()
+        context['filter_query'] = filter_query(**filters)
+        context['facets_key'] = f'{self.kwargs.get("cat_slug", "")}?{context["filter_query"]}'
+        context['facets'] = SimpleLazyObject(self.get_facets_context)
+        return context
+
+    def get_facets_context(self):
+        """Значения фильтров для боковой панели: подпись, количество товаров и ссылка"""
+        filters = self.get_catalog_filters()
+        prices, in_stock = filters['prices'], filters['in_stock']
+        cat_slug = self.kwargs.get('cat_slug')
+        categories = get_categories()
+        category_id = next((category['id'] for category in categories if category['slug'] == cat_slug), None)
+        facets = get_facets(category_id, **filters)
+        base_url = reverse('mainapp:category_id', args=[cat_slug]) if cat_slug else reverse('mainapp:products')
+
+        def url(path=base_url, **changes):
+            query = filter_query(**dict(filters, **changes))
+            return f'{path}?{query}' if query else path
+
+        return {
+            'all': {'count': sum(facets['categories'].values()), 'selected': not cat_slug,
+                    'url': url(reverse('mainapp:products'))},
+            'categories': [
+                {'name': category['name'], 'count': facets['categories'].get(category['id'], 0),
+                 'selected': category['id'] == category_id,
+                 'url': url(reverse('mainapp:category_id', args=[category['slug']]))}
+                for category in categories
+            ],
+            'prices': [
+                {'label': price_label(bucket), 'count': facets['prices'][bucket], 'selected': bucket in prices,
+                 'url': url(prices=tuple(sorted(set(prices) ^ {bucket})))}
+                for bucket in range(len(PRICE_BUCKETS))
+            ],
+            'in_stock': {'count': facets['in_stock'], 'selected': in_stock, 'url': url(in_stock=not in_stock)},
+        }
+
+
+class CatalogJsonView(CatalogFilterMixin, KeysetMixin, View):
+    """
+    Каталог в JSON с keyset-пагинацией и фасетными фильтрами.
+    Ссылки next/prev ведут на соседние страницы
+    """
+    keyset_url_name = 'mainapp:products_json'
+    keyset_category_url_name = 'mainapp:category_json'
+
+    def get(self, request, *args, **kwargs):
+        page = self.get_keyset_page(self.get_filtered_queryset())
+        return JsonResponse({
+            'items': [dict(item, price=str(item['price'])) for item in page],
+            'next': self.get_cursor_url(page.next_cursor),
+            'prev': self.get_cursor_url(page.prev_cursor),
+        }, json_dumps_params={'ensure_ascii': False})
+
+
+class SearchView(TemplateView, AdminContextMixin):
+    """Поиск по названию и описанию товаров"""
+    template_name = 'mainapp/search.html'
+    title = 'GeekShop - Поиск'
+    time = now
+    limit = 20
+
+    def get_context_data(self, **kwargs):
+        context = super(SearchView, self).get_context_data(**kwargs)
+        query = self.request.GET.get('q', '').strip()
+        context['query'] = query
+        context['products'] = search_products(query, self.limit) if query else []
+        return context
+
+
+class SearchJsonView(View):
+    """Поиск по товарам в JSON: ?q=запрос&limit=20"""
+    max_limit = 100
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get('q', '').strip()
+        try:
+            limit = min(int(request.GET.get('limit', 20)), self.max_limit)
+        except ValueError:
+            limit = 20
+        items = search_products(query, limit) if query else []
+        return JsonResponse({
+            'query': query,
+            'items': [dict(item, price=str(item['price'])) for item in items],
+        }, json_dumps_params={'ensure_ascii': False})
 
 
 # FBV вариант ProductsView
@@ -76,7 +326,9 @@ class ProductsView(ListView):
 #     return render(request, 'mainapp/products.html', content)
 
 
-class ProductDetail(DetailView):
+class ProductDetail(ConditionalMixin, DetailView):
     """Детализация отдельного товара"""
+    etag_func = staticmethod(product_etag)
+    last_modified_func = staticmethod(product_last_modified)
     model = Products
     template_name = 'mainapp/product_detail.html'
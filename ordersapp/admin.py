@@ -1,7 +1,8 @@
 from django.contrib import admin
 
 # Register your models here.
-from ordersapp.models import Order, OrderItem
+from ordersapp.models import Order, OrderEvent, OrderItem
 
 admin.site.register(Order)
 admin.site.register(OrderItem)
+admin.site.register(OrderEvent)
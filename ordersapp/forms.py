@@ -1,4 +1,5 @@
 from django import forms
+from django.urls import reverse_lazy
 
 from mainapp.models import Products
 from ordersapp.models import Order, OrderItem
@@ -15,6 +16,33 @@ class OrderForm(forms.ModelForm):
             field.widget.attrs['class'] = 'form-contorl'
 
 
+class ProductAutocompleteSelect(forms.Select):
+    """
+    Выбор товара без списка всего каталога: выводится только выбранный товар,
+    остальные варианты подгружаются из автодополнения (order_scripts.js).
+    Названия выбранных товаров передает форма, недостающие читаются одним запросом
+    """
+
+    def __init__(self, attrs=None):
+        super(ProductAutocompleteSelect, self).__init__(attrs)
+        self.labels = {}
+
+    def __deepcopy__(self, memo):
+        obj = super(ProductAutocompleteSelect, self).__deepcopy__(memo)
+        obj.labels = {}
+        return obj
+
+    def optgroups(self, name, value, attrs=None):
+        selected = [product_id for product_id in value if product_id]
+        missing = [product_id for product_id in selected if product_id not in self.labels]
+        if missing:
+            self.labels.update((str(product_id), product_name) for product_id, product_name in
+                               Products.objects.filter(pk__in=missing).values_list('id', 'name'))
+        self.choices = [('', '---------')] + [(product_id, self.labels.get(product_id, product_id))
+                                              for product_id in selected]
+        return super(ProductAutocompleteSelect, self).optgroups(name, value, attrs)
+
+
 class OrderItemForm(forms.ModelForm):
     """Форма отдельного товара в заказе"""
     price = forms.CharField(label='Цена', required=False)
@@ -22,9 +50,20 @@ class OrderItemForm(forms.ModelForm):
     class Meta:
         model = OrderItem
         exclude = ()
+        widgets = {
+            'product': ProductAutocompleteSelect(
+                attrs={'data-autocomplete': reverse_lazy('ordersapp:product_autocomplete'),
+                       'data-prices': reverse_lazy('ordersapp:product_prices')}),
+        }
 
     def __init__(self, *args, **kwargs):
         super(OrderItemForm, self).__init__(*args, **kwargs)
-        self.fields['product'].queryset = Products.get_items().select_related()
+        # queryset не выполняется при выводе формы: по нему только проверяется выбранный товар
+        self.fields['product'].queryset = Products.get_items()
+        product = self.initial.get('product')
+        if isinstance(product, Products):
+            self.fields['product'].widget.labels[str(product.pk)] = product.name
+        elif self.instance.pk:
+            self.fields['product'].widget.labels[str(self.instance.product_id)] = self.instance.product_name
         for field_name, field in self.fields.items():
             field.widget.attrs['class'] = 'form-control'
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ordersapp.models import Order
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает итоги (total_quantity, total_cost) всех заказов по их позициям.
+    Заказы обновляются пачками по диапазону id, каждая пачка - в своей транзакции
+    """
+    help = 'Пересчет итогов заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = Order.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        updated = 0
+        for start in range(0, last_id, batch_size):
+            with transaction.atomic():
+                updated += Order.recount_totals(Order.objects.filter(pk__gt=start, pk__lte=start + batch_size))
+        self.stdout.write(f'Пересчитано заказов: {updated}')
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ordersapp import outbox
+
+
+class Command(BaseCommand):
+    """
+    Обрабатывает события смены статуса заказов из outbox (ordersapp.outbox) до опустошения очереди.
+    С --loop работает как воркер: когда очередь пуста, ждет N секунд и проверяет снова.
+    Воркеров можно запускать несколько - события разбираются без пересечений.
+    Пример: python manage.py run_order_worker --loop 5
+    """
+    help = 'Обработка событий смены статуса заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', type=int, metavar='SECONDS', help='Ждать новых событий каждые SECONDS секунд')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            processed, failed = outbox.drain(options['batch_size'])
+            elapsed = time.perf_counter() - started
+            if processed or failed or not options['loop']:
+                metrics = outbox.get_metrics()
+                self.stdout.write(
+                    f'Обработано событий: {processed}, ошибок: {failed} '
+                    f'({processed / elapsed if elapsed else 0:.0f} событий/с); '
+                    f'в очереди {metrics["pending"]}, задержка {metrics["lag"]:.1f} с, '
+                    f'не обработано после {outbox.MAX_ATTEMPTS} попыток: {metrics["failed"]}')
+            if not options['loop']:
+                break
+            if not processed and not failed:
+                time.sleep(options['loop'])
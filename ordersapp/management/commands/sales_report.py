@@ -0,0 +1,35 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ordersapp import sales
+
+
+class Command(BaseCommand):
+    """
+    Отчет о продажах из дневных агрегатов (заполняются командой update_sales).
+    Пример: python manage.py sales_report --from 2022-07-01 --to 2022-07-31 --by product --daily
+    """
+    help = 'Отчет о продажах по категориям или товарам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat,
+                            help='Первый день (по умолчанию - 30 дней назад)')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat,
+                            help='Последний день (по умолчанию - сегодня)')
+        parser.add_argument('--by', choices=('category', 'product'), default='category')
+        parser.add_argument('--daily', action='store_true', help='Разбивка по дням')
+
+    def handle(self, *args, **options):
+        date_to = options['date_to'] or timezone.localdate()
+        date_from = options['date_from'] or date_to - timedelta(days=29)
+        rows = sales.sales_report(date_from, date_to, options['by'], options['daily'])
+        # число заказов не суммируется: заказ с товарами разных категорий входит в несколько строк
+        units = revenue = 0
+        for row in rows:
+            day = f'{row["date"]}  ' if options['daily'] else ''
+            self.stdout.write(f'{day}{row[options["by"] + "__name"]:<40} {row["units"]:>8} шт. '
+                              f'{row["revenue"]:>14.2f} руб. {row["orders"]:>6} заказов')
+            units, revenue = units + row['units'], revenue + row['revenue']
+        self.stdout.write(f'Итого с {date_from} по {date_to}: {units} шт., {revenue:.2f} руб.')
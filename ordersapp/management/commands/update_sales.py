@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ordersapp import sales
+
+
+class Command(BaseCommand):
+    """
+    Обновляет дневные агрегаты продаж (ordersapp.sales): пересчитывает дни с заказами,
+    измененными после прошлого запуска. С --rebuild пересчитывает все дни с нуля.
+    Пример (cron): python manage.py update_sales
+    """
+    help = 'Обновление дневных агрегатов продаж'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Пересчитать все агрегаты с нуля')
+        parser.add_argument('--days-per-batch', type=int, default=7, help='Дней в одном окне полного пересчета')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Строк агрегатов в одной вставке')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['rebuild']:
+            days = sales.rebuild_sales(options['days_per_batch'], options['batch_size'])
+        else:
+            days = sales.update_sales(options['batch_size'])
+        self.stdout.write(f'Пересчитано дней: {days} ({time.perf_counter() - started:.2f} с)')
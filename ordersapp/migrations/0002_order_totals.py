@@ -0,0 +1,41 @@
+# Generated by Django 3.2.6 on 2026-10-18 13:51
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_totals(apps, schema_editor):
+    Order = apps.get_model('ordersapp', 'Order')
+    OrderItem = apps.get_model('ordersapp', 'OrderItem')
+
+    def total(expression, output_field):
+        items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        return Coalesce(Subquery(items.annotate(total=Sum(expression, output_field=output_field)).values('total')),
+                        Value(0), output_field=output_field)
+
+    Order.objects.update(
+        total_quantity=total(F('quantity'), models.PositiveIntegerField()),
+        total_cost=total(F('quantity') * F('product__price'), models.DecimalField(max_digits=12, decimal_places=2)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordersapp', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_cost',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='Стоимость'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Товаров'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
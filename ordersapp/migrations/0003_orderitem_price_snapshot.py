@@ -0,0 +1,23 @@
+# Generated by Django 3.2.6 on 2026-10-18 13:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordersapp', '0002_order_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(blank=True, editable=False, max_length=128, verbose_name='Название товара'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=8, verbose_name='Цена'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, transaction
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def fill_snapshot(apps, schema_editor):
+    """
+    Заполняет цену и название товара у существующих позиций заказов текущими значениями товара.
+    Позиции обновляются пачками по диапазону id, каждая пачка - в своей транзакции,
+    чтобы не держать блокировку на всей таблице
+    """
+    OrderItem = apps.get_model('ordersapp', 'OrderItem')
+    Products = apps.get_model('mainapp', 'Products')
+    product = Products.objects.filter(pk=OuterRef('product_id'))
+    last_id = OrderItem.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    for start in range(0, last_id, BATCH_SIZE):
+        with transaction.atomic(using=schema_editor.connection.alias):
+            OrderItem.objects.filter(pk__gt=start, pk__lte=start + BATCH_SIZE).update(
+                unit_price=Subquery(product.values('price')[:1]),
+                product_name=Subquery(product.values('name')[:1]),
+            )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('mainapp', '0008_updated_at'),
+        ('ordersapp', '0003_orderitem_price_snapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_snapshot, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.6 on 2026-10-18 13:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordersapp', '0004_fill_orderitem_price_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'is_active', 'created_at'], name='ordersapp_o_user_id_7aec89_idx'),
+        ),
+    ]
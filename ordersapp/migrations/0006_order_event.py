@@ -0,0 +1,38 @@
+# Generated by Django 3.2.6 on 2026-10-18 13:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ordersapp', '0005_order_list_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(choices=[('FM', 'Формируется'), ('STP', 'Отправлен в обработку'), ('PRD', 'Обрабатывается'), ('PD', 'Оплачен'), ('RDY', 'Готов к выдаче'), ('CNC', 'Отменен')], max_length=3, verbose_name='Из статуса')),
+                ('to_status', models.CharField(choices=[('FM', 'Формируется'), ('STP', 'Отправлен в обработку'), ('PRD', 'Обрабатывается'), ('PD', 'Оплачен'), ('RDY', 'Готов к выдаче'), ('CNC', 'Отменен')], max_length=3, verbose_name='В статус')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Доступно с')),
+                ('lease', models.CharField(blank=True, max_length=32, verbose_name='Аренда воркера')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Обработано')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='ordersapp.order', verbose_name='Заказ')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='orderevent',
+            index=models.Index(condition=models.Q(('processed_at', None)), fields=['available_at'], name='order_event_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderevent',
+            index=models.Index(fields=['processed_at'], name='ordersapp_o_process_890ac1_idx'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 3.2.6 on 2026-10-18 14:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0008_updated_at'),
+        ('ordersapp', '0006_order_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCategorySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='День')),
+                ('units', models.PositiveIntegerField(default=0, verbose_name='Продано единиц')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('orders', models.PositiveIntegerField(default=0, verbose_name='Заказов')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='День')),
+                ('units', models.PositiveIntegerField(default=0, verbose_name='Продано единиц')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('orders', models.PositiveIntegerField(default=0, verbose_name='Заказов')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SalesWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32, unique=True, verbose_name='Агрегат')),
+                ('value', models.DateTimeField(verbose_name='Обновлено по')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['update_at'], name='ordersapp_o_update__d084ef_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='ordersapp_o_created_5129b6_idx'),
+        ),
+        migrations.AddField(
+            model_name='dailyproductsales',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mainapp.products', verbose_name='Товар'),
+        ),
+        migrations.AddField(
+            model_name='dailycategorysales',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mainapp.productcategory', verbose_name='Категория'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyproductsales',
+            unique_together={('date', 'product')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailycategorysales',
+            unique_together={('date', 'category')},
+        ),
+    ]
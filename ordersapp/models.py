@@ -1,10 +1,25 @@
 from django.conf import settings
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 
 # Create your models here.
+from django.utils import timezone
 from django.utils.functional import cached_property
 
-from mainapp.models import Products
+from basketapp.models import Basket
+from mainapp import stock
+from mainapp.models import ProductCategory, Products
+
+
+class InvalidTransition(ValueError):
+    """Переход заказа в этот статус из текущего не разрешен"""
+
+    def __init__(self, from_status, to_status):
+        self.from_status = from_status
+        self.to_status = to_status
+        super(InvalidTransition, self).__init__(f'Переход заказа из статуса {from_status} в {to_status} запрещен')
 
 
 class Order(models.Model):
@@ -26,40 +41,163 @@ class Order(models.Model):
         (CANCEL, 'Отменен'),
     )
 
+    # разрешенные переходы статусов, "Готов к выдаче" и "Отменен" - конечные
+    TRANSITIONS = {
+        FORMING: (SENT_TO_PROCEED, CANCEL),
+        SENT_TO_PROCEED: (PROCEEDED, CANCEL),
+        PROCEEDED: (PAID, CANCEL),
+        PAID: (READY, CANCEL),
+        READY: (),
+        CANCEL: (),
+    }
+    # заказы, которые учитываются в продажах (ordersapp.sales): оформлены и не отменены
+    SALE_STATUSES = (SENT_TO_PROCEED, PROCEEDED, PAID, READY)
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name='Пользователь')
     status = models.CharField(choices=STATUSES, max_length=3, default=FORMING, verbose_name='Статус')
     update_at = models.DateTimeField(auto_now=True, verbose_name='Обновлен')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создан')
     is_active = models.BooleanField(default=True, verbose_name='Активность')
+    # итоги по позициям заказа, пересчитываются в той же транзакции, что и изменение позиций
+    total_quantity = models.PositiveIntegerField(default=0, editable=False, verbose_name='Товаров')
+    total_cost = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False,
+                                     verbose_name='Стоимость')
+
+    TOTAL_FIELDS = ('total_quantity', 'total_cost')
+
+    class Meta:
+        # список заказов пользователя: активные, от новых к старым
+        indexes = [
+            models.Index(fields=['user', 'is_active', 'created_at']),
+            # измененные заказы и диапазоны дней для агрегатов продаж (ordersapp.sales)
+            models.Index(fields=['update_at']),
+            models.Index(fields=['created_at']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Order, cls).from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    def can_change_status(self, status, from_status=None):
+        return status in self.TRANSITIONS[from_status or self.status]
+
+    def clean(self):
+        loaded = getattr(self, '_loaded_status', None)
+        if loaded and self.status != loaded and not self.can_change_status(self.status, loaded):
+            raise ValidationError({'status': str(InvalidTransition(loaded, self.status))})
+
+    def save(self, *args, **kwargs):
+        loaded = getattr(self, '_loaded_status', None)
+        if self.pk is None or (loaded is not None and self.status == loaded):
+            self._save(*args, **kwargs)
+            return
+
+        # статус изменен или загруженный статус неизвестен (Order(pk=...), .only(), .defer('status')):
+        # переход проверяется по заблокированной строке, событие в outbox пишется в той же транзакции
+        with transaction.atomic():
+            self._save_transition(self._locked_row(), *args, **kwargs)
+
+    def _locked_row(self):
+        """Статус и активность заказа в БД (строка блокируется до конца транзакции), None - заказа нет"""
+        return Order.objects.select_for_update().filter(pk=self.pk).values_list('status', 'is_active').first()
+
+    def _save_transition(self, row, *args, **kwargs):
+        if row is None:
+            self._save(*args, **kwargs)
+            return
+        current, active = row
+        if self.status != current and not self.can_change_status(self.status, current):
+            raise InvalidTransition(current, self.status)
+        self._save(*args, **kwargs)
+        if self.status != current:
+            if self.status == self.CANCEL and active:
+                # товары отмененного заказа возвращаются на склад один раз: статус "Отменен" конечный
+                stock.release_many(self.orderitem.values_list('product_id', 'quantity'))
+            OrderEvent.objects.create(order=self, from_status=current, to_status=self.status)
+
+    def _save(self, *args, **kwargs):
+        # Итоги меняются только через recount_totals, иначе сохранение формы заказа
+        # затрет их значениями на момент загрузки объекта
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.TOTAL_FIELDS]
+        super(Order, self).save(*args, **kwargs)
+        self._loaded_status = self.status
+
+    def change_status(self, status):
+        """Переводит заказ в статус status. Выбрасывает InvalidTransition, если переход запрещен"""
+        self.status = status
+        self.save(update_fields=['status', 'update_at'])
+
+    @staticmethod
+    def recount_totals(orders):
+        """Пересчитывает итоги заказов из queryset orders одним UPDATE с подзапросами по позициям"""
+        def total(expression, output_field):
+            items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+            return Coalesce(Subquery(items.annotate(total=Sum(expression, output_field=output_field))
+                                     .values('total')), Value(0), output_field=output_field)
+
+        return orders.update(
+            update_at=timezone.now(),
+            total_quantity=total(F('quantity'), models.PositiveIntegerField()),
+            total_cost=total(F('quantity') * F('unit_price'), DecimalField(max_digits=12, decimal_places=2)),
+        )
+
+    def refresh_totals(self):
+        self.refresh_from_db(fields=self.TOTAL_FIELDS)
+
+    @classmethod
+    def from_basket(cls, user):
+        """
+        Оформляет корзину пользователя в заказ одной транзакцией за постоянное число запросов:
+        строки корзины блокируются и удаляются, позиции заказа создаются одним bulk_create.
+        Товар уже зарезервирован корзиной и переходит в заказ без изменения остатков.
+        Если корзина пуста (например, ее уже оформил параллельный запрос), возвращает None
+        """
+        with transaction.atomic():
+            lines = list(Basket.objects.select_for_update().filter(user=user).order_by('id')
+                         .values_list('id', 'product_id', 'quantity', 'product__price', 'product__name'))
+            if not lines:
+                return None
+            # удаление первым: при параллельном оформлении той же корзины второй запрос
+            # удалит меньше строк, чем прочитал, и откатится. Товар не возвращается на склад -
+            # удаление в обход BasketQuerySet.delete
+            deleted, _ = models.QuerySet.delete(Basket.objects.filter(pk__in=[line[0] for line in lines]))
+            if deleted != len(lines):
+                transaction.set_rollback(True)
+                return None
+            order = cls.objects.create(
+                user=user,
+                total_quantity=sum(quantity for _, _, quantity, _, _ in lines),
+                total_cost=sum(quantity * price for _, _, quantity, price, _ in lines),
+            )
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_id=product_id, quantity=quantity, unit_price=price, product_name=name)
+                for _, product_id, quantity, price, name in lines
+            ])
+        return order
 
     def delete(self, **kwargs):
-        for item in self.orderitem.select_related():
-            item.product.quantity += item.quantity
-            item.product.save()
-        self.is_active = False
-        # self.status = self.CANCEL
-        self.save()
+        """
+        Снимает заказ с активных. Если из текущего статуса разрешена отмена, заказ переходит в "Отменен":
+        товары возвращаются на склад, событие пишется в outbox. Уже отмененный или выданный заказ
+        товары повторно не возвращает
+        """
+        with transaction.atomic():
+            row = self._locked_row()
+            if row is None:
+                return
+            self.is_active = False
+            self.status = self.CANCEL if self.can_change_status(self.CANCEL, row[0]) else row[0]
+            self._save_transition(row)
 
     @cached_property
     def get_items(self):
         items = self.orderitem.select_related()
         return items
 
-    def get_summary(self):
-        items = self.orderitem.select_related()
-        return {
-            'order_total_quantity': sum(list(map(lambda x: x.quantity, items))),
-            'order_total_cost': sum(list(map(lambda x: x.product.price * x.quantity, items)))
-        }
-
-    def get_total_quantity(self):
-        items = self.get_items
-        return sum(list(map(lambda x: x.quantity, items)))
-
-    def total_cost(self):
-        items = self.get_items
-        return sum(list(map(lambda x: x.product.price * x.quantity, items)))
-
     def __str__(self):
         return f'Заказ | {self.pk}'
 
@@ -70,11 +208,91 @@ class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='orderitem', on_delete=models.CASCADE, verbose_name='Заказ')
     product = models.ForeignKey(Products, on_delete=models.CASCADE, verbose_name='Товар')
     quantity = models.PositiveIntegerField(default=0, verbose_name='Кол-во')
+    # цена и название товара на момент заказа: изменение товара не меняет старые заказы
+    unit_price = models.DecimalField(max_digits=8, decimal_places=2, default=0, editable=False, verbose_name='Цена')
+    product_name = models.CharField(max_length=128, blank=True, editable=False, verbose_name='Название товара')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(OrderItem, cls).from_db(db, field_names, values)
+        instance._loaded_product_id = instance.__dict__.get('product_id')
+        return instance
 
     def get_product_cost(self):
-        return self.product.price * self.quantity
+        return self.unit_price * self.quantity
+
+    def save(self, *args, **kwargs):
+        if self._state.adding or self.product_id != getattr(self, '_loaded_product_id', None):
+            self.unit_price, self.product_name = self.product.price, self.product.name
+            self._loaded_product_id = self.product_id
+        with transaction.atomic():
+            super(OrderItem, self).save(*args, **kwargs)
+            Order.recount_totals(Order.objects.filter(pk=self.order_id))
 
     def delete(self, **kwargs):
-        self.product.quantity += self.quantity
-        self.product.save()
-        super(OrderItem, self).delete(**kwargs)
+        with transaction.atomic():
+            stock.release(self.product_id, self.quantity)
+            super(OrderItem, self).delete(**kwargs)
+            Order.recount_totals(Order.objects.filter(pk=self.order_id))
+
+
+class OrderEvent(models.Model):
+    """
+    Событие смены статуса заказа (transactional outbox). Пишется в одной транзакции со сменой статуса,
+    обрабатывается воркером run_order_worker (см. ordersapp.outbox)
+    """
+
+    order = models.ForeignKey(Order, related_name='events', on_delete=models.CASCADE, verbose_name='Заказ')
+    from_status = models.CharField(choices=Order.STATUSES, max_length=3, verbose_name='Из статуса')
+    to_status = models.CharField(choices=Order.STATUSES, max_length=3, verbose_name='В статус')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
+    # не раньше этого времени событие может взять воркер: сдвигается на время аренды и при повторах
+    available_at = models.DateTimeField(default=timezone.now, verbose_name='Доступно с')
+    lease = models.CharField(max_length=32, blank=True, verbose_name='Аренда воркера')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name='Обработано')
+
+    class Meta:
+        indexes = [
+            # очередь необработанных событий
+            models.Index(fields=['available_at'], condition=Q(processed_at=None), name='order_event_pending_idx'),
+            # пропускная способность за последнюю минуту
+            models.Index(fields=['processed_at']),
+        ]
+
+    def __str__(self):
+        return f'Заказ {self.order_id}: {self.from_status} -> {self.to_status}'
+
+
+class DailyProductSales(models.Model):
+    """Продажи товара за день (по дате создания заказа), заполняется ordersapp.sales"""
+
+    date = models.DateField(verbose_name='День')
+    product = models.ForeignKey(Products, on_delete=models.CASCADE, verbose_name='Товар')
+    units = models.PositiveIntegerField(default=0, verbose_name='Продано единиц')
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Выручка')
+    orders = models.PositiveIntegerField(default=0, verbose_name='Заказов')
+
+    class Meta:
+        unique_together = ('date', 'product')
+
+
+class DailyCategorySales(models.Model):
+    """Продажи категории за день, заполняется ordersapp.sales"""
+
+    date = models.DateField(verbose_name='День')
+    category = models.ForeignKey(ProductCategory, on_delete=models.CASCADE, verbose_name='Категория')
+    units = models.PositiveIntegerField(default=0, verbose_name='Продано единиц')
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Выручка')
+    orders = models.PositiveIntegerField(default=0, verbose_name='Заказов')
+
+    class Meta:
+        unique_together = ('date', 'category')
+
+
+class SalesWatermark(models.Model):
+    """Время последнего обновления агрегатов продаж: следующий проход берет заказы, измененные после него"""
+
+    name = models.CharField(max_length=32, unique=True, verbose_name='Агрегат')
+    value = models.DateTimeField(verbose_name='Обновлено по')
@@ -0,0 +1,110 @@
+"""
+Обработка событий смены статуса заказа (таблица OrderEvent - transactional outbox).
+
+Событие пишется в той же транзакции, что и новый статус (Order.save), поэтому оно
+появляется тогда и только тогда, когда смена статуса зафиксирована. Воркер (run_order_worker)
+забирает события пачками и рассылает их получателям сигнала order_status_changed.
+
+Событие захватывается арендой: в короткой транзакции выбираются доступные события
+(в Postgres - SELECT ... FOR UPDATE SKIP LOCKED, занятые другим воркером строки пропускаются),
+затем условный UPDATE записывает в них токен воркера и сдвигает available_at на LEASE_SECONDS.
+Условие на available_at не дает двум воркерам взять одно событие и в sqlite, где блокировок строк нет.
+Если воркер упал, аренда истекает и событие берет другой воркер, поэтому доставка - "хотя бы один раз":
+получатели должны быть идемпотентными (например, помнить обработанные event.pk).
+При ошибке получателя событие повторяется с экспоненциальной задержкой, после MAX_ATTEMPTS попыток
+остается в таблице с last_error и больше не выбирается.
+"""
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Min
+from django.dispatch import Signal
+from django.utils import timezone
+
+from ordersapp.models import OrderEvent
+
+# аргументы: event - OrderEvent с загруженным order
+order_status_changed = Signal()
+
+LEASE_SECONDS = 60
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 10
+METRICS_WINDOW = 60
+
+
+def pending_events():
+    """Необработанные события, для которых еще остались попытки"""
+    return OrderEvent.objects.filter(processed_at=None, attempts__lt=MAX_ATTEMPTS)
+
+
+def claim_events(batch_size):
+    """Берет в аренду до batch_size доступных событий. Возвращает (токен аренды, события)"""
+    token = uuid.uuid4().hex
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(pending_events().filter(available_at__lte=now).order_by('id')
+                   .select_for_update(skip_locked=True).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return token, []
+        OrderEvent.objects.filter(pk__in=ids, processed_at=None, available_at__lte=now).update(
+            lease=token, available_at=now + timedelta(seconds=LEASE_SECONDS))
+    return token, list(OrderEvent.objects.filter(pk__in=ids, lease=token).select_related('order').order_by('id'))
+
+
+def _deliver(event):
+    errors = [response for _, response in order_status_changed.send_robust(sender=OrderEvent, event=event)
+              if isinstance(response, Exception)]
+    if errors:
+        raise errors[0]
+
+
+def process_batch(batch_size=100):
+    """
+    Обрабатывает одну пачку событий. Обработанные события отмечаются одним UPDATE,
+    и только пока аренда принадлежит этому воркеру. Возвращает (обработано, ошибок)
+    """
+    token, events = claim_events(batch_size)
+    done = []
+    for event in events:
+        try:
+            _deliver(event)
+        except Exception as error:
+            OrderEvent.objects.filter(pk=event.pk, lease=token).update(
+                lease='',
+                attempts=event.attempts + 1,
+                last_error=repr(error),
+                available_at=timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** event.attempts),
+            )
+        else:
+            done.append(event.pk)
+    if done:
+        OrderEvent.objects.filter(pk__in=done, lease=token).update(lease='', processed_at=timezone.now())
+    return len(done), len(events) - len(done)
+
+
+def drain(batch_size=100):
+    """Обрабатывает пачки, пока доступные события не закончатся. Возвращает (обработано, ошибок)"""
+    processed = failed = 0
+    while True:
+        done, errors = process_batch(batch_size)
+        processed, failed = processed + done, failed + errors
+        if done + errors < batch_size:
+            return processed, failed
+
+
+def get_metrics():
+    """
+    Состояние очереди: pending - ждут обработки, failed - исчерпали попытки,
+    lag - возраст самого старого ожидающего события в секундах,
+    throughput - обработано событий в секунду за последние METRICS_WINDOW секунд
+    """
+    now = timezone.now()
+    oldest = pending_events().aggregate(oldest=Min('created_at'))['oldest']
+    return {
+        'pending': pending_events().count(),
+        'failed': OrderEvent.objects.filter(processed_at=None, attempts__gte=MAX_ATTEMPTS).count(),
+        'lag': (now - oldest).total_seconds() if oldest else 0,
+        'throughput': OrderEvent.objects.filter(
+            processed_at__gte=now - timedelta(seconds=METRICS_WINDOW)).count() / METRICS_WINDOW,
+    }
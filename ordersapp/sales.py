@@ -0,0 +1,150 @@
+"""
+Дневные агрегаты продаж: DailyProductSales и DailyCategorySales (единицы, выручка, заказы).
+
+Продажей считается позиция активного заказа в статусе из Order.SALE_STATUSES, день - дата создания заказа,
+выручка - quantity * unit_price (цена на момент заказа), поэтому отчеты не читают позиции и каталог.
+
+Агрегаты дня всегда пересчитываются целиком: строки дня удаляются и заново вставляются из GROUP BY
+по позициям заказов этого дня, так что повторный пересчет ничего не портит.
+- update_sales - инкрементальное обновление: пересчитываются только дни, в которых есть заказы,
+  измененные после отметки SalesWatermark (update_at заказа меняется при смене статуса, удалении
+  и изменении позиций). Отметка берется с запасом WATERMARK_OVERLAP на транзакции,
+  зафиксированные позже начала предыдущего прохода;
+- rebuild_sales - полный пересчет: диапазон дат проходится окнами по days_per_batch дней, группировка
+  выполняется в БД, результат читается итератором и вставляется пачками, поэтому память ограничена
+  одной пачкой строк независимо от числа позиций. Каждое окно заменяется в своей транзакции,
+  так что отчеты во время пересчета видят полные данные.
+Пересчет дней идет под блокировкой агрегатов (_lock_sales), поэтому параллельные проходы update_sales
+и rebuild_sales не вставляют одни и те же строки дня.
+"""
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from ordersapp.models import DailyCategorySales, DailyProductSales, Order, OrderItem, SalesWatermark
+
+SALES_WATERMARK = 'daily_sales'
+# ключ advisory-блокировки Postgres для пересчета агрегатов
+SALES_LOCK_ID = 0x5A1E5
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _day_ranges(days):
+    """Склеивает дни в непрерывные диапазоны [начало, конец)"""
+    ranges = []
+    for day in sorted(set(days)):
+        if ranges and ranges[-1][1] == day:
+            ranges[-1][1] = day + timedelta(days=1)
+        else:
+            ranges.append([day, day + timedelta(days=1)])
+    return ranges
+
+
+def _grouped(items, key, field):
+    """GROUP BY (день, key) по позициям: единицы, выручка и число разных заказов"""
+    date = TruncDate('order__created_at')
+    rows = items.values(field, date=date) if key == field else items.values(date=date, **{key: F(field)})
+    return rows.annotate(
+        units=Sum('quantity'),
+        revenue=Sum(F('quantity') * F('unit_price'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        orders=Count('order_id', distinct=True),
+    ).order_by()
+
+
+def _write(model, rows, batch_size):
+    rows = (model(**row) for row in rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        model.objects.bulk_create(batch)
+
+
+def _lock_sales():
+    """Блокирует пересчет агрегатов другими процессами до конца транзакции"""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [SALES_LOCK_ID])
+    else:
+        # sqlite сам выполняет пишущие транзакции по одной, в остальных БД блокируется строка отметки
+        list(SalesWatermark.objects.select_for_update().filter(name=SALES_WATERMARK))
+
+
+def refresh_range(start, end, batch_size=5000):
+    """Пересчитывает агрегаты дней [start, end) в одной транзакции"""
+    items = OrderItem.objects.filter(order__created_at__gte=_day_start(start), order__created_at__lt=_day_start(end),
+                                     order__is_active=True, order__status__in=Order.SALE_STATUSES)
+    with transaction.atomic():
+        _lock_sales()
+        for model in (DailyProductSales, DailyCategorySales):
+            model.objects.filter(date__gte=start, date__lt=end).delete()
+        _write(DailyProductSales, _grouped(items, 'product_id', 'product_id').iterator(batch_size), batch_size)
+        _write(DailyCategorySales, _grouped(items, 'category_id', 'product__category_id').iterator(batch_size),
+               batch_size)
+
+
+def _set_watermark(value):
+    SalesWatermark.objects.update_or_create(name=SALES_WATERMARK, defaults={'value': value})
+
+
+def update_sales(batch_size=5000):
+    """
+    Пересчитывает дни с заказами, измененными после отметки, и сдвигает отметку на время начала прохода.
+    Без отметки выполняет полный пересчет. Возвращает число пересчитанных дней
+    """
+    started = timezone.now()
+    watermark = SalesWatermark.objects.filter(name=SALES_WATERMARK).values_list('value', flat=True).first()
+    if watermark is None:
+        return rebuild_sales(batch_size=batch_size)
+    days = list(Order.objects.filter(update_at__gte=watermark - WATERMARK_OVERLAP).order_by()
+                .dates('created_at', 'day'))
+    for start, end in _day_ranges(days):
+        refresh_range(start, end, batch_size)
+    _set_watermark(started)
+    return len(days)
+
+
+def rebuild_sales(days_per_batch=7, batch_size=5000):
+    """
+    Пересчитывает агрегаты с нуля окнами по days_per_batch дней, каждое окно - в своей транзакции.
+    Строки дней вне диапазона заказов удаляются в конце. Возвращает число пройденных дней
+    """
+    started = timezone.now()
+    bounds = Order.objects.aggregate(first=Min('created_at'), last=Max('created_at'))
+    days = 0
+    stale = Q()
+    if bounds['first'] is not None:
+        day, last = timezone.localdate(bounds['first']), timezone.localdate(bounds['last'])
+        stale = Q(date__lt=day) | Q(date__gt=last)
+        while day <= last:
+            end = min(day + timedelta(days=days_per_batch), last + timedelta(days=1))
+            refresh_range(day, end, batch_size)
+            days += (end - day).days
+            day = end
+    with transaction.atomic():
+        _lock_sales()
+        for model in (DailyProductSales, DailyCategorySales):
+            model.objects.filter(stale).delete()
+    _set_watermark(started)
+    return days
+
+
+def sales_report(date_from, date_to, by='category', daily=False):
+    """
+    Продажи за дни [date_from, date_to] из агрегатов: по категориям или товарам (by),
+    итогом за период или по дням (daily). Строки отсортированы по дню и убыванию выручки
+    """
+    model = DailyCategorySales if by == 'category' else DailyProductSales
+    fields = ['date'] if daily else []
+    return (model.objects.filter(date__gte=date_from, date__lte=date_to)
+            .values(*fields, f'{by}_id', f'{by}__name')
+            .annotate(units=Sum('units'), revenue=Sum('revenue'), orders=Sum('orders'))
+            .order_by(*fields, '-revenue', f'{by}_id'))
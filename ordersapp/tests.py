@@ -1,3 +1,455 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 # Create your tests here.
+from authapp.models import User
+from basketapp.models import Basket
+from mainapp.models import ProductCategory, Products
+from mainapp.search import get_search_backend
+from ordersapp import outbox, sales
+from ordersapp.models import DailyCategorySales, DailyProductSales, InvalidTransition, Order, OrderEvent, OrderItem
+
+
+class TestCheckout(TestCase):
+
+    def setUp(self) -> None:
+        self.category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.user = User.objects.create_user(username='user', password='123')
+
+    def fill_basket(self, size):
+        for i in range(size):
+            product = Products.objects.create(name=f'Товар {i}', slug=f'checkout-{size}-{i}',
+                                              category=self.category, price=10 + i, quantity=5)
+            Basket.objects.add(self.user.pk, product.pk, 2)
+
+    def checkout_queries(self, size):
+        self.fill_basket(size)
+        with self.assertNumQueries(7):
+            order = Order.from_basket(self.user)
+        self.assertEqual(order.orderitem.count(), size)
+        return order
+
+    def test_constant_queries(self):
+        self.checkout_queries(3)
+        order = self.checkout_queries(40)
+        self.assertFalse(Basket.objects.exists())
+        self.assertEqual(set(order.orderitem.values_list('quantity', flat=True)), {2})
+        # товар перешел в заказ, остатки не изменились
+        self.assertEqual(set(Products.objects.values_list('quantity', flat=True)), {3})
+
+    def test_empty_basket(self):
+        self.assertIsNone(Order.from_basket(self.user))
+        self.assertFalse(Order.objects.exists())
+
+    def test_make_order_view(self):
+        self.fill_basket(2)
+        self.client.login(username='user', password='123')
+        response = self.client.get('/make_order/')
+        self.assertRedirects(response, '/orders/', fetch_redirect_response=False)
+        self.assertEqual(OrderItem.objects.filter(order__user=self.user).count(), 2)
+
+
+class TestOrderTotals(TestCase):
+
+    def setUp(self) -> None:
+        category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.boots = Products.objects.create(name='Ботинки', slug='boots', category=category, price=100, quantity=10)
+        self.shoes = Products.objects.create(name='Туфли', slug='shoes', category=category, price=250, quantity=10)
+        self.user = User.objects.create_user(username='user', password='123')
+        Basket.objects.add(self.user.pk, self.boots.pk, 2)
+        Basket.objects.add(self.user.pk, self.shoes.pk, 1)
+        self.order = Order.from_basket(self.user)
+
+    def assertTotals(self, quantity, cost):
+        self.order.refresh_totals()
+        self.assertEqual((self.order.total_quantity, self.order.total_cost), (quantity, cost))
+
+    def test_checkout_and_item_changes(self):
+        self.assertEqual((self.order.total_quantity, self.order.total_cost), (3, 450))
+        item = self.order.orderitem.get(product=self.boots)
+        item.quantity = 4
+        item.save()
+        self.assertTotals(5, 650)
+        OrderItem.objects.create(order=self.order, product=self.boots, quantity=1)
+        self.assertTotals(6, 750)
+        item.delete()
+        self.assertTotals(2, 350)
+
+    def test_stale_order_save_keeps_totals(self):
+        order = Order.objects.get(pk=self.order.pk)
+        OrderItem.objects.create(order=self.order, product=self.boots, quantity=1)
+        order.status = Order.SENT_TO_PROCEED
+        order.save()
+        self.assertTotals(4, 550)
+
+    def test_pages_read_columns(self):
+        self.client.login(username='user', password='123')
+        for url in ('/orders/', f'/order_read/{self.order.pk}'):
+            response = self.client.get(url)
+            self.assertContains(response, '450')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.order.total_cost, 450)
+
+    def test_recount_command(self):
+        Order.objects.update(total_quantity=0, total_cost=0)
+        out = StringIO()
+        call_command('recount_order_totals', batch_size=1, stdout=out)
+        self.assertIn('Пересчитано заказов: 1', out.getvalue())
+        self.assertTotals(3, 450)
+
+    def test_price_snapshot(self):
+        self.assertEqual(set(self.order.orderitem.values_list('product_name', 'unit_price')),
+                         {('Ботинки', 100), ('Туфли', 250)})
+        Products.objects.filter(pk=self.boots.pk).update(price=1000, name='Сапоги')
+        item = self.order.orderitem.get(product=self.boots)
+        item.quantity = 3
+        item.save()
+        self.assertEqual((item.unit_price, item.product_name), (100, 'Ботинки'))
+        self.assertTotals(4, 550)
+        # новая позиция получает текущую цену
+        OrderItem.objects.create(order=self.order, product_id=self.boots.pk, quantity=1)
+        self.assertTotals(5, 1550)
+
+    def test_recount_does_not_join_products(self):
+        with CaptureQueriesContext(connection) as queries:
+            Order.recount_totals(Order.objects.filter(pk=self.order.pk))
+        self.assertNotIn('mainapp_products', ' '.join(query['sql'] for query in queries))
+
+
+class TestOrdersList(TestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='user', password='123')
+        other = User.objects.create_user(username='other', password='123')
+        Order.objects.create(user=other)
+        self.orders = [Order.objects.create(user=self.user, status=Order.PAID if i % 3 == 0 else Order.FORMING)
+                       for i in range(25)]
+        Order.objects.filter(pk=self.orders[5].pk).update(is_active=False)
+        self.client.login(username='user', password='123')
+
+    def walk(self, url):
+        pks = []
+        while url:
+            response = self.client.get(url)
+            pks.extend(order.pk for order in response.context['orders'])
+            url = response.context['next_url']
+        return pks, response
+
+    def test_pages(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/orders/')
+        self.assertEqual(len(response.context['orders']), 20)
+        self.assertIsNone(response.context['prev_url'])
+
+        pks, last = self.walk('/orders/')
+        expected = [order.pk for order in reversed(self.orders) if order.pk != self.orders[5].pk]
+        self.assertEqual(pks, expected)
+        response = self.client.get(last.context['prev_url'])
+        self.assertEqual([order.pk for order in response.context['orders']], expected[:20])
+
+    def test_status_filter(self):
+        pks, _ = self.walk('/orders/status/PD/')
+        self.assertEqual(pks, [order.pk for order in reversed(self.orders[::3])])
+        self.assertEqual(self.client.get('/orders/status/XX/').status_code, 404)
+        self.assertEqual(self.client.get('/orders/page/garbage/').status_code, 404)
+
+
+class TestOrderItemProductChoices(TestCase):
+
+    def setUp(self) -> None:
+        get_search_backend().index = None
+        category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.products = [Products.objects.create(name=f'Кроссовки {i}', slug=f'sneakers-{i}', category=category,
+                                                 price=100 + i, quantity=10) for i in range(30)]
+        self.boots = Products.objects.create(name='Ботинки', slug='boots', category=category, price=500, quantity=10)
+        self.user = User.objects.create_user(username='user', password='123')
+        self.client.login(username='user', password='123')
+
+    def test_create_form_renders_only_selected(self):
+        for product in self.products[:3]:
+            Basket.objects.add(self.user.pk, product.pk)
+        response = self.client.get('/order_create/')
+        content = response.content.decode()
+        self.assertEqual(content.count('<option'), 2 * 3)
+        self.assertIn('Кроссовки 2', content)
+        self.assertNotIn('Кроссовки 3<', content)
+        self.assertIn('data-autocomplete="/product/autocomplete/"', content)
+
+    def test_update_form_uses_snapshot_names(self):
+        Basket.objects.add(self.user.pk, self.boots.pk)
+        order = Order.from_basket(self.user)
+        Products.objects.filter(pk=self.boots.pk).update(name='Сапоги')
+        response = self.client.get(f'/order_update/{order.pk}')
+        self.assertContains(response, '>Ботинки</option>')
+        self.assertNotContains(response, 'Кроссовки')
+
+    def test_autocomplete(self):
+        data = self.client.get('/product/autocomplete/', {'q': 'ботин'}).json()
+        self.assertEqual(data['items'], [{'id': self.boots.pk, 'name': 'Ботинки', 'price': '500.00'}])
+        self.assertEqual(self.client.get('/product/autocomplete/').json()['items'], [])
+
+
+@override_settings(LOW_CACHE=True)
+class TestProductPrices(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.boots = Products.objects.create(name='Ботинки', slug='boots', category=category, price=100, quantity=3)
+        self.shoes = Products.objects.create(name='Туфли', slug='shoes', category=category, price=250, quantity=7)
+        self.url = f'/product/prices/?ids={self.boots.pk},{self.shoes.pk}'
+
+    def test_batch_and_cache(self):
+        with self.assertNumQueries(1):
+            data = self.client.get(self.url).json()
+        self.assertEqual(data['prices'], {str(self.boots.pk): {'price': '100.00', 'quantity': 3},
+                                          str(self.shoes.pk): {'price': '250.00', 'quantity': 7}})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).json(), data)
+
+    def test_price_edit_invalidates(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.boots.price = 120
+            self.boots.save()
+        self.assertEqual(self.client.get(self.url).json()['prices'][str(self.boots.pk)]['price'], '120.00')
+
+    def test_bad_ids(self):
+        self.assertEqual(self.client.get('/product/prices/?ids=1,x').status_code, 400)
+        self.assertEqual(self.client.get('/product/prices/').json(), {'prices': {}})
+
+
+class TestOrderEvents(TestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='user', password='123')
+        self.order = Order.objects.create(user=self.user)
+        self.received = []
+        outbox.order_status_changed.connect(self.receiver)
+
+    def tearDown(self) -> None:
+        outbox.order_status_changed.disconnect(self.receiver)
+
+    def receiver(self, event, **kwargs):
+        self.received.append((event.pk, event.from_status, event.to_status))
+
+    def test_transitions(self):
+        self.order.change_status(Order.SENT_TO_PROCEED)
+        with self.assertRaises(InvalidTransition):
+            self.order.change_status(Order.READY)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, Order.SENT_TO_PROCEED)
+        # статус сохраненного заказа проверяется по БД, а не по загруженному объекту
+        stale = Order.objects.get(pk=self.order.pk)
+        self.order.change_status(Order.CANCEL)
+        with self.assertRaises(InvalidTransition):
+            stale.change_status(Order.PROCEEDED)
+        self.assertEqual(list(OrderEvent.objects.order_by('id').values_list('from_status', 'to_status')),
+                         [('FM', 'STP'), ('STP', 'CNC')])
+
+    def test_unknown_loaded_status(self):
+        Order(pk=self.order.pk, status=Order.SENT_TO_PROCEED).save(update_fields=['status'])
+        order = Order.objects.only('id', 'user_id').get(pk=self.order.pk)
+        order.status = Order.READY
+        with self.assertRaises(InvalidTransition):
+            order.save()
+        order.status = Order.PROCEEDED
+        order.save()
+        self.assertEqual(list(OrderEvent.objects.order_by('id').values_list('from_status', 'to_status')),
+                         [('FM', 'STP'), ('STP', 'PRD')])
+
+    def test_delete_cancels_with_event(self):
+        self.order.change_status(Order.SENT_TO_PROCEED)
+        Order.objects.get(pk=self.order.pk).delete()
+        self.assertEqual(Order.objects.filter(pk=self.order.pk, is_active=False, status=Order.CANCEL).count(), 1)
+        self.assertEqual(list(OrderEvent.objects.order_by('id').values_list('to_status', flat=True)),
+                         [Order.SENT_TO_PROCEED, Order.CANCEL])
+
+    def test_purchase_view(self):
+        self.client.login(username='user', password='123')
+        for _ in range(2):
+            self.client.get(f'/purchase/{self.order.pk}/')
+        self.assertEqual(OrderEvent.objects.filter(order=self.order).count(), 1)
+
+    def test_worker_retries_and_delivers_once(self):
+        self.order.change_status(Order.SENT_TO_PROCEED)
+        event = OrderEvent.objects.get()
+        failures = []
+
+        def broken(**kwargs):
+            if not failures:
+                failures.append(1)
+                raise RuntimeError('склад недоступен')
+
+        outbox.order_status_changed.connect(broken)
+        try:
+            self.assertEqual(outbox.drain(), (0, 1))
+            event.refresh_from_db()
+            self.assertEqual((event.attempts, event.processed_at), (1, None))
+            self.assertIn('склад недоступен', event.last_error)
+            # повтор - после задержки
+            self.assertEqual(outbox.drain(), (0, 0))
+            OrderEvent.objects.update(available_at=event.created_at)
+            self.assertEqual(outbox.drain(), (1, 0))
+        finally:
+            outbox.order_status_changed.disconnect(broken)
+
+        self.assertEqual(outbox.drain(), (0, 0))
+        self.assertEqual(self.received, [(event.pk, 'FM', 'STP')] * 2)
+        self.assertEqual(outbox.get_metrics()['pending'], 0)
+
+    def test_leased_events_are_skipped(self):
+        self.order.change_status(Order.SENT_TO_PROCEED)
+        token, events = outbox.claim_events(10)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(outbox.claim_events(10)[1], [])
+        self.assertEqual(outbox.get_metrics()['pending'], 1)
+
+    def test_command_and_metrics(self):
+        self.order.change_status(Order.SENT_TO_PROCEED)
+        self.order.change_status(Order.PROCEEDED)
+        out = StringIO()
+        call_command('run_order_worker', batch_size=1, stdout=out)
+        self.assertIn('Обработано событий: 2, ошибок: 0', out.getvalue())
+        self.assertEqual(len(self.received), 2)
+
+        User.objects.create_superuser(username='root', password='123')
+        self.client.login(username='root', password='123')
+        metrics = self.client.get('/orders/events/metrics/').json()
+        self.assertEqual((metrics['pending'], metrics['failed']), (0, 0))
+        self.assertGreater(metrics['throughput'], 0)
+
+
+class TestSalesAggregates(TestCase):
+
+    def setUp(self) -> None:
+        self.shoes = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        self.coats = ProductCategory.objects.create(name='Куртки', slug='coats')
+        self.boots = Products.objects.create(name='Ботинки', slug='boots', category=self.shoes, price=100, quantity=50)
+        self.sneakers = Products.objects.create(name='Кроссовки', slug='sneakers', category=self.shoes, price=50,
+                                                quantity=50)
+        self.coat = Products.objects.create(name='Куртка', slug='coat', category=self.coats, price=300, quantity=50)
+        self.user = User.objects.create_user(username='user', password='123')
+        self.today = timezone.localdate()
+        self.old = self.order({self.boots: 2, self.sneakers: 1, self.coat: 1}, days_ago=3)
+        self.order({self.boots: 1}, days_ago=3)
+        self.order({self.coat: 5}, status=Order.FORMING)
+
+    def order(self, lines, days_ago=0, status=Order.SENT_TO_PROCEED):
+        for product, quantity in lines.items():
+            Basket.objects.add(self.user.pk, product.pk, quantity)
+        order = Order.from_basket(self.user)
+        if status != Order.FORMING:
+            order.change_status(status)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        return order
+
+    def category_sales(self):
+        return {(row.date, row.category.slug): (row.units, row.revenue, row.orders)
+                for row in DailyCategorySales.objects.select_related('category')}
+
+    def test_rebuild(self):
+        # строки дней без заказов удаляются в конце пересчета, а не до него
+        DailyCategorySales.objects.create(date=self.today - timedelta(days=30), category=self.boots.category,
+                                          units=1, revenue=1, orders=1)
+        self.assertEqual(sales.rebuild_sales(days_per_batch=1, batch_size=1), 4)
+        day = self.today - timedelta(days=3)
+        self.assertEqual(self.category_sales(), {(day, 'shoes'): (4, 350, 2), (day, 'coats'): (1, 300, 1)})
+        self.assertEqual(DailyProductSales.objects.get(product=self.boots).units, 3)
+
+    def test_incremental_update(self):
+        sales.rebuild_sales()
+        expected = self.category_sales()
+        self.order({self.coat: 2})
+        self.old.change_status(Order.CANCEL)
+        # пересчитываются только дни измененных заказов
+        self.assertEqual(sales.update_sales(), 2)
+        del expected[(self.today - timedelta(days=3), 'coats')]
+        expected[(self.today - timedelta(days=3), 'shoes')] = (1, 100, 1)
+        expected[(self.today, 'coats')] = (2, 600, 1)
+        self.assertEqual(self.category_sales(), expected)
+        self.assertEqual(sales.update_sales(), 2)
+        self.assertEqual(self.category_sales(), expected)
+
+    def test_report_command_and_admin_page(self):
+        call_command('update_sales', stdout=StringIO())
+        out = StringIO()
+        call_command('sales_report', '--by', 'product', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('Ботинки'))
+        self.assertIn('Итого', lines[-1])
+        self.assertIn('650.00 руб.', lines[-1])
+
+        User.objects.create_superuser(username='root', password='123')
+        self.client.login(username='root', password='123')
+        response = self.client.get('/adminapp/sales/')
+        self.assertContains(response, 'Куртки')
+        self.assertEqual(self.client.get('/adminapp/sales/?from=garbage').status_code, 404)
+
+
+class TestParallelCheckout(TransactionTestCase):
+
+    def test_lost_race_rolls_back(self):
+        # последовательная проверка: пока запрос читал корзину, часть строк оформил параллельный запрос
+        category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        user = User.objects.create_user(username='user', password='123')
+        for i in range(3):
+            product = Products.objects.create(name=f'Товар {i}', slug=f'race-{i}', category=category, quantity=1)
+            Basket.objects.add(user.pk, product.pk)
+        lines = list(Basket.objects.filter(user=user).values_list('pk', flat=True))
+        delete = QuerySet.delete
+
+        def delete_after_other_checkout(queryset):
+            Basket.objects.filter(pk=lines[0])._raw_delete(queryset.db)
+            return delete(queryset)
+
+        with mock.patch.object(QuerySet, 'delete', delete_after_other_checkout):
+            self.assertIsNone(Order.from_basket(user))
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(list(Basket.objects.filter(user=user).values_list('pk', flat=True)), lines)
+        self.assertEqual(set(Products.objects.values_list('quantity', flat=True)), {0})
+        self.assertIsInstance(Order.from_basket(user), Order)
+        self.assertIsNone(Order.from_basket(user))
+        self.assertEqual(OrderItem.objects.count(), 3)
+
+    # параллельные потоки требуют отдельных соединений с тестовой БД - тест выполняется на Postgres
+    @skipUnlessDBFeature('test_db_allows_multiple_connections')
+    def test_one_order(self):
+        category = ProductCategory.objects.create(name='Обувь', slug='shoes')
+        user = User.objects.create_user(username='user', password='123')
+        for i in range(10):
+            product = Products.objects.create(name=f'Товар {i}', slug=f'parallel-{i}', category=category, quantity=1)
+            Basket.objects.add(user.pk, product.pk)
+
+        barrier = threading.Barrier(4)
+        results = []
+
+        def checkout():
+            try:
+                barrier.wait()
+                results.append(Order.from_basket(user))
+            except Exception as error:
+                results.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.count(), 10)
+        self.assertEqual(len([result for result in results if isinstance(result, Order)]), 1)
+        self.assertFalse(Basket.objects.exists())
@@ -1,28 +1,92 @@
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.db import transaction
 from django.forms import inlineformset_factory
-from django.http import HttpResponseRedirect, JsonResponse
+from django.http import Http404, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render
 
 # Create your views here.
 from django.urls import reverse_lazy, reverse
-from django.views.generic import ListView, CreateView, DeleteView, UpdateView, DetailView
+from django.views.generic import ListView, CreateView, DeleteView, UpdateView, DetailView, View
 
-from adminapp.mixin import AuthorisationDispatchMixin
-from mainapp.models import Products
+from adminapp.mixin import AuthorisationDispatchMixin, SuperuserDispatchMixin
+from mainapp.cache_functions import get_product_prices
+from mainapp.search import search_products
+from mainapp.pagination import InvalidCursor, KeysetPaginator
 from ordersapp.forms import OrderItemForm
-from ordersapp.models import Order, OrderItem
+from ordersapp import outbox
+from ordersapp.models import InvalidTransition, Order, OrderItem
+from basketapp.backends import BasketBusy, get_basket_backend
 from basketapp.models import Basket
+from basketapp.views import BASKET_BUSY_MESSAGE
+
+
+PRODUCT_AUTOCOMPLETE_LIMIT = 10
+PRODUCT_PRICES_MAX_IDS = 100
+ORDERS_KEYSET_ORDERINGS = {
+    'created': ('-created_at', '-id'),
+}
+
+
+def checkout_basket(request):
+    """Переносит корзину в строки Basket и сообщает о товарах, которых не хватило на складе"""
+    try:
+        rejected = get_basket_backend(request).checkout()
+    except BasketBusy:
+        messages.error(request, BASKET_BUSY_MESSAGE)
+        return
+    if rejected:
+        messages.error(request, 'Части товаров нет в нужном количестве, они остались в корзине')
 
 
 class OrdersListView(ListView, AuthorisationDispatchMixin):
-    """Список заказов"""
+    """
+    Список активных заказов пользователя от новых к старым, с фильтром по статусу из URL.
+    Страницы переключаются курсорами по (created_at, id) - выборка идет по индексу
+    (user, is_active, created_at) без OFFSET и COUNT(*), итоги берутся из полей заказа
+    """
     template_name = 'ordersapp/orders_list.html'
     model = Order
     context_object_name = 'orders'
+    paginate_by = 20
+
+    def get_status(self):
+        status = self.kwargs.get('status')
+        if status is not None and status not in dict(Order.STATUSES):
+            raise Http404(f'Неизвестный статус: {status}')
+        return status
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        queryset = Order.objects.filter(user=self.request.user, is_active=True)
+        status = self.get_status()
+        if status:
+            queryset = queryset.filter(status=status)
+        return queryset
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size, 'created', ORDERS_KEYSET_ORDERINGS)
+        try:
+            page = paginator.page(self.kwargs.get('cursor'), values=None)
+        except InvalidCursor:
+            raise Http404('Неверный курсор')
+        return None, page, page.object_list, page.has_next() or page.has_previous()
+
+    def get_cursor_url(self, cursor):
+        if cursor is None:
+            return None
+        kwargs = {'cursor': cursor}
+        if self.kwargs.get('status'):
+            kwargs['status'] = self.kwargs['status']
+        return reverse('ordersapp:orders', kwargs=kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super(OrdersListView, self).get_context_data(**kwargs)
+        page = context['page_obj']
+        context['next_url'] = self.get_cursor_url(page.next_cursor)
+        context['prev_url'] = self.get_cursor_url(page.prev_cursor)
+        context['status'] = self.kwargs.get('status')
+        context['statuses'] = Order.STATUSES
+        return context
 
 
 class OrderCreateView(CreateView):
@@ -39,7 +103,8 @@ class OrderCreateView(CreateView):
         if self.request.POST:
             formset = OrderFormSet(self.request.POST)
         else:
-            basket_items = Basket.objects.filter(user=self.request.user).select_related('user')
+            checkout_basket(self.request)
+            basket_items = Basket.objects.filter(user=self.request.user).select_related('product')
             if len(basket_items):
                 OrderFormSet = inlineformset_factory(Order, OrderItem,
                                                      form=OrderItemForm, extra=len(basket_items))
@@ -66,7 +131,8 @@ class OrderCreateView(CreateView):
                 ordersitems.instance = self.object
                 ordersitems.save()
 
-        if self.object.total_cost() == 0:
+        self.object.refresh_totals()
+        if self.object.total_cost == 0:
             self.object.delete()
 
         return super(OrderCreateView, self).form_valid(form)
@@ -75,13 +141,8 @@ class OrderCreateView(CreateView):
 @login_required(login_url='/login')
 def make_order(request):
     """Функция для добавления заказа в список заказов при нажатии на кнопку 'Оформить'"""
-    baskets = Basket.objects.filter(user=request.user)
-    order = Order(user=request.user)
-    order.save()
-    for good in baskets:
-        OrderItem.objects.create(order=order, product=good.product, quantity=good.quantity)
-    baskets.delete(key='make_order')
-
+    checkout_basket(request)
+    Order.from_basket(request.user)
     return HttpResponseRedirect(reverse('ordersapp:orders'))
 
 
@@ -108,7 +169,7 @@ class OrderUpdateView(UpdateView):
             formset = OrderFormSet(instance=self.object)
             for num, form in enumerate(formset.forms):
                 if form.instance.pk:
-                    form.initial['price'] = form.instance.product.price
+                    form.initial['price'] = form.instance.unit_price
 
         data['orderitem'] = formset
         return data
@@ -121,7 +182,8 @@ class OrderUpdateView(UpdateView):
             if orderitems.is_valid():
                 orderitems.instance = self.object
                 orderitems.save()
-            if self.object.total_cost() == 0:
+            self.object.refresh_totals()
+            if self.object.total_cost == 0:
                 self.object.delete()
         return super(OrderUpdateView, self).form_valid(form)
 
@@ -139,14 +201,43 @@ class OrderReadView(DetailView):
 def order_forming_complete(request, pk):
     """Изменение статуса заказа на 'Отправлен в обработку' при нажатии на 'Совершить покупку' в заказе"""
     order = Order.objects.get(pk=pk)
-    order.status = Order.SENT_TO_PROCEED
-    order.save()
+    try:
+        order.change_status(Order.SENT_TO_PROCEED)
+    except InvalidTransition:
+        # повторное нажатие или заказ уже обрабатывается
+        pass
     return HttpResponseRedirect(reverse('ordersapp:orders'))
 
 
-def get_product_price(request, pk):
-    if request.is_ajax():
-        product = Products.objects.get(pk=pk)
-        if product:
-            return JsonResponse({'price': product.price})
-        return JsonResponse({'price': 0})
+def product_prices(request):
+    """
+    Цены и остатки товаров строк заказа одним запросом: ?ids=1,2,3.
+    Редактор заказа запрашивает их сразу для всех строк, а затем для каждого нового товара.
+    Остатки могут отставать до минуты (см. get_product_prices)
+    """
+    try:
+        product_ids = {int(product_id) for product_id in request.GET.get('ids', '').split(',') if product_id}
+    except ValueError:
+        return JsonResponse({'error': 'Неверный список товаров'}, status=400)
+    if len(product_ids) > PRODUCT_PRICES_MAX_IDS:
+        return JsonResponse({'error': f'Не больше {PRODUCT_PRICES_MAX_IDS} товаров за запрос'}, status=400)
+    return JsonResponse({
+        'prices': {product_id: {'price': str(item['price']), 'quantity': item['quantity']}
+                   for product_id, item in get_product_prices(product_ids).items()},
+    })
+
+
+def product_autocomplete(request):
+    """Автодополнение товара в форме заказа: ?q=запрос, ответ - id, название и цена найденных товаров"""
+    query = request.GET.get('q', '').strip()
+    items = search_products(query, PRODUCT_AUTOCOMPLETE_LIMIT) if query else []
+    return JsonResponse({
+        'items': [{'id': item['id'], 'name': item['name'], 'price': str(item['price'])} for item in items],
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+class OrderEventMetricsView(SuperuserDispatchMixin, View):
+    """Метрики очереди событий заказов в JSON: размер очереди, задержка, пропускная способность"""
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(outbox.get_metrics())
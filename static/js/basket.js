@@ -1,13 +1,72 @@
-window.onload = function () {
-    $('.basket_list').on('click', 'input[type="number"]', function () {
-        let t_href = event.target;
+// Изменения количества в корзине копятся и отправляются одним POST на /basket/batch/
+// после паузы в BASKET_DEBOUNCE мс; в ответ приходят только новые количества строк и итоги
+const BASKET_DEBOUNCE = 400;
 
+$(function () {
+    let pending = {};
+    let timer = null;
+    let inflight = false;
+
+    function getCookie(name) {
+        let match = document.cookie.match(new RegExp('(?:^|; )' + name + '=([^;]*)'));
+        return match ? decodeURIComponent(match[1]) : null;
+    }
+
+    function schedule() {
+        clearTimeout(timer);
+        timer = setTimeout(flush, BASKET_DEBOUNCE);
+    }
+
+    function flush() {
+        if (inflight || $.isEmptyObject(pending)) {
+            return;
+        }
+        let lines = pending;
+        pending = {};
+        inflight = true;
         $.ajax({
-            url: "/basket/edit/" + t_href.name + "/" + t_href.value + "/",
-            success: function (data) {
-                $('.basket_list').html(data.result);
-            },
+            url: '/basket/batch/',
+            method: 'POST',
+            contentType: 'application/json',
+            headers: {'X-CSRFToken': getCookie('csrftoken')},
+            data: JSON.stringify({lines: lines}),
+        }).always(function (xhr) {
+            let data = xhr.responseJSON || xhr;
+            if (data && data.lines) {
+                render(data);
+            }
+            if (data && data.error) {
+                alert(data.error);
+            }
+            inflight = false;
+            if (!$.isEmptyObject(pending)) {
+                schedule();
+            }
         });
-        event.preventDefault();
+    }
+
+    function render(data) {
+        $.each(data.lines, function (line, quantity) {
+            let card = $('[data-basket-line="' + line + '"]');
+            if (quantity > 0) {
+                card.find('input[type="number"]').val(quantity);
+            } else {
+                card.remove();
+            }
+        });
+        $('.basket_quantity').text(data.quantity);
+        $('.basket_total_cost').text(data.total_cost);
+        if (!data.count) {
+            $('.basket_list').empty();
+        }
+    }
+
+    $('.basket_list').on('change', 'input[type="number"]', function (event) {
+        let quantity = parseInt(event.target.value);
+        if (isNaN(quantity) || quantity < 0) {
+            return;
+        }
+        pending[event.target.name] = quantity;
+        schedule();
     });
-}
\ No newline at end of file
+});
@@ -1,16 +1,4 @@
 window.onload = function () {
-    $('.basket_list').on('click', 'input[type="number"]', function () {
-        let t_href = event.target;
-
-        $.ajax({
-            url: "/basket/edit/" + t_href.name + "/" + t_href.value + "/",
-            success: function (data) {
-                $('.basket_list').html(data.result);
-            },
-        });
-        event.preventDefault();
-    });
-
     let total_price = parseFloat($('.order_total_cost').text().replace(',', '.'));
     let total_forms = $('input[name=orderitem-TOTAL_FORMS]').val() || 0;
     let total_quantity = parseInt($('.order_total_quantity').text()) || 0;
@@ -62,6 +50,34 @@ window.onload = function () {
 
     })
 
+    // товар выбирается из автодополнения: в select есть только выбранный товар и найденные по запросу
+    const PRODUCT_SEARCH_DEBOUNCE = 300;
+    let product_search_timer;
+
+    $('.order_form select[data-autocomplete]').each(function () {
+        $('<input type="search" class="form-control product_search" placeholder="поиск товара">').insertBefore(this);
+    });
+
+    $('.order_form').on('input', '.product_search', function () {
+        let input = $(this);
+        let select = input.siblings('select[data-autocomplete]');
+        clearTimeout(product_search_timer);
+        product_search_timer = setTimeout(function () {
+            let query = input.val().trim();
+            if (!query) {
+                return;
+            }
+            $.getJSON(select.data('autocomplete'), {q: query}, function (data) {
+                select.find('option').not(':selected').not('[value=""]').remove();
+                data.items.forEach(function (item) {
+                    if (String(item.id) !== select.val()) {
+                        $('<option>').val(item.id).text(item.name + ' - ' + item.price + ' руб').appendTo(select);
+                    }
+                });
+            });
+        }, PRODUCT_SEARCH_DEBOUNCE);
+    });
+
     $('.formset_row').formset({
         addText: 'добавить',
         deleteText: 'удалить',
@@ -79,28 +95,55 @@ window.onload = function () {
         };
     }
 
-    $('.order_form select').change(function () {
+    // цены и остатки товаров строк: все выбранные товары загружаются одним запросом при открытии формы,
+    // новые товары - при выборе
+    let product_prices = {};
+    let product_selects = $('.order_form select[data-prices]');
+
+    function loadPrices(product_ids, callback) {
+        $.getJSON(product_selects.data('prices'), {ids: product_ids.join(',')}, function (data) {
+            $.extend(product_prices, data.prices);
+            if (callback) {
+                callback();
+            }
+        });
+    }
+
+    let row_product_ids = product_selects.map(function () {
+        return $(this).val();
+    }).get().filter(Boolean);
+    if (row_product_ids.length) {
+        loadPrices(row_product_ids);
+    }
+
+    function setRowPrice(orderitem_num, price) {
+        price_arr[orderitem_num] = parseFloat(price);
+        if (isNaN(quantity_arr[orderitem_num])) {
+            quantity_arr[orderitem_num] = 0;
+        }
+        var price_html = '<span class="orderitems-' + orderitem_num + '-price">' + price.toString().replace('.', ',') + '</span> руб';
+        var current_tr = $('.order_form table').find('tr:eq(' + (orderitem_num + 1) + ')');
+        current_tr.find('td:eq(2)').html(price_html);
+        if (isNaN(current_tr.find('input[type="number"]').val())) {
+            current_tr.find('input[type="number"]').val(0);
+        }
+        orderSummaryRecalc();
+    }
+
+    $('.order_form').on('change', 'select', function (event) {
         var target = event.target;
-        orderitem_num = parseInt(target.name.replace('orderitem-', '').replace('-product', ''));
+        var row_num = parseInt(target.name.replace('orderitem-', '').replace('-product', ''));
         var orderitem_product_pk = target.options[target.selectedIndex].value;
-        if (orderitem_product_pk) {
-            $.ajax({
-                url: '/product/' + orderitem_product_pk + '/',
-                success: function (data) {
-                    if (data.price) {
-                        price_arr[orderitem_num] = parseFloat(data.price);
-                        if (isNaN(quantity_arr[orderitem_num])) {
-                            quantity_arr[orderitem_num] = 0;
-                        }
-                        var price_html = '<span class="orderitems-' + orderitem_num + '-price">' + data.price.toString().replace('.', ',') + '</span> руб';
-                        var current_tr = $('.order_form table').find('tr:eq(' + (orderitem_num + 1) + ')');
-                        current_tr.find('td:eq(2)').html(price_html);
-                        if (isNaN(current_tr.find('input[type="number"]').val())) {
-                            current_tr.find('input[type="number"]').val(0);
-                        }
-                        orderSummaryRecalc();
-                    }
-                },
+        if (!orderitem_product_pk) {
+            return;
+        }
+        if (product_prices[orderitem_product_pk]) {
+            setRowPrice(row_num, product_prices[orderitem_product_pk].price);
+        } else {
+            loadPrices([orderitem_product_pk], function () {
+                if (product_prices[orderitem_product_pk]) {
+                    setRowPrice(row_num, product_prices[orderitem_product_pk].price);
+                }
             });
         }
     });